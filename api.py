@@ -0,0 +1,302 @@
+"""
+This python script is the read only json API of the weather. The responses carry a strong ETag
+derived from the openweather dt and a Cache-Control max-age of the time the cached weather stays
+fresh, so browsers and edge caches can reuse them and revalidate them with If-None-Match. The
+stream route pushes the changes of the weather of some locations as server-sent events.
+"""
+import gzip
+import hashlib
+import os
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from flask import Blueprint, Response, abort, jsonify, request, stream_with_context
+from werkzeug.exceptions import HTTPException
+
+from openweathermap import weather
+from openweathermap.broker import Event, get_default_broker
+from openweathermap.cache.lru import LRUCache
+from openweathermap.cache.response import CURRENT, FORECAST
+from openweathermap.datasets.current_weather import CurrentWeatherData
+from openweathermap.datasets.encoders import encode_json
+from openweathermap.datasets.forecast import Forecast
+from openweathermap.datasets.location import Location
+from openweathermap.datasets.units import CANONICAL_UNITS, UNITS
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+# Bodies smaller than this are not worth compressing.
+MIN_COMPRESS_SIZE = 256
+_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+# The encoded bodies by ETag, so a popular location is serialized and compressed once.
+_bodies = LRUCache(1024)
+
+# The most locations of one stream and the seconds between two keep-alive comments.
+MAX_STREAM_LOCATIONS = int(os.getenv("OWM_STREAM_MAX_LOCATIONS", "10"))
+STREAM_HEARTBEAT = float(os.getenv("OWM_STREAM_HEARTBEAT", "15"))
+
+
+def _coordinate(name: str, low: float, high: float) -> float:
+    """
+    :param name      :      The name of the query argument, lat or lon.
+    :param low       :      The lowest valid value.
+    :param high      :      The highest valid value.
+
+    :return:                The coordinate. The request is aborted when it is not valid.
+    """
+    value = request.args.get(name, type=float)
+    if value is None or not low <= value <= high:
+        abort(400, description=f"{name} must be a number between {low} and {high}")
+    return value
+
+
+def _units() -> str | None:
+    """
+    :return:       The units query argument, or None for the UNITS_OF_MEASURE setting. The
+                   request is aborted when it is not valid.
+    """
+    units = request.args.get("units")
+    if units is not None and units not in UNITS:
+        abort(400, description=f"units must be one of {', '.join(UNITS)}")
+    return units or weather.units_of_measure
+
+
+def _location() -> Location:
+    """
+    :return:       The Location of the lat and lon or of the city, state and country query
+                   arguments. The coordinates are snapped to the nearest known location.
+    """
+    if "lat" in request.args or "lon" in request.args:
+        lat, lon = _coordinate("lat", -90, 90), _coordinate("lon", -180, 180)
+        return weather.spatial_index.snap(lat, lon, weather.snap_radius_km) \
+            or Location(lat=lat, lon=lon)
+    city = request.args.get("city", "").strip()
+    if not city:
+        abort(400, description="city or lat and lon are required")
+    location = weather.get_lan_lon(city, request.args.get("state", ""),
+                                   request.args.get("country", ""))
+    if location is None:
+        abort(502, description="the location could not be looked up")
+    if location.lat is None or location.lon is None:
+        abort(404, description="the location was not found")
+    return location
+
+
+def _etag(kind: str, location: Location, data: CurrentWeatherData | Forecast,
+          units: str | None) -> str:
+    """
+    :param kind          :      The kind of response, current or forecast.
+    :param location      :      The Location of the response.
+    :param data          :      The CurrentWeatherData or Forecast.
+    :param units         :      The units of measure of the response.
+
+    :return:                    The ETag, without quotes. It only changes when openweather
+                                publishes a new observation or forecast (a new dt).
+    """
+    if kind == CURRENT:
+        updated = (data.dt,)
+    else:
+        rows = data.list_obj or []
+        updated = (rows[0].dt, rows[-1].dt, len(rows)) if rows else ()
+    key = repr((kind, units, location.name, location.state, location.country,
+                location.lat, location.lon, updated))
+    return hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+
+
+def _max_age(kind: str, location: Location) -> int:
+    """
+    :param kind          :      The kind of response, current or forecast.
+    :param location      :      The Location of the response.
+
+    :return:                    The seconds until the cached weather stops being fresh.
+    """
+    key = weather.weather_cache.make_key(kind, location.lat, location.lon, CANONICAL_UNITS)
+    entry = weather.weather_cache.get(key)
+    return max(0, int(entry[1] - time.time())) if entry is not None else 0
+
+
+def _encoding() -> Optional[str]:
+    """
+    :return:       The best compression the client accepts or None.
+    """
+    return request.accept_encodings.best_match(_ENCODINGS)
+
+
+def _body(etag: str, encoding: Optional[str], location: Location, kind: str,
+          data: CurrentWeatherData | Forecast, max_age: int) -> Tuple[bytes, Optional[str]]:
+    """
+    :param etag          :      The ETag of the response.
+    :param encoding      :      The compression the client accepts, br or gzip, or None.
+    :param location      :      The Location of the response.
+    :param kind          :      The kind of response, current or forecast.
+    :param data          :      The CurrentWeatherData or Forecast.
+    :param max_age       :      The seconds the body stays fresh.
+
+    :return:                    Tuple of the body and its compression. Small bodies are not
+                                compressed. The body is reused while it is fresh.
+    """
+    now = time.time()
+    entry = _bodies.get((etag, encoding), now)
+    if entry is not None:
+        return entry[0]
+    body = encode_json({"location": location, kind: data})
+    # The body is cached under the compression asked for, so a small body is found again.
+    chosen = encoding
+    if len(body) < MIN_COMPRESS_SIZE:
+        chosen = None
+    elif encoding == "br":
+        body = brotli.compress(body, quality=5)
+    elif encoding == "gzip":
+        body = gzip.compress(body, compresslevel=6, mtime=0)
+    _bodies.put((etag, encoding), (body, chosen), now + max(max_age, 1))
+    return body, chosen
+
+
+def _weather_response(kind: str) -> Response:
+    """
+    :param kind      :      The kind of response, current or forecast.
+
+    :return:                The json response or an empty 304 response when the client already
+                            has it.
+    """
+    units = _units()
+    location = _location()
+    if kind == CURRENT:
+        data = weather.get_current_weather(location.lat, location.lon, units=units)
+    else:
+        data = weather.get_forcast(location.lat, location.lon, units=units)
+    if not weather.is_successful(data):
+        abort(502, description=f"the {kind} weather could not be fetched")
+
+    etag = _etag(kind, location, data, units)
+    max_age = _max_age(kind, location)
+    # The compressed bodies are different bytes so they have their own strong ETag.
+    variants = [etag] + [f"{etag}-{name}" for name in _ENCODINGS]
+    matched = next((tag for tag in variants if request.if_none_match.contains_weak(tag)), None)
+    if matched is not None:
+        response = Response(status=304)
+        response.set_etag(matched)
+    else:
+        body, encoding = _body(etag, _encoding(), location, kind, data, max_age)
+        response = Response(body, mimetype="application/json")
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+    response.headers["Cache-Control"] = f"public, max-age={max_age}"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+@api.route("/current")
+def current() -> Response:
+    """
+    Query arguments: city, state and country, or lat and lon, and optionally units.
+
+    :return:     The Location and CurrentWeatherData as json.
+    """
+    return _weather_response(CURRENT)
+
+
+@api.route("/forecast")
+def forecast() -> Response:
+    """
+    Query arguments: city, state and country, or lat and lon, and optionally units.
+
+    :return:     The Location and Forecast as json.
+    """
+    return _weather_response(FORECAST)
+
+
+def _locations() -> List[Tuple[float, float]]:
+    """
+    :return:       The latitude and longitude of each at=lat,lon query argument, or of the
+                   location of the other query arguments. The request is aborted when they are
+                   not valid.
+    """
+    values = request.args.getlist("at")
+    if not values:
+        location = _location()
+        return [(location.lat, location.lon)]
+    if len(values) > MAX_STREAM_LOCATIONS:
+        abort(400, description=f"at most {MAX_STREAM_LOCATIONS} locations can be streamed")
+    locations = []
+    for value in values:
+        try:
+            lat, lon = (float(part) for part in value.split(","))
+        except ValueError:
+            abort(400, description="at must be lat,lon")
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            abort(400, description="at must be a valid lat,lon")
+        location = weather.spatial_index.snap(lat, lon, weather.snap_radius_km)
+        locations.append((location.lat, location.lon) if location is not None else (lat, lon))
+    return locations
+
+
+def _kinds() -> Tuple[str, ...]:
+    """
+    :return:       The kinds of the kind query argument, current and forecast by default. The
+                   request is aborted when they are not valid.
+    """
+    kinds = tuple(request.args.get("kind", f"{CURRENT},{FORECAST}").split(","))
+    if not kinds or any(kind not in (CURRENT, FORECAST) for kind in kinds):
+        abort(400, description=f"kind must be {CURRENT}, {FORECAST} or both")
+    return kinds
+
+
+def _sse(event: Event) -> str:
+    """
+    :param event      :      The event.
+
+    :return:                 The event in the server-sent events format.
+    """
+    return f"event: {event.type}\ndata: {encode_json(event).decode()}\n\n"
+
+
+@api.route("/stream")
+def stream() -> Response:
+    """
+    Query arguments: at=lat,lon once per location, or city, state and country, or lat and lon,
+    and optionally kind=current,forecast and units.
+
+    :return:     The server-sent events stream. A snapshot event is sent for each location
+                 and kind, then an update event with only the fields that changed each time
+                 the weather is refreshed.
+    """
+    units = _units()
+    locations = _locations()
+    kinds = _kinds()
+    broker = get_default_broker()
+    subscription = broker.subscribe(locations, kinds, units)
+
+    def events() -> Iterator[str]:
+        try:
+            yield f"retry: {int(STREAM_HEARTBEAT * 1000)}\n\n"
+            while not subscription.closed:
+                event = subscription.next(STREAM_HEARTBEAT)
+                # A comment keeps the proxies from closing an idle connection.
+                yield _sse(event) if event is not None else ": keep-alive\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = Response(stream_with_context(events()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-store"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+@api.errorhandler(HTTPException)
+def error(e: HTTPException) -> Tuple[Response, int]:
+    """
+    :param e      :      The http error.
+
+    :return:             The error as json. Errors are not cached.
+    """
+    response = jsonify({"code": e.code, "error": e.description})
+    response.headers["Cache-Control"] = "no-store"
+    return response, e.code
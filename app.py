@@ -1,18 +1,95 @@
 """
 This python script is main script.
 """
+import functools
+import inspect
+import logging
 from typing import Type
 
-from flask import Flask, render_template, request
+from flask import Flask, Response, render_template, request
 
+from api import api
+from openweathermap import async_weather
+from openweathermap.datasets.units import UNITS
 from openweathermap.weather import (main as get_weather, Location, CurrentWeatherData, Forecast,
-                                    Formats)
+                                    Formats, units_of_measure)
+from openweathermap.metrics import REGISTRY, RENDER_SECONDS
+from openweathermap.prefetch import start_default_prefetcher
 from utils.get_class_name import get_full_class_name
+from utils.log_config import configure_logging
+from utils.tracing import get_default_tracer, span
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.register_blueprint(api)
+# Keeps the weather of the watched locations warm when OWM_PREFETCH_WATCHLIST or
+# OWM_PREFETCH_LEARN_TOP is set.
+start_default_prefetcher()
+
+
+def render_home(**context) -> str:
+    """
+    :param context      :      The template variables.
+
+    :return:                   The rendered home.html template. The units field keeps the units
+                               of measure posted with the form.
+    """
+    context.setdefault("units", form_units() or units_of_measure)
+    context.setdefault("units_options", UNITS)
+    with RENDER_SECONDS.time(template="home.html"), span("render", template="home.html"):
+        return render_template("home.html", **context)
+
+
+def trace_request(name: str):
+    """
+    :param name      :      The name of the route.
+
+    :return:                The context of the trace of the request used by the with statement.
+                            The request is traced or profiled when it is sampled, or when it
+                            asks to with the X-OWM-Trace or X-OWM-Profile header and
+                            OWM_TRACE_HEADERS is set.
+    """
+    tracer = get_default_tracer()
+    return tracer.start(name,
+                        trace=tracer.allow_headers and request.headers.get("X-OWM-Trace") == "1",
+                        profile=(tracer.allow_headers
+                                 and request.headers.get("X-OWM-Profile") == "1"),
+                        method=request.method)
+
+
+def traced(view):
+    """
+    :param view      :      The view function, plain or async.
+
+    :return:                The view running in the trace of its request, see trace_request.
+    """
+    if inspect.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def traced_async_view(*args, **kwargs):
+            with trace_request(view.__name__):
+                return await view(*args, **kwargs)
+        return traced_async_view
+
+    @functools.wraps(view)
+    def traced_view(*args, **kwargs):
+        with trace_request(view.__name__):
+            return view(*args, **kwargs)
+    return traced_view
+
+
+def form_units() -> str | None:
+    """
+    :return:       The units of measure posted with the form, or None for the UNITS_OF_MEASURE
+                   setting.
+    """
+    units = request.form.get('units')
+    return units if units in UNITS else None
 
 
 @app.route('/', methods=['GET', 'POST'])
+@traced
 def home():
     """
 
@@ -24,20 +101,57 @@ def home():
     formats_data: Type[Formats] | None = None
     try:
         if request.method == 'GET':
-            print(request.form)
+            logger.debug("home: form=%s", request.form)
         elif request.method == 'POST':
             city = request.form['cityName']
             state = request.form['stateName']
             country = request.form['countryName']
             location_data, current_weather_data, forecast_data, formats_data = (
-                get_weather(city, state, country))
+                get_weather(city, state, country, units=form_units()))
     except (IndexError, ValueError, TypeError, KeyError) as e:
-        print(f"{get_full_class_name(e)}: {e.args}")
-    return render_template("home.html",
-                           location_data=location_data,
-                           current_weather_data=current_weather_data,
-                           forecast_data=forecast_data,
-                           formats_data=formats_data)
+        logger.warning("%s: %s", get_full_class_name(e), e.args)
+    return render_home(location_data=location_data,
+                       current_weather_data=current_weather_data,
+                       forecast_data=forecast_data,
+                       formats_data=formats_data)
+
+
+@app.route('/async', methods=['GET', 'POST'])
+@traced
+async def home_async():
+    """
+    Same as home but the weather is fetched with the non-blocking client, so the worker is not
+    tied up while the openweather API requests are in flight.
+
+    :return:     render_template
+    """
+    location_data: Type[Location] | None = None
+    current_weather_data: Type[CurrentWeatherData] | None = None
+    forecast_data: Type[Forecast] | None = None
+    formats_data: Type[Formats] | None = None
+    try:
+        if request.method == 'POST':
+            city = request.form['cityName']
+            state = request.form['stateName']
+            country = request.form['countryName']
+            location_data, current_weather_data, forecast_data, formats_data = (
+                await async_weather.run(async_weather.main(city, state, country,
+                                                           units=form_units())))
+    except (IndexError, ValueError, TypeError, KeyError) as e:
+        logger.warning("%s: %s", get_full_class_name(e), e.args)
+    return render_home(location_data=location_data,
+                       current_weather_data=current_weather_data,
+                       forecast_data=forecast_data,
+                       formats_data=formats_data)
+
+
+@app.route('/metrics')
+def metrics():
+    """
+
+    :return:     The metrics in the Prometheus text format.
+    """
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == '__main__':
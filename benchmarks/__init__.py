@@ -0,0 +1,19 @@
+"""
+This python package is for the offline benchmarks of the openweathermap package. The recorded
+API payloads are in the payloads directory.
+"""
+import json
+import os
+from typing import Any
+
+PAYLOADS_DIR = os.path.join(os.path.dirname(__file__), "payloads")
+
+
+def load_payload(name: str) -> Any:
+    """
+    :param name      :      The name of the recorded payload without the .json extension.
+
+    :return:                The decoded payload.
+    """
+    with open(os.path.join(PAYLOADS_DIR, f"{name}.json"), encoding="utf-8") as payload_file:
+        return json.load(payload_file)
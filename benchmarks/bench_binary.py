@@ -0,0 +1,59 @@
+"""
+This python script compares the size and the encode and decode throughput of the binary encoding
+with the json body decoded by the compiled decoders and with pickle. The round trips are tested
+by tests/test_binary.py.
+
+    python -m benchmarks.bench_binary [--seconds 1.0]
+"""
+import argparse
+import json
+import pickle
+from typing import Any, Dict
+
+from benchmarks import load_payload
+from benchmarks.bench_decode import throughput
+from openweathermap.datasets.binary import decode_binary, encode_binary
+from openweathermap.datasets.decoders import (decode_current_weather, decode_forecast,
+                                              decode_json)
+from openweathermap.datasets.encoders import encode_json
+
+
+def main(argv: list[str] | None = None) -> Dict[str, Any]:
+    """
+    :param argv      :      The command line arguments.
+
+    :return:                The size and throughput of each format.
+    """
+    parser = argparse.ArgumentParser(
+        description="Compare the binary encoding with json and pickle.")
+    parser.add_argument("--seconds", type=float, default=1.0, help="seconds per measurement")
+    parser.add_argument("--units", default="standard", help="units of measure")
+    args = parser.parse_args(argv)
+    units = args.units
+
+    results: Dict[str, Any] = {}
+    bodies = {"current_weather": json.dumps(load_payload("current")).encode(),
+              "forecast": json.dumps(load_payload("forecast")).encode()}
+    decoders = {"current_weather": lambda body: decode_current_weather(decode_json(body), units),
+                "forecast": lambda body: decode_forecast(decode_json(body), units)}
+    for name, decode_api in decoders.items():
+        obj = decode_api(bodies[name])
+        formats = {
+            # The raw API body, as it is stored today, decoded by the compiled decoders. The
+            # dataclasses are written back to json with encode_json.
+            "json": (encode_json, decode_api, bodies[name]),
+            "pickle": (lambda o: pickle.dumps(o, pickle.HIGHEST_PROTOCOL), pickle.loads,
+                       pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)),
+            "binary": (encode_binary, decode_binary, encode_binary(obj)),
+        }
+        results[name] = {
+            label: {"bytes": len(body),
+                    "encode_per_s": round(throughput(lambda: encode(obj), args.seconds)),
+                    "decode_per_s": round(throughput(lambda: decode(body), args.seconds))}
+            for label, (encode, decode, body) in formats.items()}
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+This python script compares the parse throughput of the from_dict parsers with the compiled
+decoders, starting from the raw json body as it is served from a cache. The forecast_lazy case
+compares the compiled forecast decoder with the lazy one when only the first rows are used.
+
+    python -m benchmarks.bench_decode [--seconds 1.0]
+"""
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict
+
+from benchmarks import load_payload
+from openweathermap.datasets.current_weather import CurrentWeatherData
+from openweathermap.datasets.decoders import (decode_current_weather, decode_forecast,
+                                              decode_json, decode_location)
+from openweathermap.datasets.forecast import Forecast
+from openweathermap.datasets.location import Location
+
+
+def throughput(parse: Callable[[], Any], seconds: float) -> float:
+    """
+    :param parse        :      The function parsing one payload.
+    :param seconds      :      The number of seconds to run for.
+
+    :return:                   The number of payloads parsed per second.
+    """
+    count = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        for _ in range(50):
+            parse()
+        count += 50
+    return count / (time.perf_counter() - start)
+
+
+def _first_rows(forecast: Forecast, count: int = 3) -> Forecast:
+    """
+    :param forecast      :      The Forecast.
+    :param count         :      The number of rows to use, e.g. the next hours on the dashboard.
+
+    :return:                    The Forecast after its first rows were used.
+    """
+    forecast.list_obj[:count]
+    return forecast
+
+
+def main(argv: list[str] | None = None) -> Dict[str, Dict[str, float]]:
+    """
+    :param argv      :      The command line arguments.
+
+    :return:                The parses per second of each payload and parser.
+    """
+    parser = argparse.ArgumentParser(description="Compare from_dict with the compiled decoders.")
+    parser.add_argument("--seconds", type=float, default=1.0, help="seconds per measurement")
+    parser.add_argument("--units", default="imperial", help="units of measure")
+    args = parser.parse_args(argv)
+    units = args.units
+
+    bodies = {name: json.dumps(load_payload(name)).encode()
+              for name in ("geo", "current", "forecast")}
+    cases = {
+        "location": (lambda: Location.from_dict(json.loads(bodies["geo"])[0]),
+                     lambda: decode_location(decode_json(bodies["geo"])[0])),
+        "current_weather": (lambda: CurrentWeatherData.from_dict(json.loads(bodies["current"]),
+                                                                 units),
+                            lambda: decode_current_weather(decode_json(bodies["current"]),
+                                                           units)),
+        "forecast": (lambda: Forecast.from_dict(json.loads(bodies["forecast"]), units),
+                     lambda: decode_forecast(decode_json(bodies["forecast"]), units)),
+        "forecast_lazy": (lambda: _first_rows(decode_forecast(decode_json(bodies["forecast"]),
+                                                              units)),
+                          lambda: _first_rows(decode_forecast(decode_json(bodies["forecast"]),
+                                                              units, lazy=True))),
+    }
+    results = {}
+    for name, (from_dict, decoder) in cases.items():
+        if from_dict() != decoder():
+            raise AssertionError(f"the compiled decoder of {name} differs from from_dict")
+        results[name] = {"from_dict_per_s": round(throughput(from_dict, args.seconds)),
+                         "decoder_per_s": round(throughput(decoder, args.seconds))}
+        results[name]["speedup"] = round(results[name]["decoder_per_s"]
+                                         / results[name]["from_dict_per_s"], 2)
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+This python script compares resolving a city with the offline geocoding index with a call to
+the geocoding API of the local stub server. The index is built from the recorded city list.
+
+    python -m benchmarks.bench_geocode [--count 1000] [--latency 0.02]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Dict
+
+from benchmarks import PAYLOADS_DIR
+from benchmarks.stub_server import StubServer
+from openweathermap.client import WeatherClient
+from openweathermap.geocode_index import GeocodeIndex, build_index, iter_city_list
+
+
+def main(argv: list[str] | None = None) -> Dict[str, float]:
+    """
+    :param argv      :      The command line arguments.
+
+    :return:                The microseconds per lookup of the index and of the API.
+    """
+    parser = argparse.ArgumentParser(description="Compare the geocoding index with the API.")
+    parser.add_argument("--count", type=int, default=1000, help="lookups per case")
+    parser.add_argument("--latency", type=float, default=0.02, help="stub seconds per request")
+    args = parser.parse_args(argv)
+
+    city_list = os.path.join(PAYLOADS_DIR, "city.list.json.gz")
+    with tempfile.TemporaryDirectory() as index_dir, StubServer(latency=args.latency) as stub:
+        index_path = os.path.join(index_dir, "cities.sqlite3")
+        build_index(iter_city_list(city_list), index_path)
+        index = GeocodeIndex(index_path)
+        if index.resolve("Atlanta", "GA", "US") is None:
+            raise AssertionError("Atlanta is missing from the geocoding index")
+
+        start = time.perf_counter()
+        for _ in range(args.count):
+            index.resolve("Atlanta", "GA", "US")
+        index_us = (time.perf_counter() - start) / args.count * 1e6
+
+        client = WeatherClient(base_url=stub.base_url)
+        api_count = max(1, args.count // 100)
+        start = time.perf_counter()
+        for _ in range(api_count):
+            client.get(f"{stub.base_url}/geo/1.0/direct?q=Atlanta,GA,US&limit=1",
+                       "geocode").json()
+        api_us = (time.perf_counter() - start) / api_count * 1e6
+        client.close()
+
+    results = {"index_us": round(index_us, 1), "api_us": round(api_us, 1),
+               "speedup": round(api_us / index_us, 1)}
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == '__main__':
+    main()
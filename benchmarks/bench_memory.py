@@ -0,0 +1,61 @@
+"""
+This python script measures the memory used by the cached Forecast and Location objects.
+
+    python -m benchmarks.bench_memory [--count 1000]
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+from typing import Any, Callable, Dict
+
+from benchmarks import load_payload
+from openweathermap.datasets.forecast import Forecast
+from openweathermap.datasets.frozen import freeze
+from openweathermap.datasets.location import Location
+
+
+def bytes_per_object(build: Callable[[], Any], count: int) -> float:
+    """
+    :param build      :      The function building one object.
+    :param count      :      The number of objects to build and keep alive.
+
+    :return:                 The average number of bytes allocated per object.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build() for _ in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / count
+
+
+def main(argv: list[str] | None = None) -> Dict[str, float]:
+    """
+    :param argv      :      The command line arguments.
+
+    :return:                The bytes per object of each case.
+    """
+    parser = argparse.ArgumentParser(description="Measure the bytes per cached object.")
+    parser.add_argument("--count", type=int, default=1000, help="number of objects to build")
+    args = parser.parse_args(argv)
+
+    forecast_payload = load_payload("forecast")
+    location_payload = load_payload("geo")[0]
+    results = {
+        "forecast": bytes_per_object(lambda: Forecast.from_dict(forecast_payload, "imperial"),
+                                     args.count),
+        "forecast_frozen": bytes_per_object(
+            lambda: freeze(Forecast.from_dict(forecast_payload, "imperial")), args.count),
+        "location": bytes_per_object(lambda: Location.from_dict(location_payload), args.count),
+        "location_frozen": bytes_per_object(lambda: freeze(Location.from_dict(location_payload)),
+                                            args.count),
+    }
+    print(json.dumps({name: round(value) for name, value in results.items()}, indent=2))
+    return results
+
+
+if __name__ == '__main__':
+    main()
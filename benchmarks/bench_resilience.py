@@ -0,0 +1,82 @@
+"""
+This python script measures the upstream latency of the current weather against a stub of the
+openweather API that answers some requests slowly or with an error, without and with the
+retries and hedged requests, and how fast the calls fail once the upstream is down.
+
+    python -m benchmarks.bench_resilience [--count 600] [--slow-rate 0.05] [--error-rate 0.05]
+"""
+import argparse
+import json
+import time
+from typing import Dict, List
+
+import requests
+
+from benchmarks.run import summarize
+from benchmarks.stub_server import StubServer
+from openweathermap.client import WeatherClient
+from openweathermap.resilience import Resilience
+
+
+def _latencies(client: WeatherClient, url: str, count: int) -> Dict[str, float]:
+    """
+    :param client      :      The client to measure.
+    :param url         :      The current weather url of the stub.
+    :param count       :      The number of requests.
+
+    :return:                  The latency summary and the share of failed calls.
+    """
+    seconds: List[float] = []
+    failures = 0
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            if client.get(url, "current_weather").status_code != 200:
+                failures += 1
+        except requests.RequestException:
+            failures += 1
+        seconds.append(time.perf_counter() - start)
+    return {**summarize(seconds), "failed": round(failures / count, 3)}
+
+
+def main(argv: list[str] | None = None) -> Dict[str, Dict[str, float]]:
+    """
+    :param argv      :      The command line arguments.
+
+    :return:                The latencies of each case.
+    """
+    parser = argparse.ArgumentParser(description="Measure the retries, hedging and circuits.")
+    parser.add_argument("--count", type=int, default=600, help="requests per case")
+    parser.add_argument("--latency", type=float, default=0.01, help="stub seconds per request")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="fraction of slow requests")
+    parser.add_argument("--slow-latency", type=float, default=0.5, help="seconds per slow request")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="fraction of 500 errors")
+    args = parser.parse_args(argv)
+
+    cases = {"plain": Resilience(attempts=1),
+             "retries": Resilience(attempts=3, base_delay=0.01),
+             "retries_hedged": Resilience(attempts=3, base_delay=0.01, hedge_percentile=90)}
+    results = {}
+    with StubServer(latency=args.latency, error_rate=args.error_rate, seed=1,
+                    slow_rate=args.slow_rate, slow_latency=args.slow_latency) as stub:
+        url = f"{stub.base_url}/data/2.5/weather?lat=33.749&lon=-84.388"
+        for name, resilience in cases.items():
+            client = WeatherClient(base_url=stub.base_url, resilience=resilience)
+            # Fill the latency window the hedging delay is taken from.
+            _latencies(client, url, 100)
+            results[name] = _latencies(client, url, args.count)
+            client.close()
+        port = stub.server_address[1]
+
+    # The stub is stopped, so every request fails until the circuit opens.
+    resilience = Resilience(attempts=3, base_delay=0.01, failure_threshold=5)
+    client = WeatherClient(resilience=resilience)
+    results["outage"] = _latencies(client, f"http://127.0.0.1:{port}/data/2.5/weather?", 100)
+    results["outage"]["circuit"] = resilience.breaker("current_weather").state
+    client.close()
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+This python script measures the weather cache hit rate and the upstream requests when the same
+lookups are spread over 1 to many worker processes, with only the in-memory tier and with the
+shared SQLite tier, against a stub of the openweather API.
+
+    python -m benchmarks.bench_shared_cache [--workers 1 8 32] [--locations 50] [--lookups 400]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+from typing import Dict, List, Tuple
+
+from benchmarks.stub_server import StubServer
+
+
+def _worker(base_url: str, path: str, locations: List[Tuple[float, float]], lookups: int,
+            seed: int) -> Dict[str, int]:
+    """
+    :param base_url       :      The base url of the stub.
+    :param path           :      The SQLite file of the shared tier or "" for none.
+    :param locations      :      The coordinates looked up.
+    :param lookups        :      The number of lookups of the worker.
+    :param seed           :      The seed of the lookup order.
+
+    :return:                     The cache counts of the worker.
+    """
+    os.environ.update(OWM_BASE_URL=base_url, API_KEY="bench", OWM_WEATHER_CACHE_PATH=path,
+                      OWM_RETRY_ATTEMPTS="1")
+    # pylint: disable=import-outside-toplevel
+    from openweathermap import weather
+
+    rng = random.Random(seed)
+    for _ in range(lookups):
+        lat, lon = rng.choice(locations)
+        weather.get_current_weather(lat, lon)
+    cache = weather.weather_cache
+    return {"hits": cache.hits, "stale": cache.stale_hits, "misses": cache.misses,
+            "shared_hits": cache.shared_hits}
+
+
+def run_case(workers: int, shared: bool, locations: int, lookups: int) -> Dict[str, float]:
+    """
+    :param workers        :      The number of worker processes.
+    :param shared         :      Use the shared SQLite tier.
+    :param locations      :      The number of different locations.
+    :param lookups        :      The total number of lookups, split over the workers.
+
+    :return:                     The hit rate and the upstream requests of the case.
+    """
+    coords = [(round(30 + i * 0.1, 2), round(-90 + i * 0.1, 2)) for i in range(locations)]
+    directory = tempfile.mkdtemp(prefix="owm-bench-")
+    path = os.path.join(directory, "weather.sqlite3") if shared else ""
+    try:
+        with StubServer() as stub:
+            # Forked workers would share the parent's connections, so they are spawned.
+            with multiprocessing.get_context("spawn").Pool(workers) as pool:
+                counts = pool.starmap(_worker, [(stub.base_url, path, coords,
+                                                 lookups // workers, seed)
+                                                for seed in range(workers)])
+            upstream = stub.requests.get("/data/2.5/weather", 0)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    hits = sum(count["hits"] for count in counts)
+    total = hits + sum(count["stale"] + count["misses"] for count in counts)
+    return {"hit_rate": round(hits / total, 3), "upstream_requests": upstream,
+            "shared_hits": sum(count["shared_hits"] for count in counts)}
+
+
+def main(argv: list[str] | None = None) -> Dict[str, Dict[str, float]]:
+    """
+    :param argv      :      The command line arguments.
+
+    :return:                The results of each case.
+    """
+    parser = argparse.ArgumentParser(description="Measure the cache hit rate across workers.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8, 32],
+                        help="numbers of worker processes")
+    parser.add_argument("--locations", type=int, default=50, help="different locations")
+    parser.add_argument("--lookups", type=int, default=1600, help="lookups over all workers")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for workers in args.workers:
+        for shared in (False, True):
+            name = f"{workers}_workers_{'shared' if shared else 'memory'}"
+            results[name] = run_case(workers, shared, args.locations, args.lookups)
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+This python script runs the offline benchmark suite against the local stub of the openweather
+API and writes the results as json so they can be compared between runs.
+
+    python -m benchmarks.run [--output results.json] [--baseline previous.json]
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+from benchmarks import load_payload
+from benchmarks.bench_decode import throughput
+from benchmarks.stub_server import StubServer
+
+# The openweather urls, used when there is no .env file. The stub replaces the host.
+_DEFAULT_URLS = {"OWM_GEO_URL": "https://api.openweathermap.org/geo/1.0/direct?q=",
+                 "OWM_CUR_WEATHER_URL": "https://api.openweathermap.org/data/2.5/weather?",
+                 "OWM_FRC_WEATHER_URL": "https://api.openweathermap.org/data/2.5/forecast?"}
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """
+    :param values       :      The measured values.
+    :param percent      :      The percentile, e.g. 99.
+
+    :return:                   The nearest-rank percentile of the values.
+    """
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    """
+    :param seconds      :      The measured latencies in seconds.
+
+    :return:                   The count, mean, p50 and p99 in milliseconds.
+    """
+    return {"count": len(seconds),
+            "mean_ms": round(sum(seconds) / len(seconds) * 1000, 3),
+            "p50_ms": round(percentile(seconds, 50) * 1000, 3),
+            "p99_ms": round(percentile(seconds, 99) * 1000, 3)}
+
+
+def bench_parse(seconds: float, units: str) -> Dict[str, float]:
+    """
+    :param seconds      :      The number of seconds per payload.
+    :param units        :      The units of measure.
+
+    :return:                   The from_dict parses per second of each recorded payload.
+    """
+    # pylint: disable=import-outside-toplevel
+    from openweathermap.datasets.current_weather import CurrentWeatherData
+    from openweathermap.datasets.forecast import Forecast
+    from openweathermap.datasets.location import Location
+
+    geo = load_payload("geo")[0]
+    cases: Dict[str, Callable[[], Any]] = {"location": lambda: Location.from_dict(geo)}
+    for name in ("current", "current_rain", "current_snow", "current_no_gust"):
+        payload = load_payload(name)
+        cases[name] = lambda payload=payload: CurrentWeatherData.from_dict(payload, units)
+    for name in ("forecast", "forecast_missing"):
+        payload = load_payload(name)
+        cases[name] = lambda payload=payload: Forecast.from_dict(payload, units)
+    return {name: round(throughput(parse, seconds)) for name, parse in cases.items()}
+
+
+def bench_main(iterations: int) -> Dict[str, Dict[str, float]]:
+    """
+    :param iterations      :      The number of calls of weather.main per case.
+
+    :return:                      The weather.main latency with cold and with warm caches.
+    """
+    from openweathermap import weather  # pylint: disable=import-outside-toplevel
+
+    cold, warm = [], []
+    for i in range(iterations):
+        # A new city and an empty weather cache miss every cache.
+        weather.weather_cache.clear()
+        start = time.perf_counter()
+        weather.main(f"Cold City {i}", "GA", "US")
+        cold.append(time.perf_counter() - start)
+    weather.main("Atlanta", "GA", "US")
+    for _ in range(iterations):
+        start = time.perf_counter()
+        weather.main("Atlanta", "GA", "US")
+        warm.append(time.perf_counter() - start)
+    return {"cold": summarize(cold), "warm": summarize(warm)}
+
+
+def bench_home(requests: int, concurrency: int, cities: int) -> Dict[str, float]:
+    """
+    :param requests         :      The number of POSTs to app.home.
+    :param concurrency      :      The number of POSTs in flight at the same time.
+    :param cities           :      The number of different cities posted.
+
+    :return:                       The latency of the POSTs and the requests per second.
+    """
+    from app import app  # pylint: disable=import-outside-toplevel
+
+    def post(i: int) -> float:
+        client = app.test_client()
+        start = time.perf_counter()
+        resp = client.post("/", data={"cityName": f"City {i % cities}", "stateName": "GA",
+                                      "countryName": "US"})
+        elapsed = time.perf_counter() - start
+        if resp.status_code != 200:
+            raise AssertionError(f"home returned {resp.status_code}")
+        return elapsed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        seconds = list(executor.map(post, range(requests)))
+    results = summarize(seconds)
+    results["requests_per_s"] = round(requests / (time.perf_counter() - start), 1)
+    return results
+
+
+def flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    """
+    :param results      :      The nested results.
+    :param prefix       :      The path of the results.
+
+    :return:                   The numeric results by their dotted path.
+    """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(baseline: Dict[str, Any], results: Dict[str, Any]) -> Dict[str, float]:
+    """
+    :param baseline      :      The results of a previous run.
+    :param results       :      The results of this run.
+
+    :return:                    The change in percent of each result found in both runs.
+    """
+    before, after = flatten(baseline["results"]), flatten(results["results"])
+    return {key: round((after[key] - before[key]) / before[key] * 100, 1)
+            for key in sorted(before.keys() & after.keys()) if before[key]}
+
+
+def main(argv: list[str] | None = None) -> Dict[str, Any]:
+    """
+    :param argv      :      The command line arguments.
+
+    :return:                The benchmark results.
+    """
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite.")
+    parser.add_argument("--seconds", type=float, default=0.5, help="seconds per parse payload")
+    parser.add_argument("--iterations", type=int, default=50, help="weather.main calls per case")
+    parser.add_argument("--requests", type=int, default=200, help="POSTs to app.home")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent POSTs")
+    parser.add_argument("--cities", type=int, default=20, help="different cities posted")
+    parser.add_argument("--latency", type=float, default=0.02, help="stub seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="stub fraction of errors")
+    parser.add_argument("--units", default="imperial", help="units of measure")
+    parser.add_argument("--output", help="file to write the json results to")
+    parser.add_argument("--baseline", help="json results of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    with StubServer(latency=args.latency, error_rate=args.error_rate, seed=0) as stub, \
+            tempfile.TemporaryDirectory() as cache_dir:
+        # The environment has to be set before openweathermap.weather is imported.
+        for name, url in _DEFAULT_URLS.items():
+            os.environ.setdefault(name, url)
+        os.environ.update({"OWM_BASE_URL": stub.base_url, "API_KEY": "benchmark",
+                           "UNITS_OF_MEASURE": args.units,
+                           "OWM_GEO_CACHE_PATH": os.path.join(cache_dir, "geocode.sqlite3")})
+        results = {"parse_per_s": bench_parse(args.seconds, args.units),
+                   "main": bench_main(args.iterations),
+                   "home": bench_home(args.requests, args.concurrency, args.cities)}
+        upstream_requests = dict(stub.requests)
+
+    output = {"meta": {"time": datetime.now(timezone.utc).isoformat(),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "args": vars(args),
+                       "upstream_requests": upstream_requests},
+              "results": results}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            output["change_percent"] = compare(json.load(baseline_file), output)
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(text + "\n")
+    print(text)
+    return output
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+This python script is a local stub of the openweather API serving the recorded payloads. It
+stands in for the OWM_GEO_URL, OWM_CUR_WEATHER_URL and OWM_FRC_WEATHER_URL urls when
+OWM_BASE_URL points to it, with a configurable latency, error rate and share of slow requests.
+
+    python -m benchmarks.stub_server [--port 8765] [--latency 0.05] [--error-rate 0.01]
+                                     [--slow-rate 0.01] [--slow-latency 1.0]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from benchmarks import load_payload
+
+# The recorded payload served for each path of the openweather API.
+DEFAULT_PAYLOADS: Dict[str, str] = {"/geo/1.0/direct": "geo",
+                                    "/data/2.5/weather": "current",
+                                    "/data/2.5/forecast": "forecast"}
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Class representing the handler of one request to the stub server"""
+    protocol_version = "HTTP/1.1"
+    # Send the headers and the body without waiting for the ack of the previous segment.
+    disable_nagle_algorithm = True
+    server: 'StubServer'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """
+        Do not log every request.
+        """
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Answer with the recorded payload of the path after the configured latency.
+        """
+        stub = self.server
+        path = urlsplit(self.path).path
+        stub.count(path)
+        latency = stub.latency
+        if stub.slow_rate > 0 and stub.random() < stub.slow_rate:
+            latency = stub.slow_latency
+        if latency > 0:
+            time.sleep(latency)
+        body = stub.bodies.get(path)
+        if body is None:
+            self._send(404, b'{"cod": "404", "message": "Not found"}')
+        elif stub.error_rate > 0 and stub.random() < stub.error_rate:
+            self._send(500, b'{"cod": "500", "message": "Internal error"}')
+        else:
+            self._send(200, body)
+
+    def _send(self, status: int, body: bytes) -> None:
+        """
+        :param status      :      The http status code.
+        :param body        :      The json body.
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServer(ThreadingHTTPServer):
+    """Class representing a local stub of the openweather API"""
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0, error_rate: float = 0.0,
+                 payloads: Optional[Dict[str, str]] = None, seed: Optional[int] = None,
+                 slow_rate: float = 0.0, slow_latency: float = 1.0):
+        """
+        :param port            :      The port to listen on, 0 picks a free port.
+        :param latency         :      The seconds to wait before answering each request.
+        :param error_rate      :      The fraction of the requests answered with a 500 error.
+        :param payloads        :      The name of the recorded payload by path, e.g.
+                                      {"/data/2.5/weather": "current_rain"}. The paths not given
+                                      use DEFAULT_PAYLOADS.
+        :param seed            :      The seed of the error sampling.
+        :param slow_rate       :      The fraction of the requests answered after slow_latency,
+                                      like a slow node of the openweather API.
+        :param slow_latency    :      The seconds to wait before answering a slow request.
+        """
+        super().__init__(("127.0.0.1", port), _StubHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.bodies: Dict[str, bytes] = {
+            path: json.dumps(load_payload(name)).encode()
+            for path, name in {**DEFAULT_PAYLOADS, **(payloads or {})}.items()}
+        self.requests: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """
+        :return:       The base url to use as OWM_BASE_URL.
+        """
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, path: str) -> None:
+        """
+        :param path      :      The path of the request to count.
+        """
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def random(self) -> float:
+        """
+        :return:       The next random number of the error and slow request sampling.
+        """
+        with self._lock:
+            return self._random.random()
+
+    def start(self) -> 'StubServer':
+        """
+        :return:       The server, serving in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name="owm-stub-server",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stop serving and close the socket.
+        """
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> 'StubServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    :param argv      :      The command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Serve the recorded openweather API payloads.")
+    parser.add_argument("--port", type=int, default=8765, help="port to listen on")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 500 errors")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of slow requests")
+    parser.add_argument("--slow-latency", type=float, default=1.0,
+                        help="seconds per slow request")
+    parser.add_argument("--current", default="current", help="current weather payload name")
+    parser.add_argument("--forecast", default="forecast", help="forecast payload name")
+    args = parser.parse_args(argv)
+
+    server = StubServer(args.port, args.latency, args.error_rate,
+                        {"/data/2.5/weather": args.current, "/data/2.5/forecast": args.forecast},
+                        slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    print(f"Serving the openweather API stub on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
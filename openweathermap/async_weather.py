@@ -0,0 +1,409 @@
+"""
+This python script gets the current weather from the openweather API without blocking. It
+mirrors openweathermap.weather on top of aiohttp and shares its caches.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Optional, Tuple, Type
+
+from dotenv import load_dotenv
+
+from openweathermap import weather
+from openweathermap.cache.geocode import GeocodeCache
+from openweathermap.cache.response import CURRENT, FORECAST
+from openweathermap.client import rebase_url
+from openweathermap.datasets.current_weather import CurrentWeatherData
+from openweathermap.datasets.decoders import (decode_forecast, decode_json, decode_location,
+                                              get_decoder)
+from openweathermap.datasets.forecast import Forecast
+from openweathermap.datasets.location import Location
+from openweathermap.datasets.shared import Formats
+from openweathermap.datasets.units import (CANONICAL_UNITS, current_weather_in_units,
+                                           forecast_in_units)
+from openweathermap.metrics import PARSE_SECONDS, UPSTREAM_REQUESTS, UPSTREAM_SECONDS
+from openweathermap.rate_limit import RateLimitedError, get_default_limiter
+from openweathermap.resilience import CircuitOpenError, get_default_resilience
+from utils.get_class_name import get_full_class_name
+from utils.tracing import current_span, propagate_async, span
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - aiohttp is optional
+    aiohttp = None
+
+# The errors of a failed request. Without aiohttp no request is made, so only the timeout is left
+# to catch and the except clauses still work.
+CLIENT_ERRORS: Tuple[Type[BaseException], ...] = (
+    (aiohttp.ClientError, asyncio.TimeoutError) if aiohttp is not None else (asyncio.TimeoutError,))
+
+logger = logging.getLogger(__name__)
+
+# Get configuration information
+load_dotenv()
+
+# The kind of history of each dataclass.
+_KINDS = {CurrentWeatherData: CURRENT, Forecast: FORECAST}
+
+
+class AsyncWeatherClient:
+    """Class representing a pooled, non-blocking http client for the openweather API"""
+
+    def __init__(self, pool_size: int = 100, max_per_host: int = 100,
+                 connect_timeout: float = 3.05, read_timeout: float = 5.0,
+                 base_url: Optional[str] = None):
+        """
+        :param pool_size          :      The maximum number of open connections.
+        :param max_per_host       :      The maximum connections kept open to one host.
+        :param connect_timeout    :      The connect timeout in seconds.
+        :param read_timeout       :      The read timeout in seconds.
+        :param base_url           :      The base url (e.g. http://127.0.0.1:8080) to send the
+                                         requests to instead of api.openweathermap.org.
+        """
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for the async openweathermap client")
+        self.pool_size = pool_size
+        self.max_per_host = max_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.geo_url = rebase_url(os.getenv("OWM_GEO_URL"), base_url)
+        self.cur_weather_url = rebase_url(os.getenv("OWM_CUR_WEATHER_URL"), base_url)
+        self.forecast_url = rebase_url(os.getenv("OWM_FRC_WEATHER_URL"), base_url)
+        self._session: Optional['aiohttp.ClientSession'] = None
+        self._session_loop: asyncio.AbstractEventLoop | None = None
+
+    @staticmethod
+    def from_env() -> 'AsyncWeatherClient':
+        """
+        :return:       AsyncWeatherClient configured from the environment.
+        """
+        return AsyncWeatherClient(pool_size=int(os.getenv("OWM_ASYNC_POOL_SIZE", "100")),
+                                  max_per_host=int(os.getenv("OWM_ASYNC_MAX_PER_HOST", "100")),
+                                  connect_timeout=float(os.getenv("OWM_CONNECT_TIMEOUT", "3.05")),
+                                  read_timeout=float(os.getenv("OWM_READ_TIMEOUT", "5")),
+                                  base_url=os.getenv("OWM_BASE_URL") or None)
+
+    @property
+    def session(self) -> 'aiohttp.ClientSession':
+        """
+        :return:       The session, created on first use in the running event loop. A session
+                       can only be used by the loop it was created in so a new one is created
+                       when the client is used from another loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.pool_size,
+                                             limit_per_host=self.max_per_host,
+                                             keepalive_timeout=30)
+            timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout,
+                                            sock_read=self.read_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._session_loop = loop
+        return self._session
+
+    async def get_json(self, url: str, endpoint: str = "other") -> Tuple[int, Any]:
+        """
+        :param url           :      The url to get.
+        :param endpoint      :      The name of the endpoint used by the metrics, e.g. geocode.
+
+        :return:                    Tuple of the status code and the decoded json body. Failed
+                                    requests are retried and slow ones hedged, see
+                                    Resilience.call_async.
+        """
+        status, body = await get_default_resilience().call_async(
+            endpoint, lambda: self._get(url, endpoint), lambda resp: resp[0], CLIENT_ERRORS)
+        return status, decode_json(body)
+
+    async def _get(self, url: str, endpoint: str) -> Tuple[int, bytes]:
+        """
+        :param url           :      The url to get.
+        :param endpoint      :      The name of the endpoint used by the metrics.
+
+        :return:                    Tuple of the status code and the body of one request, once
+                                    the rate limiter gave a token for it.
+        """
+        rate_limiter = get_default_limiter()
+        if rate_limiter is not None:
+            await rate_limiter.acquire_async(endpoint)
+        status = "error"
+        start = time.perf_counter()
+        try:
+            with span("upstream", endpoint=endpoint) as upstream:
+                async with self.session.get(url) as resp:
+                    status = str(resp.status)
+                    body = await resp.read()
+                upstream.set("status", resp.status)
+                upstream.set("bytes", len(body))
+            return resp.status, body
+        finally:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+            UPSTREAM_REQUESTS.inc(endpoint=endpoint, status=status)
+
+    async def close(self) -> None:
+        """
+        Close the connection pool.
+        """
+        if self._session is not None:
+            await self._session.close()
+
+
+async def get_lan_lon(city_name: str, state_code: str, country_code: str, limit: int = 1,
+                      client: AsyncWeatherClient | None = None) -> Location:
+    """
+    :param city_name:      The city name to get the latitude and longitude from.
+    :param state_code:     The state code to get the latitude and longitude from.
+    :param country_code:   The country code to get the latitude and longitude from.
+    :param limit:          The number of latitude and longitude combinations to retrieve.
+    :param client:         The async http client. Defaults to the shared client.
+
+    :return:               Location dataclass representing the location.
+    """
+    cache_key = GeocodeCache.make_key(city_name, state_code, country_code, limit)
+    # The caches and the index read SQLite, so they run off the event loop.
+    found, cached_location = await asyncio.to_thread(weather.geocode_cache.get, cache_key)
+    if found:
+        current_span().set("cache", "hit")
+        return cached_location if cached_location is not None else Location()
+    if weather.geocode_index is not None:
+        indexed_location = await asyncio.to_thread(weather.geocode_index.resolve, city_name,
+                                                   state_code, country_code)
+        if indexed_location is not None:
+            current_span().set("cache", "index")
+            return indexed_location
+    current_span().set("cache", "miss")
+    try:
+        client = client or get_default_client()
+        location_data: Location | None = Location()
+        status, payload = await client.get_json(
+            f"{client.geo_url}{city_name},{state_code},{country_code}&limit={limit}"
+            f"&appid={weather.api_key}", weather.GEOCODE)
+        logger.debug("get_lan_lon: status_code=%s payload=%s", status, payload)
+        if status == 200 and payload:
+            with PARSE_SECONDS.time(type=weather.GEOCODE), span("parse", type=weather.GEOCODE):
+                location_data = decode_location(payload[0])
+            await asyncio.to_thread(weather.geocode_cache.put, cache_key, location_data)
+            weather.spatial_index.add(location_data)
+        elif status in (200, 400, 404):
+            await asyncio.to_thread(weather.geocode_cache.put, cache_key, None)
+    except CLIENT_ERRORS + (CircuitOpenError, RateLimitedError) as e:
+        logger.warning("%s: %s", get_full_class_name(e), e.args)
+        location_data = None
+    except (IndexError, ValueError, TypeError, AttributeError) as e:
+        logger.warning("%s: %s", get_full_class_name(e), e.args)
+        location_data = None
+
+    return location_data
+
+
+async def _fetch(cls, url_name: str, endpoint: str, lat: float, lon: float,
+                 client: AsyncWeatherClient | None):
+    """
+    :param cls          :      The CurrentWeatherData or Forecast dataclass to parse into.
+                               Its key in _KINDS is the kind of history.
+    :param url_name     :      The name of the client url to get.
+    :param endpoint     :      The name of the endpoint used by the metrics.
+    :param lat          :      The latitude to get the weather from.
+    :param lon          :      The longitude to get the weather from.
+    :param client       :      The async http client. Defaults to the shared client.
+
+    :return:                   The parsed dataclass in the canonical units, the empty
+                               dataclass when nothing was found or None on an error.
+    """
+    try:
+        client = client or get_default_client()
+        status, payload = await client.get_json(
+            f"{getattr(client, url_name)}lat={lat}&lon={lon}&lang={weather.language}"
+            f"&appid={weather.api_key}&units={CANONICAL_UNITS}", endpoint)
+        logger.debug("%s: status_code=%s payload=%s", cls.__name__, status, payload)
+        if status == 200 and payload:
+            with PARSE_SECONDS.time(type=endpoint), span("parse", type=endpoint):
+                if cls is Forecast:
+                    weather_data = decode_forecast(payload, CANONICAL_UNITS, weather.lazy_forecast)
+                else:
+                    weather_data = get_decoder(cls, CANONICAL_UNITS)(payload)
+            if weather.history_store is not None:
+                await asyncio.to_thread(weather.history_store.record, _KINDS[cls], payload,
+                                        CANONICAL_UNITS)
+            return weather_data
+        return cls()
+    except CLIENT_ERRORS + (CircuitOpenError, RateLimitedError) as e:
+        logger.warning("%s: %s", get_full_class_name(e), e.args)
+    except (IndexError, ValueError, TypeError, AttributeError) as e:
+        logger.warning("%s: %s", get_full_class_name(e), e.args)
+    return None
+
+
+async def _get_cached(kind: str, lat: float, lon: float, fetch: Callable[[], Awaitable],
+                      sync_fetch: Callable[[], Any]):
+    """
+    :param kind           :      The kind of response, current or forecast.
+    :param lat            :      The latitude of the response.
+    :param lon            :      The longitude of the response.
+    :param fetch          :      The function returning the awaitable that fetches the response
+                                 on a miss.
+    :param sync_fetch     :      The blocking fetch used to refresh a stale entry in the
+                                 background.
+
+    :return:                     The cached or fetched dataclass in the canonical units.
+    """
+    if lat is None or lon is None:
+        return await fetch()
+    key = weather.weather_cache.make_key(kind, lat, lon, CANONICAL_UNITS)
+    # The SQLite tier and the binary encoding of the entries run off the event loop.
+    entry = await asyncio.to_thread(weather.weather_cache.peek, key)
+    if entry is not None:
+        value, fresh = entry
+        if not fresh:
+            weather.weather_cache.refresh(key, sync_fetch, weather.is_successful)
+        return value
+    # Shares the in-flight fetch of the key with the blocking and the other async callers.
+    value, shared = await weather.fetch_flights.do_async(key, fetch)
+    if weather.is_successful(value):
+        if not shared:
+            await asyncio.to_thread(weather.weather_cache.put, key, value)
+        return value
+    fallback = await asyncio.to_thread(weather.weather_cache.fallback, key)
+    return fallback if fallback is not None else value
+
+
+async def get_current_weather(lat: float, lon: float, client: AsyncWeatherClient | None = None,
+                              units: str | None = None) -> CurrentWeatherData:
+    """
+    :param lat:      The latitude to get the current weather from.
+    :param lon:      The longitude to get the current weather from.
+    :param client:   The async http client. Defaults to the shared client.
+    :param units:    The units of measure. Defaults to the UNITS_OF_MEASURE setting.
+
+    :return:         CurrentWeatherData dataclass representing the current weather.
+    """
+    return current_weather_in_units(
+        await _get_cached(CURRENT, lat, lon,
+                          lambda: _fetch(CurrentWeatherData, "cur_weather_url",
+                                         weather.CURRENT_WEATHER, lat, lon, client),
+                          lambda: weather.fetch_current_weather(lat, lon)),
+        units or weather.units_of_measure)
+
+
+async def get_forcast(lat: float, lon: float, client: AsyncWeatherClient | None = None,
+                      units: str | None = None) -> Forecast:
+    """
+    :param lat:      The latitude to get the forecast from.
+    :param lon:      The longitude to get the forecast from.
+    :param client:   The async http client. Defaults to the shared client.
+    :param units:    The units of measure. Defaults to the UNITS_OF_MEASURE setting.
+
+    :return:         Forecast dataclass representing the forecast.
+    """
+    return forecast_in_units(
+        await _get_cached(FORECAST, lat, lon,
+                          lambda: _fetch(Forecast, "forecast_url", FORECAST, lat, lon, client),
+                          lambda: weather.fetch_forcast(lat, lon)),
+        units or weather.units_of_measure)
+
+
+async def _spanned(stage: str, coro: Awaitable) -> Any:
+    """
+    :param stage      :      The name of the stage.
+    :param coro       :      The coroutine of the stage.
+
+    :return:                 The result of the coroutine, awaited in a span of the stage.
+    """
+    with span(stage):
+        return await coro
+
+
+async def main(city_name: str, state_code: str, country_code: str,
+               client: AsyncWeatherClient | None = None, units: str | None = None) -> tuple:
+    """
+    :param city_name:      The city name to get the latitude and longitude from.
+    :param state_code:     The state code to get the latitude and longitude from.
+    :param country_code:   The country code to get the latitude and longitude from.
+    :param client:         The async http client. Defaults to the shared client.
+    :param units:          The units of measure. Defaults to the UNITS_OF_MEASURE setting.
+
+    :return:               Tuple of the Location, CurrentWeatherData, Forecast and Formats.
+    """
+    units = units or weather.units_of_measure
+    # Identical lookups made at the same time share the result of the first one.
+    flight_key = (GeocodeCache.make_key(city_name, state_code, country_code), units)
+    result, _ = await weather.request_flights.do_async(
+        flight_key, lambda: _main(city_name, state_code, country_code, client, units))
+    return result
+
+
+async def _main(city_name: str, state_code: str, country_code: str,
+                client: AsyncWeatherClient | None, units: str) -> tuple:
+    """
+    :param city_name:      The city name to get the latitude and longitude from.
+    :param state_code:     The state code to get the latitude and longitude from.
+    :param country_code:   The country code to get the latitude and longitude from.
+    :param client:         The async http client. Defaults to the shared client.
+    :param units:          The units of measure.
+
+    :return:               Tuple of the Location, CurrentWeatherData, Forecast and Formats.
+                           The Location and the weather are None when the location could not be
+                           looked up, e.g. the circuit is open.
+    """
+    with span("formats"):
+        formats_data: Formats = Formats.for_units(units)
+    location_data: Location | None = await _spanned("geocode", get_lan_lon(
+        city_name, state_code, country_code, client=client))
+    if location_data is None:
+        return None, None, None, formats_data
+    current_weather_data, forecast_data = await asyncio.gather(
+        _spanned("current_weather", get_current_weather(location_data.lat, location_data.lon,
+                                                        client=client, units=units)),
+        _spanned("forecast", get_forcast(location_data.lat, location_data.lon, client=client,
+                                         units=units)))
+    return location_data, current_weather_data, forecast_data, formats_data
+
+
+_default_client: AsyncWeatherClient | None = None
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def get_default_client() -> AsyncWeatherClient:
+    """
+    :return:       The process wide AsyncWeatherClient.
+    """
+    global _default_client  # pylint: disable=global-statement
+    if _default_client is None:
+        _default_client = AsyncWeatherClient.from_env()
+    return _default_client
+
+
+def _client_loop() -> asyncio.AbstractEventLoop:
+    """
+    :return:       The event loop that owns the shared client, started on first use.
+    """
+    global _loop  # pylint: disable=global-statement
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="owm-async-loop",
+                             daemon=True).start()
+    return _loop
+
+
+def submit(coro: Awaitable) -> Future:
+    """
+    :param coro      :      The coroutine to run, e.g. main(city, state, country).
+
+    :return:                Future of the result. The coroutine runs on one long lived event
+                            loop so every caller shares the same connection pool, even when the
+                            callers run their own short lived loops like the Flask async views.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _client_loop())
+
+
+async def run(coro: Awaitable) -> Any:
+    """
+    :param coro      :      The coroutine to run on the client event loop.
+
+    :return:                The result of the coroutine.
+    """
+    return await asyncio.wrap_future(submit(propagate_async(coro)))
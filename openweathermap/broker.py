@@ -0,0 +1,292 @@
+"""
+This python script is for the broker of the live weather updates streamed to the dashboards.
+A subscriber follows the current weather or forecast of some locations. The subscribed locations
+are kept warm by the prefetcher, and each time the cache gets a new value for one of them only
+the fields that changed are pushed to every subscriber of that location, so one upstream
+refresh is fanned out to all the open dashboards.
+"""
+import logging
+import os
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from openweathermap import weather
+from openweathermap.cache.response import CURRENT, FORECAST, WeatherCache
+from openweathermap.datasets.encoders import to_json_obj
+from openweathermap.datasets.units import (CANONICAL_UNITS, current_weather_in_units,
+                                           forecast_in_units)
+from openweathermap.metrics import REGISTRY
+from openweathermap.prefetch import Prefetcher, start_default_prefetcher
+
+logger = logging.getLogger(__name__)
+
+# Get configuration information
+load_dotenv()
+
+SNAPSHOT = "snapshot"
+UPDATE = "update"
+
+STREAM_EVENTS = REGISTRY.counter("owm_stream_events_total",
+                                 "Events pushed to the stream subscribers by type.")
+STREAM_DROPPED = REGISTRY.counter("owm_stream_dropped_total",
+                                  "Stream subscribers dropped because they did not keep up.")
+
+# The number of locks the keys are spread over.
+_KEY_LOCKS = 64
+
+_CONVERTERS = {CURRENT: current_weather_in_units, FORECAST: forecast_in_units}
+
+
+def diff(old: Any, new: Any) -> Any:
+    """
+    :param old      :      The previous json object.
+    :param new      :      The new json object.
+
+    :return:               The fields of new that differ from old, nested like new, or None when
+                           nothing changed. A removed field is None and a changed list is sent
+                           whole.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        changes = {}
+        for name in new.keys() | old.keys():
+            if name not in new:
+                changes[name] = None
+            elif name not in old:
+                changes[name] = new[name]
+            else:
+                change = diff(old[name], new[name])
+                if change is not None:
+                    changes[name] = change
+        return changes or None
+    return None if old == new else new
+
+
+@dataclass
+class Event:
+    """Class representing an event pushed to the subscribers"""
+    type: str = field(default=UPDATE)
+    kind: str = field(default=None)
+    lat: float = field(default=None)
+    lon: float = field(default=None)
+    data: Any = field(default=None)
+
+
+class Subscription:
+    """Class representing the events waiting to be sent to one subscriber"""
+
+    def __init__(self, keys: List[Tuple], units: Optional[str], max_events: int = 100):
+        """
+        :param keys            :      The cache keys of the subscribed locations and kinds.
+        :param units           :      The units of measure of the events.
+        :param max_events      :      The most events waiting before the subscriber is dropped.
+        """
+        self.keys = keys
+        self.units = units or CANONICAL_UNITS
+        self.events: queue.Queue = queue.Queue(maxsize=max_events)
+        self.closed = False
+        # The keys whose full object was sent, the others get a snapshot before any update.
+        self.snapshots: set = set()
+
+    def push(self, event: Event) -> bool:
+        """
+        :param event      :      The event to send.
+
+        :return:                 False when the subscriber is too slow and was closed.
+        """
+        try:
+            self.events.put_nowait(event)
+            return True
+        except queue.Full:
+            self.closed = True
+            return False
+
+    def next(self, timeout: float) -> Optional[Event]:
+        """
+        :param timeout      :      The most seconds to wait for an event.
+
+        :return:                   The next event or None when there was none in time.
+        """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class WeatherBroker:
+    """Class representing the fan-out of the cached weather updates to the subscribers"""
+
+    def __init__(self, cache: WeatherCache, prefetcher: Optional[Prefetcher] = None,
+                 max_events: int = 100):
+        """
+        :param cache           :      The weather cache whose new values are pushed.
+        :param prefetcher      :      The prefetcher keeping the subscribed locations warm.
+        :param max_events      :      The most events waiting for a subscriber before it is
+                                      dropped.
+        """
+        self.cache = cache
+        self.prefetcher = prefetcher
+        self.max_events = max_events
+        self._subscribers: Dict[Tuple, List[Subscription]] = {}
+        # The last json object sent by cache key and units of measure, to diff the next one.
+        self._last: Dict[Tuple, Any] = {}
+        # The events of a key are computed and pushed under the lock of its stripe, so they
+        # are in order. A cache read made under the lock can publish, so it is reentrant.
+        self._key_locks = [threading.RLock() for _ in range(_KEY_LOCKS)]
+        self._lock = threading.Lock()
+        cache.add_listener(self.publish)
+
+    @staticmethod
+    def from_env(cache: WeatherCache) -> 'WeatherBroker':
+        """
+        :param cache      :      The weather cache whose new values are pushed.
+
+        :return:                 WeatherBroker configured from the environment.
+        """
+        return WeatherBroker(cache, start_default_prefetcher(required=True),
+                             max_events=int(os.getenv("OWM_STREAM_MAX_EVENTS", "100")))
+
+    def _json(self, key: Tuple, value: Any, units: str) -> Any:
+        """
+        :param key        :      The cache key.
+        :param value      :      The cached value in the canonical units.
+        :param units      :      The units of measure of the subscriber.
+
+        :return:                 The value as a json object in the units.
+        """
+        return to_json_obj(_CONVERTERS[key[0]](value, units))
+
+    def _key_lock(self, key: Tuple) -> threading.RLock:
+        """
+        :param key      :      The cache key.
+
+        :return:               The lock ordering the events of the key.
+        """
+        return self._key_locks[hash(key) % _KEY_LOCKS]
+
+    def subscribe(self, locations: List[Tuple[float, float]], kinds: Tuple[str, ...],
+                  units: Optional[str]) -> Subscription:
+        """
+        :param locations      :      The latitude and longitude of each location.
+        :param kinds          :      The kinds followed, current and forecast.
+        :param units          :      The units of measure of the events.
+
+        :return:                     The Subscription. A snapshot of each location is queued
+                                     first, the updates follow. A location that is not cached
+                                     gets its snapshot with its next value.
+        """
+        keys = {self.cache.make_key(kind, lat, lon, CANONICAL_UNITS): (lat, lon)
+                for lat, lon in locations for kind in kinds}
+        subscription = Subscription(list(keys), units, self.max_events)
+        for key, (lat, lon) in keys.items():
+            with self._key_lock(key):
+                with self._lock:
+                    self._subscribers.setdefault(key, []).append(subscription)
+                    # The other subscribers hold the last object sent, the diffs apply to it.
+                    data = self._last.get((key, subscription.units))
+                if data is None:
+                    # Reading the shared tier can publish the value, snapshot included.
+                    cached = self.cache.get(key)
+                    if (key not in subscription.snapshots and cached is not None
+                            and weather.is_successful(cached[0])):
+                        data = self._json(key, cached[0], subscription.units)
+                        with self._lock:
+                            self._last[(key, subscription.units)] = data
+                if data is not None and key not in subscription.snapshots:
+                    subscription.snapshots.add(key)
+                    subscription.push(Event(SNAPSHOT, key[0], key[1], key[2], data))
+                    STREAM_EVENTS.inc(type=SNAPSHOT)
+            if self.prefetcher is not None:
+                self.prefetcher.watch(key, lat, lon)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """
+        :param subscription      :      The Subscription to end.
+        """
+        subscription.closed = True
+        with self._lock:
+            for key in subscription.keys:
+                subscribers = self._subscribers.get(key, [])
+                if subscription in subscribers:
+                    subscribers.remove(subscription)
+                if not subscribers:
+                    self._subscribers.pop(key, None)
+                    for last in [last for last in self._last if last[0] == key]:
+                        del self._last[last]
+                    if self.prefetcher is not None:
+                        self.prefetcher.unwatch(key)
+
+    def publish(self, key: Tuple, value: Any) -> int:
+        """
+        :param key        :      The cache key that got a new value.
+        :param value      :      The new value in the canonical units.
+
+        :return:                 The number of events pushed. A subscriber that has the full
+                                 object of the location gets the fields that changed since the
+                                 last event, the others get a snapshot.
+        """
+        with self._lock:
+            if not self._subscribers.get(key) or not weather.is_successful(value):
+                return 0
+        pushed = 0
+        dropped = []
+        with self._key_lock(key):
+            with self._lock:
+                subscribers = list(self._subscribers.get(key, ()))
+            by_units: Dict[str, List[Subscription]] = {}
+            for subscription in subscribers:
+                by_units.setdefault(subscription.units, []).append(subscription)
+            for units, group in by_units.items():
+                data = self._json(key, value, units)
+                with self._lock:
+                    last = self._last.get((key, units))
+                    self._last[(key, units)] = data
+                changes = diff(last, data) if last is not None else data
+                for subscription in group:
+                    if key not in subscription.snapshots:
+                        event = Event(SNAPSHOT, key[0], key[1], key[2], data)
+                    elif changes is None:
+                        continue
+                    else:
+                        event = Event(UPDATE, key[0], key[1], key[2], changes)
+                    if subscription.push(event):
+                        subscription.snapshots.add(key)
+                        pushed += 1
+                        STREAM_EVENTS.inc(type=event.type)
+                    else:
+                        dropped.append(subscription)
+        for subscription in dropped:
+            STREAM_DROPPED.inc()
+            self.unsubscribe(subscription)
+        return pushed
+
+    def subscribers(self) -> int:
+        """
+        :return:       The number of subscriptions.
+        """
+        with self._lock:
+            return len({id(subscription) for subscribers in self._subscribers.values()
+                        for subscription in subscribers})
+
+
+_default_broker: WeatherBroker | None = None
+_default_broker_lock = threading.Lock()
+
+
+def get_default_broker() -> WeatherBroker:
+    """
+    :return:       The process wide WeatherBroker of the weather cache.
+    """
+    global _default_broker  # pylint: disable=global-statement
+    with _default_broker_lock:
+        if _default_broker is None:
+            _default_broker = WeatherBroker.from_env(weather.weather_cache)
+    return _default_broker
+
+
+REGISTRY.gauge("owm_stream_subscribers", "Open subscriptions to the weather stream.",
+               lambda: _default_broker.subscribers() if _default_broker is not None else 0)
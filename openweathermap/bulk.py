@@ -0,0 +1,161 @@
+"""
+This python script gets the current weather and forecast for many locations from the
+openweather API with a bounded number of locations in flight at the same time.
+"""
+import argparse
+import csv
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from openweathermap import weather
+from openweathermap.client import WeatherClient
+from openweathermap.datasets.current_weather import CurrentWeatherData
+from openweathermap.datasets.forecast import Forecast
+from openweathermap.datasets.location import Location
+from utils.get_class_name import get_full_class_name
+
+
+@dataclass
+class LocationQuery:
+    """Class representing a location to look up"""
+    city_name: str = field(default="")
+    state_code: str = field(default="")
+    country_code: str = field(default="")
+
+
+@dataclass
+class BulkResult:
+    """Class representing the result of one location of a bulk lookup"""
+    query: LocationQuery = field(default=None)
+    location: Optional[Location] = field(default=None)
+    current_weather: Optional[CurrentWeatherData] = field(default=None)
+    forecast: Optional[Forecast] = field(default=None)
+    error: Optional[str] = field(default=None)
+    elapsed: Optional[float] = field(default=None)
+
+    @property
+    def ok(self) -> bool:
+        """
+        :return:       True when the location, current weather and forecast were all found.
+        """
+        return self.error is None
+
+
+def _to_query(location: LocationQuery | Tuple[str, ...]) -> LocationQuery:
+    """
+    :param location      :      A LocationQuery or a (city, state, country) tuple.
+
+    :return:                    The LocationQuery. ValueError is raised when the location is
+                                neither.
+    """
+    if isinstance(location, LocationQuery):
+        return location
+    if not isinstance(location, (tuple, list)) or not 1 <= len(location) <= 3:
+        raise ValueError(f"not a (city, state, country) tuple: {location!r}")
+    return LocationQuery(*location)
+
+
+def _fetch_one(location: LocationQuery | Tuple[str, ...],
+               client: WeatherClient | None) -> BulkResult:
+    """
+    :param location      :      The location to look up, a LocationQuery or a
+                                (city, state, country) tuple.
+    :param client        :      The pooled http client. Defaults to the shared client.
+
+    :return:                    The BulkResult of the location. Errors, including a malformed
+                                location, are recorded in the result instead of being raised.
+    """
+    result = BulkResult()
+    start = time.perf_counter()
+    try:
+        result.query = query = _to_query(location)
+        # The bulk executor already bounds the concurrency so each location is fetched serially.
+        result.location, result.current_weather, result.forecast, _ = weather.main(
+            query.city_name, query.state_code, query.country_code, client=client,
+            concurrent=False)
+        if result.location is None or result.location.lat is None:
+            result.error = "location not found"
+        elif result.current_weather is None or result.current_weather.cod != 200:
+            result.error = "current weather not found"
+        elif result.forecast is None or result.forecast.cod != 200:
+            result.error = "forecast not found"
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        result.error = f"{get_full_class_name(e)}: {e.args}"
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def fetch_many(locations: Iterable[LocationQuery | Tuple[str, ...]], max_concurrency: int = 16,
+               client: WeatherClient | None = None) -> Iterator[BulkResult]:
+    """
+    :param locations          :      The locations to look up as LocationQuery objects or
+                                     (city, state, country) tuples.
+    :param max_concurrency    :      The maximum number of locations in flight at the same time.
+    :param client             :      The pooled http client. Defaults to the shared client.
+
+    :return:                         Iterator of the BulkResult of each location in the order
+                                     they complete.
+    """
+    queries = iter(locations)
+    with ThreadPoolExecutor(max_workers=max_concurrency,
+                            thread_name_prefix="owm-bulk") as executor:
+        pending: set[Future] = set()
+        # Only max_concurrency locations are submitted at a time so a large iterable is never
+        # queued up all at once.
+        for query in queries:
+            pending.add(executor.submit(_fetch_one, query, client))
+            if len(pending) >= max_concurrency:
+                break
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                for query in itertools.islice(queries, 1):
+                    pending.add(executor.submit(_fetch_one, query, client))
+
+
+def read_locations(path: str) -> Iterator[LocationQuery]:
+    """
+    :param path      :      The csv file with city, state and country columns.
+
+    :return:                Iterator of the LocationQuery of each row.
+    """
+    with open(path, newline="", encoding="utf-8") as csv_file:
+        for row in csv.reader(csv_file):
+            if row and not row[0].startswith("#"):
+                yield LocationQuery(*(value.strip() for value in (row + ["", ""])[:3]))
+
+
+def main(argv: list[str] | None = None) -> Dict[str, int]:
+    """
+    :param argv      :      The command line arguments.
+
+    :return:                The number of locations that succeeded and failed.
+    """
+    parser = argparse.ArgumentParser(description="Get the weather for many locations.")
+    parser.add_argument("locations", help="csv file with city, state and country columns")
+    parser.add_argument("--concurrency", type=int,
+                        default=int(os.getenv("OWM_BULK_CONCURRENCY", "16")),
+                        help="maximum number of locations in flight at the same time")
+    args = parser.parse_args(argv)
+
+    summary = {"ok": 0, "failed": 0}
+    start = time.perf_counter()
+    for result in fetch_many(read_locations(args.locations), args.concurrency):
+        if result.ok:
+            summary["ok"] += 1
+        else:
+            summary["failed"] += 1
+            print(f"{result.query}: {result.error}", file=sys.stderr)
+    print(f"{summary['ok']} ok, {summary['failed']} failed in "
+          f"{time.perf_counter() - start:.2f}s")
+    return summary
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+This python script is for the geocoding cache used by get_lan_lon. It keeps an in-memory LRU
+tier in front of an on-disk SQLite tier that survives restarts and is shared by the workers.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+
+from openweathermap.cache.lru import LRUCache
+from openweathermap.datasets.location import Location
+from utils.get_class_name import get_full_class_name
+
+logger = logging.getLogger(__name__)
+
+# Get configuration information
+load_dotenv()
+
+
+def _normalize(value: Optional[str]) -> str:
+    """
+    :param value      :      The value to normalize.
+
+    :return:                 The value case folded with the whitespace collapsed.
+    """
+    return " ".join(str(value or "").split()).casefold()
+
+
+# pylint: disable=too-many-instance-attributes
+# Eight is reasonable in this case.
+class GeocodeCache:
+    """Class representing the two tier geocoding cache"""
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 1024,
+                 ttl: float = 30 * 24 * 3600, negative_ttl: float = 600):
+        """
+        :param path             :      The SQLite file for the on-disk tier. When None only the
+                                       in-memory tier is used.
+        :param max_entries      :      The maximum number of entries in the in-memory tier.
+        :param ttl              :      The seconds a resolved location is kept.
+        :param negative_ttl     :      The seconds an empty or unresolvable lookup is kept.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._memory = LRUCache(max_entries)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connection() as conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, "
+                             "payload TEXT, expires_at REAL NOT NULL)")
+
+    @staticmethod
+    def from_env() -> 'GeocodeCache':
+        """
+        :return:       GeocodeCache configured from the environment.
+        """
+        path = os.getenv("OWM_GEO_CACHE_PATH", ".cache/geocode.sqlite3")
+        return GeocodeCache(path=path or None,
+                            max_entries=int(os.getenv("OWM_GEO_CACHE_SIZE", "1024")),
+                            ttl=float(os.getenv("OWM_GEO_CACHE_TTL", str(30 * 24 * 3600))),
+                            negative_ttl=float(os.getenv("OWM_GEO_CACHE_NEGATIVE_TTL", "600")))
+
+    @staticmethod
+    def make_key(city_name: str, state_code: str, country_code: str, limit: int = 1) -> str:
+        """
+        :param city_name:      The city name of the lookup.
+        :param state_code:     The state code of the lookup.
+        :param country_code:   The country code of the lookup.
+        :param limit:          The limit of the lookup.
+
+        :return:               The normalized cache key.
+        """
+        return "|".join((_normalize(city_name), _normalize(state_code),
+                         _normalize(country_code), str(int(limit))))
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        :return:       The SQLite connection for the current thread.
+        """
+        conn: sqlite3.Connection | None = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Tuple[bool, Optional[Location]]:
+        """
+        :param key      :      The normalized cache key.
+
+        :return:               Tuple of whether the key was found and the cached Location. The
+                               Location is None for a cached empty lookup.
+        """
+        now = time.time()
+        entry = self._memory.get(key, now)
+        if entry is not None:
+            self._count(True)
+            return True, entry[0]
+        if self.path:
+            try:
+                row = self._connection().execute(
+                    "SELECT payload, expires_at FROM geocode WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("%s: %s", get_full_class_name(e), e.args)
+                row = None
+            if row is not None and row[1] > now:
+                location = Location.from_dict(json.loads(row[0])) if row[0] is not None else None
+                self._memory.put(key, location, row[1])
+                self._count(True)
+                return True, location
+        self._count(False)
+        return False, None
+
+    def _count(self, hit: bool) -> None:
+        """
+        :param hit      :      True for a hit, False for a miss.
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, key: str, location: Optional[Location]) -> None:
+        """
+        :param key           :      The normalized cache key.
+        :param location      :      The Location to cache or None to cache an empty lookup.
+        """
+        expires_at = time.time() + (self.ttl if location is not None else self.negative_ttl)
+        self._memory.put(key, location, expires_at)
+        if self.path:
+            payload = json.dumps(location.to_dict()) if location is not None else None
+            try:
+                with self._connection() as conn:
+                    conn.execute("INSERT OR REPLACE INTO geocode (key, payload, expires_at) "
+                                 "VALUES (?, ?, ?)", (key, payload, expires_at))
+            except sqlite3.Error as e:
+                logger.warning("%s: %s", get_full_class_name(e), e.args)
+
+    def purge_expired(self) -> int:
+        """
+        :return:       The number of expired rows removed from the on-disk tier.
+        """
+        if not self.path:
+            return 0
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM geocode WHERE expires_at <= ?",
+                                (time.time(),)).rowcount
@@ -0,0 +1,70 @@
+"""
+This python script is for the thread safe in-memory LRU cache with expiring entries.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+
+class LRUCache:
+    """Class representing a thread safe LRU cache where every entry has an expiry time"""
+
+    def __init__(self, max_entries: int = 1024):
+        """
+        :param max_entries      :      The maximum number of entries before the least recently
+                                       used entries are evicted.
+        """
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: Hashable, now: Optional[float] = None) -> Optional[Tuple[Any, float]]:
+        """
+        :param key      :      The key of the entry.
+        :param now      :      The current time. Defaults to time.time().
+
+        :return:               Tuple of the value and its expiry time or None when the key is
+                               missing or expired.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, value: Any, expires_at: float) -> None:
+        """
+        :param key             :      The key of the entry.
+        :param value           :      The value of the entry.
+        :param expires_at      :      The time the entry expires.
+        """
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        """
+        :param key      :      The key of the entry to remove.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Remove every entry.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
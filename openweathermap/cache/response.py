@@ -0,0 +1,382 @@
+"""
+This python script is for the weather response cache used by get_current_weather and
+get_forcast. The parsed dataclasses are cached by latitude and longitude rounded to a grid, so
+a hit skips both the network call and the from_dict parsing. An optional SQLite tier in WAL mode
+is shared by the worker processes of the host, so a response fetched by one worker is a hit in
+every other one.
+"""
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from openweathermap.cache.lru import LRUCache
+from openweathermap.datasets.binary import decode_binary, encode_binary
+from openweathermap.rate_limit import BACKGROUND, priority
+from utils.get_class_name import get_full_class_name
+from utils.tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+# Get configuration information
+load_dotenv()
+
+CURRENT = "current"
+FORECAST = "forecast"
+
+
+# pylint: disable=too-many-instance-attributes
+# Twenty one is reasonable in this case.
+class WeatherCache:
+    """Class representing the coordinate bucketed weather response cache"""
+
+    def __init__(self, grid: float = 0.01, current_ttl: float = 600,
+                 forecast_ttl: float = 3 * 3600, stale_ttl: float = 1800,
+                 max_entries: int = 4096, refresh_workers: int = 4, error_ttl: float = 6 * 3600,
+                 path: Optional[str] = None, mmap_size: int = 64 * 1024 * 1024):
+        """
+        :param grid               :      The size in degrees the latitude and longitude are
+                                         rounded to.
+        :param current_ttl        :      The seconds the current weather is fresh.
+        :param forecast_ttl       :      The seconds the forecast is fresh.
+        :param stale_ttl          :      The seconds an expired entry is still served while it
+                                         is refreshed in the background.
+        :param max_entries        :      The maximum number of entries before the least recently
+                                         used entries are evicted.
+        :param refresh_workers    :      The number of threads doing the background refreshes.
+        :param error_ttl          :      The seconds an expired entry is kept to be served when
+                                         the weather can not be fetched, e.g. while the circuit
+                                         of the endpoint is open.
+        :param path               :      The SQLite file of the tier shared by the worker
+                                         processes. When None only the in-memory tier is used.
+        :param mmap_size          :      The bytes of the shared tier memory-mapped by each
+                                         process, so the reads do not copy through read calls.
+        """
+        self.grid = grid
+        self.ttls: Dict[str, float] = {CURRENT: current_ttl, FORECAST: forecast_ttl}
+        self.stale_ttl = stale_ttl
+        self.error_ttl = max(error_ttl, stale_ttl)
+        self._entries = LRUCache(max_entries)
+        self._executor = ThreadPoolExecutor(max_workers=refresh_workers,
+                                            thread_name_prefix="owm-refresh")
+        self._refreshing: set = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.fallback_hits = 0
+        self.shared_hits = 0
+        self.path = path
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._puts = 0
+        self._listeners: List[Callable[[Tuple, Any], None]] = []
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._connection() as conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS weather (key TEXT PRIMARY KEY, "
+                             "value BLOB NOT NULL, fresh_until REAL NOT NULL, "
+                             "expires_at REAL NOT NULL)")
+        # The lookups by key, halved by decay, and the keys kept warm by the prefetcher.
+        self.demand: Dict[Tuple, float] = {}
+        self.watched: set = set()
+        self.watched_lookups: Dict[str, int] = {"hit": 0, "stale": 0, "miss": 0}
+
+    @staticmethod
+    def from_env() -> 'WeatherCache':
+        """
+        :return:       WeatherCache configured from the environment.
+        """
+        return WeatherCache(grid=float(os.getenv("OWM_WEATHER_CACHE_GRID", "0.01")),
+                            current_ttl=float(os.getenv("OWM_CURRENT_TTL", "600")),
+                            forecast_ttl=float(os.getenv("OWM_FORECAST_TTL", "10800")),
+                            stale_ttl=float(os.getenv("OWM_WEATHER_CACHE_STALE_TTL", "1800")),
+                            max_entries=int(os.getenv("OWM_WEATHER_CACHE_SIZE", "4096")),
+                            error_ttl=float(os.getenv("OWM_WEATHER_CACHE_ERROR_TTL", "21600")),
+                            path=os.getenv("OWM_WEATHER_CACHE_PATH",
+                                           ".cache/weather.sqlite3") or None)
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        :return:       The SQLite connection for the current thread.
+        """
+        conn: sqlite3.Connection | None = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _key_text(key: Tuple) -> str:
+        """
+        :param key      :      The cache key.
+
+        :return:               The key of the row in the shared tier.
+        """
+        return "|".join(str(part) for part in key)
+
+    def _load(self, key: Tuple, fresher_than: float) -> Optional[Tuple[Any, float]]:
+        """
+        :param key               :      The cache key.
+        :param fresher_than      :      The fresh until time the shared entry must be past, so
+                                        only a newer entry than the in-memory one is read.
+
+        :return:                        Tuple of the value and the time it stops being fresh or
+                                        None. The entry is copied to the in-memory tier.
+        """
+        try:
+            row = self._connection().execute(
+                "SELECT value, fresh_until, expires_at FROM weather WHERE key = ? "
+                "AND fresh_until > ? AND expires_at > ?",
+                (self._key_text(key), fresher_than, time.time())).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("%s: %s", get_full_class_name(e), e.args)
+            return None
+        if row is None:
+            return None
+        try:
+            value = decode_binary(row[0])
+        except ValueError as e:
+            # Written by another version of the dataclasses, so it is fetched again.
+            logger.warning("%s: %s", get_full_class_name(e), e.args)
+            return None
+        self._entries.put(key, (value, row[1]), row[2])
+        with self._lock:
+            self.shared_hits += 1
+        self._notify(key, value)
+        return value, row[1]
+
+    def add_listener(self, listener: Callable[[Tuple, Any], None]) -> None:
+        """
+        :param listener      :      Function called with the key and the value each time a new
+                                    value is cached, including one fetched by another worker.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, key: Tuple, value: Any) -> None:
+        """
+        :param key        :      The cache key.
+        :param value      :      The new value.
+        """
+        for listener in self._listeners:
+            try:
+                listener(key, value)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("%s: %s", get_full_class_name(e), e.args)
+
+    def make_key(self, kind: str, lat: float, lon: float, units: Optional[str]) -> Tuple:
+        """
+        :param kind       :      The kind of response, current or forecast.
+        :param lat        :      The latitude of the response.
+        :param lon        :      The longitude of the response.
+        :param units      :      The units of measure of the response.
+
+        :return:                 The cache key with the coordinates rounded to the grid.
+        """
+        return (kind, round(round(float(lat) / self.grid) * self.grid, 6),
+                round(round(float(lon) / self.grid) * self.grid, 6), units)
+
+    def get(self, key: Tuple) -> Optional[Tuple[Any, float]]:
+        """
+        :param key      :      The cache key.
+
+        :return:               Tuple of the cached value and the time it stops being fresh or
+                               None when there is no usable entry.
+        """
+        entry = self._entries.get(key)
+        cached = entry[0] if entry is not None else None
+        if self.path and (cached is None or cached[1] <= time.time()):
+            # Another worker may have fetched it already.
+            cached = self._load(key, cached[1] if cached is not None else 0.0) or cached
+        if cached is None or cached[1] + self.stale_ttl <= time.time():
+            return None
+        return cached
+
+    def put(self, key: Tuple, value: Any) -> None:
+        """
+        :param key        :      The cache key.
+        :param value      :      The value to cache.
+        """
+        fresh_until = time.time() + self.ttls[key[0]]
+        self._entries.put(key, (value, fresh_until), fresh_until + self.error_ttl)
+        if self.path:
+            self._store(key, value, fresh_until)
+        self._notify(key, value)
+
+    def _store(self, key: Tuple, value: Any, fresh_until: float) -> None:
+        """
+        :param key              :      The cache key.
+        :param value            :      The value to share with the other workers.
+        :param fresh_until      :      The time the value stops being fresh.
+        """
+        try:
+            blob = encode_binary(value)
+            with self._connection() as conn:
+                conn.execute("INSERT OR REPLACE INTO weather (key, value, fresh_until, "
+                             "expires_at) VALUES (?, ?, ?, ?)",
+                             (self._key_text(key), blob, fresh_until,
+                              fresh_until + self.error_ttl))
+            with self._lock:
+                self._puts += 1
+                purge = self._puts % 1000 == 0
+            if purge:
+                self.purge_expired()
+        except (sqlite3.Error, struct.error, TypeError, ValueError) as e:
+            logger.warning("%s: %s", get_full_class_name(e), e.args)
+
+    def purge_expired(self) -> int:
+        """
+        :return:       The number of expired rows removed from the shared tier.
+        """
+        if not self.path:
+            return 0
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM weather WHERE expires_at <= ?",
+                                (time.time(),)).rowcount
+
+    def fallback(self, key: Tuple) -> Any:
+        """
+        :param key      :      The cache key.
+
+        :return:               The last cached value, even when it is past the stale time, or
+                               None. It is served when the weather could not be fetched.
+        """
+        entry = self._entries.get(key)
+        cached = entry[0] if entry is not None else None
+        if cached is None and self.path:
+            cached = self._load(key, 0.0)
+        if cached is None:
+            return None
+        with self._lock:
+            self.fallback_hits += 1
+        logger.info("Serving the weather cached until %s because it could not be fetched",
+                    time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(cached[1])),
+                    extra={"cache_key": key})
+        return cached[0]
+
+    def peek(self, key: Tuple) -> Optional[Tuple[Any, bool]]:
+        """
+        :param key      :      The cache key.
+
+        :return:               Tuple of the cached value and whether it is still fresh or None
+                               when there is no usable entry. The hit and miss counts are updated.
+        """
+        entry = self.get(key)
+        fresh = entry is not None and entry[1] > time.time()
+        result = "miss" if entry is None else "hit" if fresh else "stale"
+        self._count_lookup(key, result)
+        current_span().set("cache", result)
+        if entry is None:
+            return None
+        return entry[0], fresh
+
+    def _count_lookup(self, key: Tuple, result: str) -> None:
+        """
+        :param key         :      The cache key that was looked up.
+        :param result      :      The result of the lookup, hit, stale or miss.
+        """
+        # The lookups come from the request threads, the prefetcher and the broker at once.
+        with self._lock:
+            if result == "hit":
+                self.hits += 1
+            elif result == "stale":
+                self.stale_hits += 1
+            else:
+                self.misses += 1
+            if key in self.watched:
+                self.watched_lookups[result] += 1
+            self.demand[key] = self.demand.get(key, 0.0) + 1
+            if len(self.demand) > self._entries.max_entries:
+                # Only the most requested keys are worth remembering.
+                for dropped in sorted(self.demand, key=self.demand.get)[:len(self.demand) // 2]:
+                    del self.demand[dropped]
+
+    def popular(self, count: int) -> List[Tuple]:
+        """
+        :param count      :      The number of keys.
+
+        :return:                 The most looked up keys, most looked up first.
+        """
+        with self._lock:
+            return sorted(self.demand, key=self.demand.get, reverse=True)[:count]
+
+    def decay(self, factor: float = 0.5) -> None:
+        """
+        :param factor      :      The factor the lookup counts are multiplied by, so the recent
+                                  lookups weigh more than the old ones.
+        """
+        with self._lock:
+            self.demand = {key: count * factor for key, count in self.demand.items()
+                           if count * factor >= 0.5}
+
+    def get_or_load(self, key: Tuple, loader: Callable[[], Any],
+                    cacheable: Callable[[Any], bool] = lambda value: value is not None) -> Any:
+        """
+        :param key            :      The cache key.
+        :param loader         :      The function that fetches and parses the response.
+        :param cacheable      :      The function that decides if a loaded value is cached.
+
+        :return:                     The cached value or the value returned by the loader.
+        """
+        entry = self.peek(key)
+        if entry is not None:
+            value, fresh = entry
+            if not fresh:
+                self.refresh(key, loader, cacheable)
+            return value
+        value = loader()
+        if cacheable(value):
+            self.put(key, value)
+            return value
+        fallback = self.fallback(key)
+        return fallback if fallback is not None else value
+
+    def refresh(self, key: Tuple, loader: Callable[[], Any],
+                cacheable: Callable[[Any], bool] = lambda value: value is not None) -> None:
+        """
+        :param key            :      The cache key to refresh in the background.
+        :param loader         :      The function that fetches and parses the response.
+        :param cacheable      :      The function that decides if a loaded value is cached.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run_refresh() -> None:
+            try:
+                # The refreshes leave the quota to the interactive requests.
+                with priority(BACKGROUND):
+                    value = loader()
+                if cacheable(value):
+                    self.put(key, value)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("%s: %s", get_full_class_name(e), e.args)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(run_refresh)
+
+    def clear(self) -> None:
+        """
+        Remove every entry, from the shared tier as well.
+        """
+        self._entries.clear()
+        if self.path:
+            try:
+                with self._connection() as conn:
+                    conn.execute("DELETE FROM weather")
+            except sqlite3.Error as e:
+                logger.warning("%s: %s", get_full_class_name(e), e.args)
@@ -0,0 +1,159 @@
+"""
+This python script is for the pooled http client used to call the openweather API.
+"""
+import os
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from dotenv import load_dotenv
+from requests import Response
+from requests.adapters import HTTPAdapter
+
+from openweathermap.metrics import UPSTREAM_REQUESTS, UPSTREAM_SECONDS
+from openweathermap.rate_limit import RateLimiter, get_default_limiter
+from openweathermap.resilience import Resilience, get_default_resilience
+from utils.tracing import span
+
+# Get configuration information
+load_dotenv()
+
+
+def rebase_url(url: str | None, base_url: str | None) -> str | None:
+    """
+    :param url          :      The configured openweather url.
+    :param base_url     :      The base url (scheme and host) to use instead.
+
+    :return:                   The url with the scheme and host replaced by the base url.
+    """
+    if url is None or not base_url:
+        return url
+    parts = urlsplit(url)
+    base = urlsplit(base_url)
+    path = base.path.rstrip("/") + parts.path
+    rebased = urlunsplit((base.scheme, base.netloc, path, parts.query, parts.fragment))
+    # urlunsplit drops an empty query, but the parameters are appended after the "?".
+    return rebased + "?" if url.endswith("?") else rebased
+
+
+# pylint: disable=too-many-instance-attributes
+# Ten is reasonable in this case.
+class WeatherClient:
+    """Class representing a pooled, keep-alive http client for the openweather API"""
+
+    def __init__(self, pool_size: int = 10, max_per_host: int = 10,
+                 connect_timeout: float = 3.05, read_timeout: float = 5.0,
+                 base_url: Optional[str] = None, resilience: Optional[Resilience] = None,
+                 rate_limiter: Optional[RateLimiter] = None):
+        """
+        :param pool_size          :      The number of host connection pools to keep.
+        :param max_per_host       :      The maximum connections kept open to one host.
+        :param connect_timeout    :      The connect timeout in seconds.
+        :param read_timeout       :      The read timeout in seconds.
+        :param base_url           :      The base url (e.g. http://127.0.0.1:8080) to send the
+                                         requests to instead of api.openweathermap.org.
+        :param resilience         :      The retries, hedging and circuit breakers of the
+                                         requests. Defaults to the shared Resilience.
+        :param rate_limiter       :      The quota shared with the other worker processes.
+                                         Defaults to the one configured in the environment.
+        """
+        self.pool_size = pool_size
+        self.max_per_host = max_per_host
+        self.timeout = (connect_timeout, read_timeout)
+        self.base_url = base_url
+        self.resilience = resilience or get_default_resilience()
+        self.rate_limiter = rate_limiter or get_default_limiter()
+        self.geo_url = rebase_url(os.getenv("OWM_GEO_URL"), base_url)
+        self.cur_weather_url = rebase_url(os.getenv("OWM_CUR_WEATHER_URL"), base_url)
+        self.forecast_url = rebase_url(os.getenv("OWM_FRC_WEATHER_URL"), base_url)
+        # The adapter owns the urllib3 connection pools and is shared by every session so all
+        # the threads reuse the same keep-alive connections. pool_block caps the connections
+        # per host at max_per_host.
+        self._adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=max_per_host,
+                                    pool_block=True)
+        self._local = threading.local()
+
+    @staticmethod
+    def from_env() -> 'WeatherClient':
+        """
+        :return:       WeatherClient configured from the environment.
+        """
+        return WeatherClient(pool_size=int(os.getenv("OWM_POOL_SIZE", "10")),
+                             max_per_host=int(os.getenv("OWM_MAX_PER_HOST", "10")),
+                             connect_timeout=float(os.getenv("OWM_CONNECT_TIMEOUT", "3.05")),
+                             read_timeout=float(os.getenv("OWM_READ_TIMEOUT", "5")),
+                             base_url=os.getenv("OWM_BASE_URL") or None)
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        :return:       The session for the current thread mounted on the shared adapter.
+        """
+        session: requests.Session | None = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.headers["Connection"] = "keep-alive"
+            session.mount("http://", self._adapter)
+            session.mount("https://", self._adapter)
+            self._local.session = session
+        return session
+
+    def get(self, url: str, endpoint: str = "other") -> Response:
+        """
+        :param url           :      The url to get.
+        :param endpoint      :      The name of the endpoint used by the metrics and the circuit
+                                    breakers, e.g. geocode.
+
+        :return:                    The response from the url. Failed requests are retried and
+                                    slow ones hedged, see Resilience.call. Raises a
+                                    requests.RequestException when every attempt failed or the
+                                    circuit of the endpoint is open.
+        """
+        return self.resilience.call(endpoint, lambda: self._get(url, endpoint))
+
+    def _get(self, url: str, endpoint: str) -> Response:
+        """
+        :param url           :      The url to get.
+        :param endpoint      :      The name of the endpoint used by the metrics.
+
+        :return:                    The response of one request, once the rate limiter gave a
+                                    token for it.
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(endpoint)
+        status = "error"
+        start = time.perf_counter()
+        try:
+            with span("upstream", endpoint=endpoint) as upstream:
+                resp = self.session.get(url, timeout=self.timeout)
+                status = str(resp.status_code)
+                upstream.set("status", resp.status_code)
+                upstream.set("bytes", len(resp.content))
+            return resp
+        finally:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+            UPSTREAM_REQUESTS.inc(endpoint=endpoint, status=status)
+
+    def close(self) -> None:
+        """
+        Close the shared connection pools.
+        """
+        self._adapter.close()
+
+
+_default_client: WeatherClient | None = None
+_default_client_lock = threading.Lock()
+
+
+def get_default_client() -> WeatherClient:
+    """
+    :return:       The process wide WeatherClient.
+    """
+    global _default_client  # pylint: disable=global-statement
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = WeatherClient.from_env()
+    return _default_client
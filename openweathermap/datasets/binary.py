@@ -0,0 +1,473 @@
+"""
+This python script is for the compact binary encoding of the CurrentWeatherData and Forecast
+dataclasses, used to store them in the caches. A body starts with a versioned header and a table
+of the distinct strings. The numeric fields of each dataclass are packed in one struct with a
+bit mask of the fields that are not None, and the forecast rows are stored as one array per
+field. The decoders read with struct.unpack_from, so a bytes, memoryview or mmap buffer is read
+in place without copying it first.
+"""
+import re
+import struct
+import threading
+import typing
+import zlib
+from dataclasses import fields, is_dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from openweathermap.datasets.current_weather import CurrentWeatherData
+from openweathermap.datasets.forecast import Forecast, ListObj
+from openweathermap.datasets.lazy import LazyList
+
+MAGIC = b"OWMB"
+VERSION = 1
+
+_CURRENT_WEATHER = 1
+_FORECAST = 2
+_KINDS: Dict[type, int] = {CurrentWeatherData: _CURRENT_WEATHER, Forecast: _FORECAST}
+_CLASSES: Dict[int, type] = {kind: cls for cls, kind in _KINDS.items()}
+
+# The struct code of each kind of field. A string is an index in the string table.
+_CODES = {"float": "d", "int": "i", "long": "q", "str": "H", "datetime": "d"}
+_SCALARS: Dict[type, str] = {float: "float", int: "int", str: "str", datetime: "datetime"}
+# How a field is stored when its type does not say it, by dataclass and field name.
+_FIELD_KINDS: Dict[type, Dict[str, str]] = {
+    CurrentWeatherData: {"visibility": "float", "dt": "long", "id": "long"},
+    ListObj: {"visibility": "float", "dt": "long"},
+}
+_NO_STRING = 0xFFFF
+
+_HEADER = struct.Struct("<4sBBI")
+_COUNT = struct.Struct("<H")
+
+
+def _unwrap_optional(field_type: Any) -> Any:
+    """
+    :param field_type      :      The type of the field, e.g. Optional[int].
+
+    :return:                      The type without Optional.
+    """
+    if typing.get_origin(field_type) is typing.Union:
+        args = [arg for arg in typing.get_args(field_type) if arg is not type(None)]
+        return args[0]
+    return field_type
+
+
+class _Record:
+    """Class representing the packed layout of one dataclass and its nested dataclasses"""
+
+    def __init__(self, cls: type):
+        """
+        :param cls      :      The dataclass. Its list fields are stored after the record.
+        """
+        self.cls = cls
+        self.kinds: List[str] = []
+        # The index in the values of each field of the dataclass itself, e.g. dt.
+        self.fields: Dict[str, int] = {}
+        self.lists: List[Tuple[str, type]] = []
+        self.layout: List[str] = []
+        self._bits = 0
+        self.namespace: Dict[str, Any] = {"fromtimestamp": datetime.fromtimestamp}
+        encode_lines = ["def encode(o, st):", "    m = 0"]
+        value = self._walk(cls, "o", encode_lines, 1, top=True)
+        if self._bits > 64:
+            raise TypeError(f"{cls.__name__} has more than 64 fields to encode")
+        defaults = [0.0 if kind in ("float", "datetime") else 0 for kind in self.kinds]
+        encode_lines.insert(2, f"    a = {defaults!r}")
+        encode_lines.append("    return m, a")
+        lists = ", ".join(f"l{i}" for i in range(len(self.lists)))
+        decode_lines = [f"def decode(m, a, s{', ' if lists else ''}{lists}):",
+                        f"    return {value}"]
+        # The same decoder reading a row of the forecast arrays, the mask first, then the
+        # values and the lists, so the row is not sliced.
+        width = len(self.kinds) + 1
+        row = re.sub(r"\ba\[(\d+)\]", lambda match: f"r[{int(match.group(1)) + 1}]", value)
+        row = re.sub(r"\bl(\d+)\b", lambda match: f"r[{int(match.group(1)) + width}]", row)
+        decode_lines += ["def decode_row(r, s):", f"    return {row.replace('m >> ', 'r[0] >> ')}"]
+        # pylint: disable=exec-used
+        exec("\n".join(encode_lines), self.namespace)
+        exec("\n".join(decode_lines), self.namespace)
+        self.encode: Callable[[Any, Callable[[str], int]], Tuple[int, List[Any]]] = \
+            self.namespace["encode"]
+        self.decode: Callable[..., Any] = self.namespace["decode"]
+        self.decode_row: Callable[[Tuple, List[str]], Any] = self.namespace["decode_row"]
+        self.struct = struct.Struct("<Q" + "".join(_CODES[kind] for kind in self.kinds))
+
+    def _bit(self) -> int:
+        """
+        :return:       The next bit of the mask.
+        """
+        self._bits += 1
+        return self._bits - 1
+
+    def _walk(self, cls: type, name: str, lines: List[str], depth: int,
+              top: bool = False) -> str:
+        """
+        :param cls        :      The dataclass to lay out.
+        :param name       :      The variable holding the object in the encoder.
+        :param lines      :      The lines of the encoder, appended to.
+        :param depth      :      The indentation of the encoder lines.
+        :param top        :      True for the dataclass of the record, whose list fields are
+                                 stored after the record.
+
+        :return:                 The decoder expression building the object.
+        """
+        self.namespace[f"{cls.__name__}_{id(cls)}"] = cls
+        hints = typing.get_type_hints(cls)
+        kinds = _FIELD_KINDS.get(cls, {})
+        indent = "    " * depth
+        arguments = []
+        for dataclass_field in fields(cls):
+            field_type = _unwrap_optional(hints[dataclass_field.name])
+            path = f"{name}.{dataclass_field.name}"
+            if typing.get_origin(field_type) in (list, typing.List):
+                if not top:
+                    raise TypeError(f"{path} is a list in a nested dataclass")
+                arguments.append(f"l{len(self.lists)}")
+                self.lists.append((dataclass_field.name, typing.get_args(field_type)[0]))
+                self.layout.append(f"{dataclass_field.name}[]")
+                continue
+            bit = self._bit()
+            variable = f"v{bit}"
+            lines.append(f"{indent}{variable} = {path}")
+            lines.append(f"{indent}if {variable} is not None:")
+            lines.append(f"{indent}    m |= {1 << bit}")
+            if is_dataclass(field_type):
+                self.layout.append(f"{dataclass_field.name}{{")
+                nested = self._walk(field_type, variable, lines, depth + 1)
+                self.layout.append("}")
+                arguments.append(f"({nested} if m >> {bit} & 1 else None)")
+                continue
+            kind = kinds.get(dataclass_field.name, _SCALARS.get(field_type))
+            if kind is None:
+                raise TypeError(f"{path} of type {field_type} can not be encoded")
+            index = len(self.kinds)
+            self.kinds.append(kind)
+            if top:
+                self.fields[dataclass_field.name] = index
+            self.layout.append(f"{dataclass_field.name}:{kind}")
+            if kind == "str":
+                lines.append(f"{indent}    a[{index}] = st({variable})")
+                read = f"s[a[{index}]]"
+            elif kind == "datetime":
+                lines.append(f"{indent}    a[{index}] = {variable}.timestamp()")
+                read = f"fromtimestamp(a[{index}])"
+            else:
+                lines.append(f"{indent}    a[{index}] = {variable}")
+                read = f"a[{index}]"
+            arguments.append(f"({read} if m >> {bit} & 1 else None)")
+        return f"{cls.__name__}_{id(cls)}(" + ", ".join(arguments) + ")"
+
+    @property
+    def codes(self) -> str:
+        """
+        :return:       The struct code of the mask and of each field.
+        """
+        return self.struct.format[1:]
+
+
+_records: Dict[type, _Record] = {}
+_schema_ids: Dict[type, int] = {}
+_records_lock = threading.Lock()
+
+
+def _record(cls: type) -> _Record:
+    """
+    :param cls      :      The dataclass.
+
+    :return:               The layout of the dataclass. It is compiled on the first call and
+                           reused afterwards.
+    """
+    record = _records.get(cls)
+    if record is None:
+        with _records_lock:
+            record = _records.get(cls)
+            if record is None:
+                record = _records[cls] = _Record(cls)
+    return record
+
+
+def _schema_id(cls: type) -> int:
+    """
+    :param cls      :      The dataclass of the body, CurrentWeatherData or Forecast.
+
+    :return:               The checksum of the layout, so a body written with other fields is
+                           refused instead of being read wrong.
+    """
+    schema_id = _schema_ids.get(cls)
+    if schema_id is None:
+        layouts, pending = [], [cls]
+        while pending:
+            record = _record(pending.pop(0))
+            layouts.append(f"{record.cls.__name__}({','.join(record.layout)})")
+            pending.extend(item for _, item in record.lists)
+        schema_id = _schema_ids[cls] = zlib.crc32(";".join(layouts).encode())
+    return schema_id
+
+
+class _Strings:
+    """Class representing the string table of a body being encoded"""
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+
+    def add(self, value: str) -> int:
+        """
+        :param value      :      The string.
+
+        :return:                 The index of the string in the table.
+        """
+        index = self.index.get(value)
+        if index is None:
+            index = self.index[value] = len(self.index)
+            if index >= _NO_STRING:
+                raise ValueError("too many distinct strings to encode")
+        return index
+
+    def pack(self) -> bytes:
+        """
+        :return:       The string table, the count then each length and utf-8 string.
+        """
+        parts = [_COUNT.pack(len(self.index))]
+        for value in self.index:
+            data = value.encode()
+            parts.append(_COUNT.pack(len(data)))
+            parts.append(data)
+        return b"".join(parts)
+
+
+def _pack_items(record: _Record, items: Sequence[Any], st: Callable[[str], int]) -> bytes:
+    """
+    :param record      :      The layout of the items.
+    :param items       :      The items, e.g. the Weather of a CurrentWeatherData.
+    :param st          :      Function adding a string to the string table.
+
+    :return:                  The count then the packed items one after the other.
+    """
+    pack = record.struct.pack
+    encode = record.encode
+    parts = [_COUNT.pack(len(items))]
+    for item in items:
+        mask, values = encode(item, st)
+        parts.append(pack(mask, *values))
+    return b"".join(parts)
+
+
+def _pack_lists(record: _Record, obj: Any, st: Callable[[str], int]) -> List[bytes]:
+    """
+    :param record      :      The layout of the dataclass.
+    :param obj         :      The object whose list fields are packed.
+    :param st          :      Function adding a string to the string table.
+
+    :return:                  The packed items of each list field. A None list has the count
+                              0xFFFF.
+    """
+    parts = []
+    for name, item in record.lists:
+        items = getattr(obj, name)
+        parts.append(_COUNT.pack(_NO_STRING) if items is None
+                     else _pack_items(_record(item), items, st))
+    return parts
+
+
+def _pack_rows(record: _Record, rows: Sequence[Any], st: Callable[[str], int]) -> List[bytes]:
+    """
+    :param record      :      The layout of the rows.
+    :param rows        :      The rows, e.g. the ListObj of a Forecast.
+    :param st          :      Function adding a string to the string table.
+
+    :return:                  The count of the rows, the array of each field and the items of
+                              the list fields of every row.
+    """
+    encoded = [record.encode(row, st) for row in rows]
+    count = len(encoded)
+    parts = [_COUNT.pack(count), struct.pack(f"<{count}Q", *(mask for mask, _ in encoded))]
+    for index, code in enumerate(record.codes[1:]):
+        parts.append(struct.pack(f"<{count}{code}", *(values[index] for _, values in encoded)))
+    for name, item in record.lists:
+        item_record = _record(item)
+        lists = [getattr(row, name) or () for row in rows]
+        parts.append(struct.pack(f"<{count}H", *(len(items) for items in lists)))
+        pack, encode = item_record.struct.pack, item_record.encode
+        parts.extend(pack(*_flatten(encode(entry, st))) for items in lists for entry in items)
+    return parts
+
+
+def _flatten(encoded: Tuple[int, List[Any]]) -> List[Any]:
+    """
+    :param encoded      :      The mask and the values of an encoded object.
+
+    :return:                   The mask followed by the values.
+    """
+    return [encoded[0], *encoded[1]]
+
+
+def encode_binary(obj: CurrentWeatherData | Forecast) -> bytes:
+    """
+    :param obj      :      The CurrentWeatherData or Forecast.
+
+    :return:               The binary body of the object.
+    """
+    kind = _KINDS.get(type(obj))
+    if kind is None:
+        raise TypeError(f"{type(obj).__name__} can not be encoded")
+    record = _record(type(obj))
+    strings = _Strings()
+    mask, values = record.encode(obj, strings.add)
+    body = [record.struct.pack(mask, *values)]
+    if kind == _CURRENT_WEATHER:
+        body.extend(_pack_lists(record, obj, strings.add))
+    else:
+        rows = obj.list_obj
+        body.append(_COUNT.pack(_NO_STRING) if rows is None
+                    else b"".join(_pack_rows(_record(ListObj), rows, strings.add)))
+    return b"".join([_HEADER.pack(MAGIC, VERSION, kind, _schema_id(type(obj))), strings.pack(),
+                     *body])
+
+
+class _Reader:
+    """Class representing the position in a body being decoded"""
+
+    def __init__(self, buffer: bytes | memoryview):
+        """
+        :param buffer      :      The body, e.g. bytes, a memoryview or an mmap.
+        """
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.offset = 0
+
+    def unpack(self, layout: struct.Struct) -> Tuple:
+        """
+        :param layout      :      The struct to read.
+
+        :return:                  The values read at the position, which moves past them.
+        """
+        values = layout.unpack_from(self.buffer, self.offset)
+        self.offset += layout.size
+        return values
+
+    def take(self, size: int) -> memoryview:
+        """
+        :param size      :      The number of bytes.
+
+        :return:                The bytes at the position, which moves past them. struct.error
+                                is raised when the body is shorter.
+        """
+        if self.offset + size > len(self.view):
+            raise struct.error(f"{size} bytes needed at offset {self.offset}")
+        self.offset += size
+        return self.view[self.offset - size:self.offset]
+
+    def array(self, code: str, count: int) -> Tuple:
+        """
+        :param code       :      The struct code of the values.
+        :param count      :      The number of values.
+
+        :return:                 The values read at the position, which moves past them.
+        """
+        values = struct.unpack_from(f"<{count}{code}", self.buffer, self.offset)
+        self.offset += struct.calcsize(f"<{count}{code}")
+        return values
+
+    def count(self) -> int:
+        """
+        :return:       The count read at the position.
+        """
+        return self.unpack(_COUNT)[0]
+
+    def strings(self) -> List[str]:
+        """
+        :return:       The string table read at the position.
+        """
+        strings = []
+        for _ in range(self.count()):
+            strings.append(str(self.take(self.count()), "utf-8"))
+        return strings
+
+    def items(self, record: _Record, count: int, strings: List[str]) -> List[Any]:
+        """
+        :param record       :      The layout of the items.
+        :param count        :      The number of items.
+        :param strings      :      The string table.
+
+        :return:                   The decoded items read at the position.
+        """
+        decode = record.decode
+        return [decode(values[0], values[1:], strings) for values
+                in record.struct.iter_unpack(self.take(record.struct.size * count))]
+
+    def lists(self, record: _Record, strings: List[str]) -> List[Optional[List[Any]]]:
+        """
+        :param record       :      The layout of the dataclass whose list fields are read.
+        :param strings      :      The string table.
+
+        :return:                   The items of each list field.
+        """
+        lists = []
+        for _, item in record.lists:
+            count = self.count()
+            lists.append(None if count == _NO_STRING
+                         else self.items(_record(item), count, strings))
+        return lists
+
+    def rows(self, record: _Record, strings: List[str], lazy: bool) -> Optional[Sequence[Any]]:
+        """
+        :param record       :      The layout of the rows.
+        :param strings      :      The string table.
+        :param lazy         :      Only build a row when it is used, see LazyList.
+
+        :return:                   The rows read at the position.
+        """
+        count = self.count()
+        if count == _NO_STRING:
+            return None
+        columns = [self.array(code, count) for code in record.codes]
+        lists = []
+        for _, item in record.lists:
+            counts = self.array("H", count)
+            items = self.items(_record(item), sum(counts), strings)
+            starts = [0]
+            for size in counts:
+                starts.append(starts[-1] + size)
+            lists.append([items[starts[i]:starts[i + 1]] for i in range(count)])
+        decode_row = record.decode_row
+        # The row tuples are cheap, the dataclasses are built from them.
+        values = list(zip(*columns, *lists)) if count else []
+        if lazy:
+            dt = record.fields.get("dt")
+            return LazyList(values, lambda row: decode_row(row, strings),
+                            list(columns[dt + 1]) if dt is not None else None)
+        return [decode_row(row, strings) for row in values]
+
+
+def decode_binary(buffer: bytes | memoryview, lazy: bool = False) -> CurrentWeatherData | Forecast:
+    """
+    :param buffer      :      The binary body, e.g. bytes, a memoryview or an mmap.
+    :param lazy        :      Only build a forecast row when it is used, see LazyList.
+
+    :return:                  The CurrentWeatherData or Forecast. ValueError is raised when the
+                              body is not valid or was written with another version or other
+                              fields.
+    """
+    reader = _Reader(buffer)
+    try:
+        magic, version, kind, schema_id = reader.unpack(_HEADER)
+        cls = _CLASSES.get(kind)
+        if magic != MAGIC or version != VERSION or cls is None:
+            raise ValueError(f"not a version {VERSION} weather body")
+        if schema_id != _schema_id(cls):
+            raise ValueError(f"the {cls.__name__} body was written with other fields")
+        strings = reader.strings()
+        record = _record(cls)
+        values = reader.unpack(record.struct)
+        if kind == _CURRENT_WEATHER:
+            obj = record.decode(values[0], values[1:], strings, *reader.lists(record, strings))
+        else:
+            obj = record.decode(values[0], values[1:], strings,
+                                reader.rows(_record(ListObj), strings, lazy))
+        if reader.offset != len(reader.view):
+            raise ValueError(f"the weather body has {len(reader.view) - reader.offset} bytes "
+                             f"after its end")
+        return obj
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"the weather body is truncated or corrupt: {e}") from e
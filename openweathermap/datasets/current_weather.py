@@ -12,7 +12,7 @@ from utils.property_conversions import visibility_in_km, visibility_in_miles
 
 # pylint: disable=too-many-instance-attributes
 # Eight is reasonable in this case.
-@dataclass
+@dataclass(slots=True)
 class Main:
     """Class representing the main information"""
     temp: Optional[float] = field(default=None)
@@ -43,7 +43,7 @@ class Main:
                     _sea_level, _grnd_level)
 
 
-@dataclass
+@dataclass(slots=True)
 class Sys:
     """Class representing the sys information"""
     type: Optional[int] = field(default=None)
@@ -0,0 +1,214 @@
+"""
+This python script is for the compiled decoders of the openweather API dataclasses. A decoder
+is generated once per dataclass from its field types and builds the same objects as from_dict
+with a single lookup per field.
+"""
+import json
+import threading
+import typing
+from dataclasses import fields, is_dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from openweathermap.datasets.current_weather import CurrentWeatherData, Sys as CurrentSys
+from openweathermap.datasets.forecast import City, Forecast, ListObj
+from openweathermap.datasets.lazy import LazyList
+from openweathermap.datasets.location import Location
+from openweathermap.datasets.shared import Rain, Snow, Wind
+from utils.property_conversions import visibility_in_km, visibility_in_miles
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+# How a field differs from what its type says, by dataclass and field name.
+#   key        - the json key when it is not the field name
+#   optional   - the field is None when the key is missing instead of raising an error
+#   default    - the value used when the key is missing
+#   decoder    - the name of the function in the namespace used to convert the value
+#   context    - the value passed to the nested dataclass, e.g. the rain type
+#   constant   - the field is set to the context instead of being read from the payload
+_FIELD_SPECS: Dict[type, Dict[str, Dict[str, Any]]] = {
+    Wind: {"gust": {"default": -999999.0}},
+    Rain: {"rain_amount": {"key": "{context}", "optional": True},
+           "rain_type": {"constant": True}},
+    Snow: {"snow_amount": {"key": "{context}", "optional": True},
+           "snow_type": {"constant": True}},
+    CurrentSys: {"type": {"optional": True}, "id": {"optional": True}},
+    CurrentWeatherData: {"visibility": {"decoder": "visibility_in_units"},
+                         "rain": {"optional": True, "context": "1h"},
+                         "snow": {"optional": True, "context": "1h"}},
+    ListObj: {"visibility": {"decoder": "visibility_in_units", "optional": True},
+              "rain": {"optional": True, "context": "3h"}},
+    Forecast: {"list_obj": {"key": "list"}},
+    Location: {"local_names": {"optional": True}},
+}
+
+_SCALARS: Dict[type, str] = {float: "float", int: "int", str: "str",
+                             datetime: "datetime.fromtimestamp"}
+
+
+def _unwrap_optional(field_type: Any) -> Any:
+    """
+    :param field_type      :      The type of the field, e.g. Optional[int].
+
+    :return:                      The type without Optional.
+    """
+    if typing.get_origin(field_type) is typing.Union:
+        args = [arg for arg in typing.get_args(field_type) if arg is not type(None)]
+        return args[0]
+    return field_type
+
+
+class _DecoderCompiler:
+    """Class representing the compiler of the decoders for one units of measure"""
+
+    def __init__(self, units_of_measure: Optional[str]):
+        """
+        :param units_of_measure      :      The units of measure the decoders convert to.
+        """
+        self.namespace: Dict[str, Any] = {
+            "datetime": datetime,
+            "visibility_in_units": visibility_in_miles if units_of_measure == "imperial"
+            else visibility_in_km,
+        }
+        self._names: Dict[Tuple[type, Optional[str]], str] = {}
+
+    def _converter(self, field_type: Any, spec: Dict[str, Any]) -> Callable[[str], str]:
+        """
+        :param field_type      :      The type of the field.
+        :param spec            :      The spec of the field from _FIELD_SPECS.
+
+        :return:                      Function returning the expression converting a value.
+        """
+        if "decoder" in spec:
+            return lambda value: f"{spec['decoder']}(float({value}))"
+        field_type = _unwrap_optional(field_type)
+        if typing.get_origin(field_type) in (list, typing.List):
+            item = self.decoder_name(typing.get_args(field_type)[0], None)
+            return lambda value: f"[{item}(y) for y in {value}]"
+        if is_dataclass(field_type):
+            nested = self.decoder_name(field_type, spec.get("context"))
+            return lambda value: f"{nested}({value})"
+        if field_type in _SCALARS:
+            return lambda value: f"{_SCALARS[field_type]}({value})"
+        # Any other class with its own parser, e.g. LocalNames.
+        name = f"from_dict_{field_type.__name__}"
+        self.namespace[name] = field_type.from_dict
+        return lambda value: f"{name}({value})"
+
+    def decoder_name(self, cls: type, context: Optional[str]) -> str:
+        """
+        :param cls          :      The dataclass to decode.
+        :param context      :      The context of the nested dataclass, e.g. the rain type.
+
+        :return:                   The name of the compiled decoder in the namespace.
+        """
+        name = self._names.get((cls, context))
+        if name is not None:
+            return name
+        name = f"decode_{cls.__name__}_{len(self._names)}"
+        self._names[(cls, context)] = name
+        self.namespace[cls.__name__ + f"_{id(cls)}"] = cls
+        hints = typing.get_type_hints(cls)
+        specs = _FIELD_SPECS.get(cls, {})
+        lines = [f"def {name}(o):", "    g = o.get"]
+        arguments = []
+        for i, dataclass_field in enumerate(fields(cls)):
+            spec = specs.get(dataclass_field.name, {})
+            if "constant" in spec:
+                arguments.append(repr(context))
+                continue
+            key = spec.get("key", dataclass_field.name).format(context=context)
+            convert = self._converter(hints[dataclass_field.name], spec)
+            if "default" in spec or spec.get("optional"):
+                missing = repr(spec.get("default"))
+                lines.append(f"    v{i} = g({key!r})")
+                arguments.append(f"{convert(f'v{i}')} if v{i} is not None else {missing}")
+            else:
+                arguments.append(convert(f"g({key!r})"))
+        lines.append(f"    return {cls.__name__}_{id(cls)}(" + ", ".join(arguments) + ")")
+        # pylint: disable=exec-used
+        exec("\n".join(lines), self.namespace)
+        return name
+
+    def compile(self, cls: type) -> Callable[[Any], Any]:
+        """
+        :param cls      :      The dataclass to decode.
+
+        :return:               The compiled decoder.
+        """
+        return self.namespace[self.decoder_name(cls, None)]
+
+
+_decoders: Dict[Tuple[type, Optional[str]], Callable[[Any], Any]] = {}
+_compilers: Dict[Optional[str], _DecoderCompiler] = {}
+_compile_lock = threading.Lock()
+
+
+def get_decoder(cls: type, units_of_measure: Optional[str] = None) -> Callable[[Any], Any]:
+    """
+    :param cls                   :      The dataclass, e.g. CurrentWeatherData or Forecast.
+    :param units_of_measure      :      The units of measure to decode with.
+
+    :return:                            The compiled decoder of the dataclass. It is compiled on
+                                        the first call and reused afterwards.
+    """
+    decoder = _decoders.get((cls, units_of_measure))
+    if decoder is None:
+        with _compile_lock:
+            compiler = _compilers.get(units_of_measure)
+            if compiler is None:
+                compiler = _compilers[units_of_measure] = _DecoderCompiler(units_of_measure)
+            decoder = _decoders[(cls, units_of_measure)] = compiler.compile(cls)
+    return decoder
+
+
+def decode_json(body: bytes | str) -> Any:
+    """
+    :param body      :      The raw response body.
+
+    :return:                The decoded json, using orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def decode_location(obj: Any) -> Location:
+    """
+    :param obj      :      The Location information.
+
+    :return:               Location information, same as Location.from_dict.
+    """
+    return get_decoder(Location)(obj)
+
+
+def decode_current_weather(obj: Any, units_of_measure: str) -> CurrentWeatherData:
+    """
+    :param obj                 :      The CurrentWeatherData information.
+    :param units_of_measure    :      The units of measure.
+
+    :return:                          CurrentWeatherData information, same as
+                                      CurrentWeatherData.from_dict.
+    """
+    return get_decoder(CurrentWeatherData, units_of_measure)(obj)
+
+
+def decode_forecast(obj: Any, units_of_measure: str, lazy: bool = False) -> Forecast:
+    """
+    :param obj                 :      The Forecast information.
+    :param units_of_measure    :      The units of measure.
+    :param lazy                :      Keep the raw list and only decode a ListObj when it is
+                                      used, see LazyList.
+
+    :return:                          Forecast information, same as Forecast.from_dict.
+    """
+    if not lazy:
+        return get_decoder(Forecast, units_of_measure)(obj)
+    rows = obj.get("list")
+    return Forecast(int(obj.get("cod")), int(obj.get("message")), int(obj.get("cnt")),
+                    LazyList(rows, get_decoder(ListObj, units_of_measure),
+                             [int(row.get("dt")) for row in rows]),
+                    get_decoder(City, units_of_measure)(obj.get("city")))
@@ -0,0 +1,50 @@
+"""
+This python script is for the json encoding of the openweather API dataclasses. The dataclasses
+are written field by field so the json mirrors the attributes used by the templates.
+"""
+import json
+from collections.abc import Mapping
+from dataclasses import fields, is_dataclass
+from datetime import datetime
+from typing import Any, Dict, Tuple
+
+from openweathermap.datasets.lazy import LazyList
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+_field_names: Dict[type, Tuple[str, ...]] = {}
+
+
+def to_json_obj(obj: Any) -> Any:
+    """
+    :param obj      :      The dataclass, e.g. CurrentWeatherData or Forecast.
+
+    :return:               The object as json compatible dictionaries, lists and values. The
+                           datetimes are unix timestamps, as in the openweather API.
+    """
+    if is_dataclass(obj) and not isinstance(obj, type):
+        names = _field_names.get(type(obj))
+        if names is None:
+            names = _field_names[type(obj)] = tuple(f.name for f in fields(obj))
+        return {name: to_json_obj(getattr(obj, name)) for name in names}
+    if isinstance(obj, (list, tuple, LazyList)):
+        return [to_json_obj(value) for value in obj]
+    if isinstance(obj, datetime):
+        return int(obj.timestamp())
+    if isinstance(obj, Mapping):
+        return {key: to_json_obj(value) for key, value in obj.items()}
+    return obj
+
+
+def encode_json(obj: Any) -> bytes:
+    """
+    :param obj      :      The dataclass or json compatible object to encode.
+
+    :return:               The compact json body, using orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(to_json_obj(obj))
+    return json.dumps(to_json_obj(obj), separators=(",", ":"), ensure_ascii=False).encode()
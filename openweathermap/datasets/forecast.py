@@ -1,16 +1,19 @@
 """
 This python script is for the forecast weather dataclasses for the openweather API.
 """
+import time
+from bisect import bisect_left
 from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Any
 from typing import List, Optional
 
+from openweathermap.datasets.lazy import LazyList
 from openweathermap.datasets.shared import Coord, Clouds, Weather, Wind, Rain
 from utils.property_conversions import visibility_in_miles, visibility_in_km
 
 
-@dataclass
+@dataclass(slots=True)
 class City:
     """Class representing the City information"""
     id: Optional[int] = field(default=None)
@@ -40,7 +43,7 @@ class City:
         return City(_id, _name, _coord, _country, _population, _timezone, _sunrise, _sunset)
 
 
-@dataclass
+@dataclass(slots=True)
 class Main:
     """Class representing the Main information"""
     temp: Optional[float] = field(default=None)
@@ -73,7 +76,7 @@ class Main:
                     _humidity, _temp_kf)
 
 
-@dataclass
+@dataclass(slots=True)
 class Sys:
     """Class representing the Sys information"""
     pod: Optional[str] = field(default=None)
@@ -89,7 +92,7 @@ class Sys:
         return Sys(_pod)
 
 
-@dataclass
+@dataclass(slots=True)
 class ListObj:
     """Class representing the ListObj information"""
     dt: Optional[int] = field(default=None)
@@ -140,10 +143,12 @@ class Forecast:
     city: City = field(default=None)
 
     @staticmethod
-    def from_dict(obj: Any, units_of_measure: str) -> 'Forecast':
+    def from_dict(obj: Any, units_of_measure: str, lazy: bool = False) -> 'Forecast':
         """
         :param obj                :      The Forecast information.
         :param units_of_measure   :      The units of measure.
+        :param lazy               :      Keep the raw list and only parse a ListObj when it is
+                                         used, see LazyList.
 
         :return:                          Forecast information.
         """
@@ -151,8 +156,50 @@ class Forecast:
             _cod = int(obj.get("cod"))
             _message = int(obj.get("message"))
             _cnt = int(obj.get("cnt"))
-            _list_obj = [ListObj.from_dict(y, units_of_measure) for y in obj.get("list")]
+            if lazy:
+                _list_obj = LazyList(obj.get("list"),
+                                     lambda y: ListObj.from_dict(y, units_of_measure),
+                                     [int(y.get("dt")) for y in obj.get("list")])
+            else:
+                _list_obj = [ListObj.from_dict(y, units_of_measure) for y in obj.get("list")]
             _city = City.from_dict(obj.get("city"))
             return Forecast(_cod, _message, _cnt, _list_obj, _city)
         except (IndexError, ValueError, TypeError, AttributeError, ImportError, NameError) as e:
             raise e
+
+    def window(self, start: float, end: float) -> List[ListObj]:
+        """
+        :param start      :      The first unix time, included.
+        :param end        :      The last unix time, excluded.
+
+        :return:                 The forecast rows whose dt is in the window. With a lazy list
+                                 only these rows are parsed.
+        """
+        rows = self.list_obj or []
+        if isinstance(rows, LazyList) and rows.keys is not None:
+            dts = rows.keys
+        else:
+            dts = [row.dt for row in rows]
+        return rows[bisect_left(dts, start):bisect_left(dts, end)]
+
+    def next_hours(self, hours: float, now: Optional[float] = None) -> List[ListObj]:
+        """
+        :param hours      :      The number of hours.
+        :param now        :      The unix time to start from. Defaults to time.time().
+
+        :return:                 The forecast rows of the next hours.
+        """
+        now = time.time() if now is None else now
+        return self.window(now, now + hours * 3600)
+
+    def day(self, day: int = 0, now: Optional[float] = None) -> List[ListObj]:
+        """
+        :param day        :      The day, 0 for today, 1 for tomorrow and so on.
+        :param now        :      The unix time of today. Defaults to time.time().
+
+        :return:                 The forecast rows of the day in the timezone of the city.
+        """
+        now = time.time() if now is None else now
+        offset = self.city.timezone if self.city is not None and self.city.timezone else 0
+        start = (int(now + offset) // 86400 + day) * 86400 - offset
+        return self.window(start, start + 86400)
@@ -0,0 +1,245 @@
+"""
+This python script is for the columnar form of the forecast dataclasses for the openweather API.
+The forecast rows are stored as numpy arrays so the daily summaries and unit conversions are
+vectorized instead of looping over the ListObj objects.
+"""
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional
+
+from openweathermap.datasets.forecast import City, Forecast, ListObj, Main, Sys
+from openweathermap.datasets.shared import Clouds, Rain, Weather, Wind
+from utils.property_conversions import (temperature_in_units, visibility_in_km,
+                                        visibility_in_miles, visibility_in_units,
+                                        wind_speed_in_units)
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None
+
+# The value used by Wind.from_dict when there is no gust.
+NO_GUST = -999999.0
+
+_TEMPERATURE_COLUMNS = ("temp", "feels_like", "temp_min", "temp_max")
+_WIND_SPEED_COLUMNS = ("wind_speed", "wind_gust")
+
+
+def _require_numpy() -> None:
+    """
+    Raise an ImportError when numpy is not installed.
+    """
+    if np is None:
+        raise ImportError("numpy is required for the columnar forecast")
+
+
+# pylint: disable=too-many-instance-attributes
+# Twenty is reasonable in this case.
+@dataclass
+class ForecastColumns:
+    """Class representing the Forecast information as numpy columns"""
+    units_of_measure: Optional[str] = field(default=None)
+    cod: Optional[int] = field(default=None)
+    message: Optional[int] = field(default=None)
+    city: City = field(default=None)
+    dt: Any = field(default=None)
+    temp: Any = field(default=None)
+    feels_like: Any = field(default=None)
+    temp_min: Any = field(default=None)
+    temp_max: Any = field(default=None)
+    pressure: Any = field(default=None)
+    sea_level: Any = field(default=None)
+    grnd_level: Any = field(default=None)
+    humidity: Any = field(default=None)
+    temp_kf: Any = field(default=None)
+    clouds: Any = field(default=None)
+    wind_speed: Any = field(default=None)
+    wind_deg: Any = field(default=None)
+    wind_gust: Any = field(default=None)
+    visibility: Any = field(default=None)
+    pop: Any = field(default=None)
+    rain: Any = field(default=None)
+    weather: List[List[Weather]] = field(default=None)
+    pod: List[str] = field(default=None)
+    dt_txt: List[str] = field(default=None)
+
+    @staticmethod
+    def from_forecast(forecast: Forecast, units_of_measure: str) -> 'ForecastColumns':
+        """
+        :param forecast            :      The Forecast to convert.
+        :param units_of_measure    :      The units of measure the Forecast was parsed with.
+
+        :return:                          ForecastColumns information.
+        """
+        _require_numpy()
+        rows = forecast.list_obj
+        nan = np.nan
+        return ForecastColumns(
+            units_of_measure, forecast.cod, forecast.message, forecast.city,
+            dt=np.array([r.dt for r in rows], dtype=np.int64),
+            temp=np.array([r.main.temp for r in rows], dtype=np.float64),
+            feels_like=np.array([r.main.feels_like for r in rows], dtype=np.float64),
+            temp_min=np.array([r.main.temp_min for r in rows], dtype=np.float64),
+            temp_max=np.array([r.main.temp_max for r in rows], dtype=np.float64),
+            pressure=np.array([r.main.pressure for r in rows], dtype=np.int32),
+            sea_level=np.array([r.main.sea_level for r in rows], dtype=np.int32),
+            grnd_level=np.array([r.main.grnd_level for r in rows], dtype=np.int32),
+            humidity=np.array([r.main.humidity for r in rows], dtype=np.int16),
+            temp_kf=np.array([r.main.temp_kf for r in rows], dtype=np.float64),
+            clouds=np.array([r.clouds.all for r in rows], dtype=np.int16),
+            wind_speed=np.array([r.wind.speed for r in rows], dtype=np.float64),
+            wind_deg=np.array([r.wind.deg for r in rows], dtype=np.int16),
+            wind_gust=np.array([nan if r.wind.gust == NO_GUST else r.wind.gust for r in rows],
+                               dtype=np.float64),
+            visibility=np.array([nan if r.visibility is None else r.visibility for r in rows],
+                                dtype=np.float64),
+            pop=np.array([r.pop for r in rows], dtype=np.float64),
+            rain=np.array([nan if r.rain is None or r.rain.rain_amount is None
+                           else r.rain.rain_amount for r in rows], dtype=np.float64),
+            weather=[r.weather for r in rows],
+            pod=[r.sys.pod for r in rows],
+            dt_txt=[r.dt_txt for r in rows])
+
+    @staticmethod
+    def from_dict(obj: Any, units_of_measure: str) -> 'ForecastColumns':
+        """
+        :param obj                :      The Forecast information.
+        :param units_of_measure   :      The units of measure.
+
+        :return:                         ForecastColumns information, built straight from the
+                                         payload without the ListObj objects.
+        """
+        _require_numpy()
+        rows = obj.get("list")
+        mains = [r.get("main") for r in rows]
+        winds = [r.get("wind") for r in rows]
+        nan = np.nan
+        to_units = visibility_in_miles if units_of_measure == "imperial" else visibility_in_km
+        visibility = np.array([nan if r.get("visibility") is None
+                               else to_units(float(r.get("visibility"))) for r in rows],
+                              dtype=np.float64)
+        return ForecastColumns(
+            units_of_measure, int(obj.get("cod")), int(obj.get("message")),
+            City.from_dict(obj.get("city")),
+            dt=np.array([r.get("dt") for r in rows], dtype=np.int64),
+            temp=np.array([m.get("temp") for m in mains], dtype=np.float64),
+            feels_like=np.array([m.get("feels_like") for m in mains], dtype=np.float64),
+            temp_min=np.array([m.get("temp_min") for m in mains], dtype=np.float64),
+            temp_max=np.array([m.get("temp_max") for m in mains], dtype=np.float64),
+            pressure=np.array([m.get("pressure") for m in mains], dtype=np.int32),
+            sea_level=np.array([m.get("sea_level") for m in mains], dtype=np.int32),
+            grnd_level=np.array([m.get("grnd_level") for m in mains], dtype=np.int32),
+            humidity=np.array([m.get("humidity") for m in mains], dtype=np.int16),
+            temp_kf=np.array([m.get("temp_kf") for m in mains], dtype=np.float64),
+            clouds=np.array([r.get("clouds").get("all") for r in rows], dtype=np.int16),
+            wind_speed=np.array([w.get("speed") for w in winds], dtype=np.float64),
+            wind_deg=np.array([w.get("deg") for w in winds], dtype=np.int16),
+            wind_gust=np.array([nan if w.get("gust") is None else w.get("gust") for w in winds],
+                               dtype=np.float64),
+            visibility=visibility,
+            pop=np.array([r.get("pop") for r in rows], dtype=np.float64),
+            rain=np.array([nan if r.get("rain") is None or r.get("rain").get("3h") is None
+                           else r.get("rain").get("3h") for r in rows], dtype=np.float64),
+            weather=[[Weather.from_dict(y) for y in r.get("weather")] for r in rows],
+            pod=[str(r.get("sys").get("pod")) for r in rows],
+            dt_txt=[str(r.get("dt_txt")) for r in rows])
+
+    def __len__(self) -> int:
+        return 0 if self.dt is None else len(self.dt)
+
+    def to_list_obj(self) -> List[ListObj]:
+        """
+        :return:       The ListObj rows, as used by the home.html template.
+        """
+        rows = []
+        for i in range(len(self)):
+            gust = self.wind_gust[i]
+            visibility = self.visibility[i]
+            rain = self.rain[i]
+            rows.append(ListObj(
+                int(self.dt[i]),
+                Main(float(self.temp[i]), float(self.feels_like[i]), float(self.temp_min[i]),
+                     float(self.temp_max[i]), int(self.pressure[i]), int(self.sea_level[i]),
+                     int(self.grnd_level[i]), int(self.humidity[i]), float(self.temp_kf[i])),
+                self.weather[i],
+                Clouds(int(self.clouds[i])),
+                Wind(float(self.wind_speed[i]), int(self.wind_deg[i]),
+                     NO_GUST if np.isnan(gust) else float(gust)),
+                None if np.isnan(visibility) else float(visibility),
+                float(self.pop[i]),
+                None if np.isnan(rain) else Rain(float(rain), "3h"),
+                Sys(self.pod[i]),
+                self.dt_txt[i]))
+        return rows
+
+    def to_forecast(self) -> Forecast:
+        """
+        :return:       The Forecast with the ListObj rows.
+        """
+        return Forecast(self.cod, self.message, len(self), self.to_list_obj(), self.city)
+
+    def _day_index(self, local_time: bool = True):
+        """
+        :param local_time     :      Split the days at the city's local midnight instead of UTC.
+
+        :return:                     Tuple of the day of each group (days since the epoch) and
+                                     the index of the first row of each group.
+        """
+        offset = self.city.timezone if local_time and self.city is not None \
+            and self.city.timezone is not None else 0
+        days = (self.dt + offset) // 86400
+        # The rows are sorted by dt so the days are already grouped together.
+        return np.unique(days, return_index=True)
+
+    def daily(self, column: str, local_time: bool = True) -> Dict[str, Any]:
+        """
+        :param column         :      The name of the numeric column, e.g. temp or humidity.
+        :param local_time     :      Split the days at the city's local midnight instead of UTC.
+
+        :return:                     Dictionary of the day (days since the epoch) and the
+                                     minimum, maximum and mean of the column for each day.
+        """
+        values = np.asarray(getattr(self, column), dtype=np.float64)
+        days, starts = self._day_index(local_time)
+        # Missing values are nan and are left out of the mean.
+        present = ~np.isnan(values)
+        sums = np.add.reduceat(np.where(present, values, 0.0), starts)
+        counts = np.add.reduceat(present.astype(np.int64), starts)
+        return {"day": days,
+                "min": np.fmin.reduceat(values, starts),
+                "max": np.fmax.reduceat(values, starts),
+                "mean": np.divide(sums, counts, out=np.full(len(starts), np.nan),
+                                  where=counts > 0)}
+
+    def daily_precipitation(self, local_time: bool = True) -> Dict[str, Any]:
+        """
+        :param local_time     :      Split the days at the city's local midnight instead of UTC.
+
+        :return:                     Dictionary of the day (days since the epoch), the total
+                                     rain in mm and the highest probability of precipitation.
+        """
+        days, starts = self._day_index(local_time)
+        return {"day": days,
+                "rain": np.add.reduceat(np.nan_to_num(self.rain), starts),
+                "pop": np.maximum.reduceat(self.pop, starts)}
+
+    def to_units(self, units_of_measure: str) -> 'ForecastColumns':
+        """
+        :param units_of_measure    :      The units of measure to convert to (standard, metric
+                                          or imperial).
+
+        :return:                          New ForecastColumns in the units of measure.
+        """
+        source = self.units_of_measure
+        if source == units_of_measure:
+            return self
+        changes: Dict[str, Any] = {"units_of_measure": units_of_measure}
+        for name in _TEMPERATURE_COLUMNS:
+            changes[name] = np.round(
+                temperature_in_units(getattr(self, name), source, units_of_measure), 2)
+        for name in _WIND_SPEED_COLUMNS:
+            changes[name] = np.round(
+                wind_speed_in_units(getattr(self, name), source, units_of_measure), 2)
+        changes["visibility"] = np.round(
+            visibility_in_units(self.visibility, source, units_of_measure), 2)
+        return replace(self, **changes)
+
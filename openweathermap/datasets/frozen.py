@@ -0,0 +1,72 @@
+"""
+This python script is for the frozen variants of the openweather API dataclasses. A frozen
+copy is slotted and can not be changed, so it is safe to share between requests from a cache.
+"""
+from dataclasses import field, fields, is_dataclass, make_dataclass
+from typing import Any, Dict
+
+from openweathermap.datasets import current_weather, forecast, location, shared
+from openweathermap.datasets.lazy import LazyList
+
+_frozen_classes: Dict[type, type] = {}
+
+
+def frozen_class(cls: type, name: str | None = None) -> type:
+    """
+    :param cls       :      The dataclass, e.g. Location or Forecast.
+    :param name      :      The name of the frozen variant. Defaults to Frozen and the name of
+                            the dataclass.
+
+    :return:                The frozen, slotted variant of the dataclass with the same fields.
+                            It is bound to its name in this module, so it can be pickled.
+    """
+    frozen = _frozen_classes.get(cls)
+    if frozen is None:
+        name = name or f"Frozen{cls.__name__}"
+        if globals().get(name) is not None:
+            # Another dataclass of the same name, e.g. the Main of the forecast.
+            name = f"Frozen{cls.__module__.rsplit('.', 1)[-1].title().replace('_', '')}" \
+                   f"{cls.__name__}"
+        frozen = make_dataclass(name,
+                                [(f.name, f.type, field(default=f.default)) for f in fields(cls)],
+                                frozen=True, slots=True)
+        frozen.__module__ = __name__
+        frozen.__qualname__ = name
+        globals()[name] = frozen
+        _frozen_classes[cls] = frozen
+    return frozen
+
+
+# The frozen variants of the API dataclasses are created when the module is imported, so they
+# exist before a pickled copy is loaded in another process.
+FrozenCoord = frozen_class(shared.Coord)
+FrozenClouds = frozen_class(shared.Clouds)
+FrozenWeather = frozen_class(shared.Weather)
+FrozenRain = frozen_class(shared.Rain)
+FrozenSnow = frozen_class(shared.Snow)
+FrozenWind = frozen_class(shared.Wind)
+FrozenLocation = frozen_class(location.Location)
+FrozenCurrentWeatherMain = frozen_class(current_weather.Main, "FrozenCurrentWeatherMain")
+FrozenCurrentWeatherSys = frozen_class(current_weather.Sys, "FrozenCurrentWeatherSys")
+FrozenCurrentWeatherData = frozen_class(current_weather.CurrentWeatherData)
+FrozenCity = frozen_class(forecast.City)
+FrozenForecastMain = frozen_class(forecast.Main, "FrozenForecastMain")
+FrozenForecastSys = frozen_class(forecast.Sys, "FrozenForecastSys")
+FrozenListObj = frozen_class(forecast.ListObj)
+FrozenForecast = frozen_class(forecast.Forecast)
+
+
+def freeze(obj: Any) -> Any:
+    """
+    :param obj      :      The dataclass object to freeze.
+
+    :return:               The frozen copy of the object. Nested dataclasses are frozen and
+                           lists become tuples.
+    """
+    if is_dataclass(obj) and not isinstance(obj, type):
+        if type(obj) in _frozen_classes.values():
+            return obj
+        return frozen_class(type(obj))(*(freeze(getattr(obj, f.name)) for f in fields(obj)))
+    if isinstance(obj, (list, LazyList)):
+        return tuple(freeze(value) for value in obj)
+    return obj
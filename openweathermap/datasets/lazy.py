@@ -0,0 +1,73 @@
+"""
+This python script is for the lazy list of the openweather API dataclasses. The raw json rows are
+kept and each row is only built into its dataclass when it is indexed, sliced or iterated, then
+kept so it is built once.
+"""
+from collections.abc import Sequence
+from typing import Any, Callable, List, Optional
+
+# Marks the rows that were not built yet, since a built row is never this object.
+_MISSING = object()
+
+
+class LazyList(Sequence):
+    """Class representing a read only list whose items are built on first access"""
+
+    __slots__ = ("_rows", "_build", "_items", "keys")
+
+    def __init__(self, rows: Sequence, build: Callable[[Any], Any],
+                 keys: Optional[List[Any]] = None):
+        """
+        :param rows       :      The raw rows, e.g. the json rows of the forecast list.
+        :param build      :      Function building the item of a row.
+        :param keys       :      The sorted key of each row, e.g. its dt, so a window of the
+                                 rows is found without building them.
+        """
+        self._rows = rows
+        self._build = build
+        self._items: List[Any] = [_MISSING] * len(rows)
+        self.keys = keys
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._items)))]
+        item = self._items[index]
+        if item is _MISSING:
+            # Two threads may build the same row at the same time. Both build an equal item.
+            item = self._items[index] = self._build(self._rows[index])
+        return item
+
+    def __iter__(self):
+        for index in range(len(self._items)):
+            yield self[index]
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (LazyList, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"LazyList({self.built}/{len(self)} built)"
+
+    def __reduce__(self):
+        # The build function may not be picklable, so the copy is a plain list.
+        return list, (list(self),)
+
+    @property
+    def built(self) -> int:
+        """
+        :return:       The number of rows built so far.
+        """
+        return sum(item is not _MISSING for item in self._items)
+
+    def map(self, func: Callable[[Any], Any]) -> 'LazyList':
+        """
+        :param func      :      Function converting an item, e.g. to other units of measure.
+
+        :return:                New LazyList of the converted items. An item is only built and
+                                converted when the new list is accessed.
+        """
+        return LazyList(self, func, self.keys)
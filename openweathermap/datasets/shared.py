@@ -4,10 +4,10 @@ and forecast for the openweather API.
 """
 import os
 from dataclasses import dataclass, field
-from typing import Any, Optional
+from typing import Any, Dict, Optional
 
 
-@dataclass
+@dataclass(slots=True)
 class Coord:
     """Class representing the location latitude and longitude"""
     lon: Optional[float] = field(default=None)
@@ -25,7 +25,7 @@ class Coord:
         return Coord(_lon, _lat)
 
 
-@dataclass
+@dataclass(slots=True)
 class Clouds:
     """Class representing a cloud information"""
     all: Optional[int] = field(default=None)
@@ -41,7 +41,7 @@ class Clouds:
         return Clouds(_all)
 
 
-@dataclass
+@dataclass(slots=True)
 class Weather:
     """Class representing a weather information"""
     id: Optional[int] = field(default=None)
@@ -63,7 +63,7 @@ class Weather:
         return Weather(_id, _main, _description, _icon)
 
 
-@dataclass
+@dataclass(slots=True)
 class Rain:
     """Class representing a rain information"""
     rain_amount: Optional[float] = field(default=None)
@@ -82,7 +82,7 @@ class Rain:
         return Rain(_rain_amount, _rain_type)
 
 
-@dataclass
+@dataclass(slots=True)
 class Snow:
     """Class representing a snow information"""
     snow_amount: Optional[float] = field(default=None)
@@ -101,7 +101,7 @@ class Snow:
         return Snow(_snow_amount, _snow_type)
 
 
-@dataclass
+@dataclass(slots=True)
 class Wind:
     """Class representing a wind information"""
     speed: Optional[float] = field(default=None)
@@ -160,3 +160,20 @@ class Formats:
                            _wind_speed_format, _wind_direction_format, _visibility_format)
         except (IndexError, ValueError, TypeError, AttributeError, ImportError, NameError) as e:
             raise e
+
+    @staticmethod
+    def for_units(units_of_measure: Optional[str]) -> 'Formats':
+        """
+        :param units_of_measure      :      The units of measure information.
+
+        :return:                            The different formats' information. They are read
+                                            once per unit system and shared by every request.
+        """
+        formats = _formats_by_units.get(units_of_measure)
+        if formats is None:
+            formats = _formats_by_units[units_of_measure] = \
+                Formats.set_format_items(units_of_measure)
+        return formats
+
+
+_formats_by_units: Dict[Optional[str], Formats] = {}
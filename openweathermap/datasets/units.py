@@ -0,0 +1,161 @@
+"""
+This python script is for the units of measure of the openweather API dataclasses. The responses
+are fetched and cached once in the canonical units and converted to the units of each request,
+so one upstream fetch serves every unit system.
+"""
+import time
+from dataclasses import replace
+from typing import Any, Callable, Optional
+
+from openweathermap.cache.lru import LRUCache
+from openweathermap.datasets.current_weather import CurrentWeatherData
+from openweathermap.datasets.forecast import Forecast, ListObj
+from openweathermap.datasets.lazy import LazyList
+from openweathermap.datasets.shared import Wind
+from utils.property_conversions import (temperature_in_units, visibility_in_units,
+                                        wind_speed_in_units)
+
+# Kelvin and meters/sec. The visibility is parsed to km as for the metric units.
+CANONICAL_UNITS = "standard"
+UNITS = ("standard", "metric", "imperial")
+
+# The value used by Wind.from_dict when there is no gust.
+_NO_GUST = -999999.0
+_TEMPERATURE_FIELDS = ("temp", "feels_like", "temp_min", "temp_max")
+
+# The converted dataclasses by the canonical one and the units, so a cached response is converted
+# once per unit system. The entry keeps the canonical dataclass so its id is not reused.
+_converted = LRUCache(1024)
+_CONVERTED_TTL = 3600
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    """
+    :param value      :      The converted value.
+
+    :return:                 The value rounded to 2 decimals like the openweather API.
+    """
+    return None if value is None else round(value, 2)
+
+
+def _main_in_units(main: Any, from_units: str, to_units: str) -> Any:
+    """
+    :param main            :      The Main of the current weather or of a forecast row.
+    :param from_units      :      The units of measure of the Main.
+    :param to_units        :      The units of measure to convert to.
+
+    :return:                      The Main in to_units.
+    """
+    if main is None:
+        return None
+    changes = {name: _round(temperature_in_units(getattr(main, name), from_units, to_units))
+               for name in _TEMPERATURE_FIELDS if getattr(main, name) is not None}
+    temp_kf = getattr(main, "temp_kf", None)
+    if temp_kf is not None:
+        # A temperature difference only changes its scale.
+        changes["temp_kf"] = _round(temperature_in_units(temp_kf, from_units, to_units)
+                                    - temperature_in_units(0.0, from_units, to_units))
+    return replace(main, **changes)
+
+
+def _wind_in_units(wind: Optional[Wind], from_units: str, to_units: str) -> Optional[Wind]:
+    """
+    :param wind            :      The Wind.
+    :param from_units      :      The units of measure of the Wind.
+    :param to_units        :      The units of measure to convert to.
+
+    :return:                      The Wind in to_units.
+    """
+    if wind is None:
+        return None
+    gust = wind.gust if wind.gust in (None, _NO_GUST) \
+        else _round(wind_speed_in_units(wind.gust, from_units, to_units))
+    speed = None if wind.speed is None \
+        else _round(wind_speed_in_units(wind.speed, from_units, to_units))
+    return replace(wind, speed=speed, gust=gust)
+
+
+def _visibility_in_units(visibility: Optional[float], from_units: str,
+                         to_units: str) -> Optional[float]:
+    """
+    :param visibility      :      The visibility in km, or in miles when imperial.
+    :param from_units      :      The units of measure of the visibility.
+    :param to_units        :      The units of measure to convert to.
+
+    :return:                      The visibility in to_units.
+    """
+    return None if visibility is None \
+        else _round(visibility_in_units(visibility, from_units, to_units))
+
+
+def _memoized(data: Any, to_units: str, convert: Callable[[], Any]) -> Any:
+    """
+    :param data          :      The canonical dataclass.
+    :param to_units      :      The units of measure to convert to.
+    :param convert       :      Function returning the converted dataclass.
+
+    :return:                    The converted dataclass, converted once while it is cached.
+    """
+    key = (id(data), to_units)
+    entry = _converted.get(key)
+    if entry is not None and entry[0][0] is data:
+        return entry[0][1]
+    converted = convert()
+    _converted.put(key, (data, converted), time.time() + _CONVERTED_TTL)
+    return converted
+
+
+def current_weather_in_units(data: Optional[CurrentWeatherData], to_units: Optional[str],
+                             from_units: str = CANONICAL_UNITS) -> Optional[CurrentWeatherData]:
+    """
+    :param data            :      The CurrentWeatherData.
+    :param to_units        :      The units of measure to convert to.
+    :param from_units      :      The units of measure of the CurrentWeatherData.
+
+    :return:                      New CurrentWeatherData in to_units, or the same one when the
+                                  units are the same or there is nothing to convert.
+    """
+    to_units = to_units or CANONICAL_UNITS
+    if data is None or data.main is None or to_units == from_units:
+        return data
+    return _memoized(data, to_units, lambda: replace(
+        data, main=_main_in_units(data.main, from_units, to_units),
+        wind=_wind_in_units(data.wind, from_units, to_units),
+        visibility=_visibility_in_units(data.visibility, from_units, to_units)))
+
+
+def _row_in_units(row: ListObj, from_units: str, to_units: str) -> ListObj:
+    """
+    :param row             :      The forecast row.
+    :param from_units      :      The units of measure of the row.
+    :param to_units        :      The units of measure to convert to.
+
+    :return:                      The row in to_units.
+    """
+    return replace(row, main=_main_in_units(row.main, from_units, to_units),
+                   wind=_wind_in_units(row.wind, from_units, to_units),
+                   visibility=_visibility_in_units(row.visibility, from_units, to_units))
+
+
+def forecast_in_units(forecast: Optional[Forecast], to_units: Optional[str],
+                      from_units: str = CANONICAL_UNITS) -> Optional[Forecast]:
+    """
+    :param forecast        :      The Forecast.
+    :param to_units        :      The units of measure to convert to.
+    :param from_units      :      The units of measure of the Forecast.
+
+    :return:                      New Forecast in to_units, or the same one when the units are
+                                  the same or there is nothing to convert. The columnar form is
+                                  converted with ForecastColumns.to_units.
+    """
+    to_units = to_units or CANONICAL_UNITS
+    if forecast is None or not forecast.list_obj or to_units == from_units:
+        return forecast
+    if isinstance(forecast.list_obj, LazyList):
+        # The rows are converted when they are used, like they are parsed.
+        return _memoized(forecast, to_units, lambda: replace(
+            forecast, list_obj=forecast.list_obj.map(
+                lambda row: _row_in_units(row, from_units, to_units))))
+    return _memoized(forecast, to_units, lambda: replace(
+        forecast, list_obj=[_row_in_units(row, from_units, to_units)
+                            for row in forecast.list_obj]))
@@ -0,0 +1,280 @@
+"""
+This python script is for the offline geocoding index built from the openweather bulk city list
+(city.list.json.gz). The list is streamed into a SQLite file keyed by the normalized name,
+country and state so get_lan_lon can resolve most cities without calling the geocoding API.
+
+    python -m openweathermap.geocode_index city.list.json.gz [--index .cache/cities.sqlite3]
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import unicodedata
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+from openweathermap.datasets.location import Location
+from utils.get_class_name import get_full_class_name
+
+logger = logging.getLogger(__name__)
+
+# Get configuration information
+load_dotenv()
+
+_CHUNK_SIZE = 1 << 16
+_BATCH_SIZE = 10000
+_COLUMNS = "id, name, state, country, lat, lon"
+_INSERT = "INSERT OR REPLACE INTO cities VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def normalize(value: Optional[str]) -> str:
+    """
+    :param value      :      The name, state or country to normalize.
+
+    :return:                 The value without accents, case folded and with the whitespace
+                             collapsed, e.g. "sao paulo" for "São  Paulo".
+    """
+    decomposed = unicodedata.normalize("NFKD", str(value or ""))
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.split()).casefold()
+
+
+def iter_city_list(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    :param path      :      The city list, a json array that may be gzipped.
+
+    :return:                Iterator of the cities. The file is decoded one chunk at a time so
+                            the whole list is never in memory.
+    """
+    decoder = json.JSONDecoder()
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as city_file:
+        buffer = ""
+        position = 0
+        started = False
+        eof = False
+        while True:
+            # Skip the whitespace, the opening bracket and the commas between the cities.
+            while position < len(buffer) and buffer[position] in " \t\r\n,[":
+                started = started or buffer[position] == "["
+                position += 1
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            if started and position < len(buffer):
+                try:
+                    city, position = decoder.raw_decode(buffer, position)
+                    yield city
+                    continue
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+            elif eof:
+                return
+            # The next city is not complete yet, so read more of the file.
+            chunk = city_file.read(_CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
+def _row(city: Dict[str, Any]) -> tuple:
+    """
+    :param city      :      A city of the city list.
+
+    :return:                The row of the index.
+    """
+    coord = city.get("coord") or {}
+    return (normalize(city.get("name")), normalize(city.get("country")),
+            normalize(city.get("state")), int(city.get("id")), str(city.get("name")),
+            str(city.get("state") or ""), str(city.get("country") or ""),
+            float(coord.get("lat")), float(coord.get("lon")))
+
+
+def build_index(cities: Iterable[Dict[str, Any]], path: str) -> int:
+    """
+    :param cities      :      The cities, e.g. iter_city_list("city.list.json.gz").
+    :param path        :      The SQLite file of the index. It is replaced once the new index
+                              is complete so readers never see a partial index.
+
+    :return:                  The number of cities in the index.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    building = f"{path}.building"
+    if os.path.exists(building):
+        os.remove(building)
+    count = 0
+    conn = sqlite3.connect(building)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        # The rows are clustered by the lookup key so an exact or prefix lookup is a range scan.
+        conn.execute("CREATE TABLE cities (name_key TEXT NOT NULL, country_key TEXT NOT NULL, "
+                     "state_key TEXT NOT NULL, id INTEGER NOT NULL, name TEXT, state TEXT, "
+                     "country TEXT, lat REAL, lon REAL, "
+                     "PRIMARY KEY (name_key, country_key, state_key, id)) WITHOUT ROWID")
+        batch = []
+        for city in cities:
+            try:
+                batch.append(_row(city))
+            except (TypeError, ValueError, AttributeError) as e:
+                logger.warning("%s: %s", get_full_class_name(e), e.args)
+                continue
+            if len(batch) >= _BATCH_SIZE:
+                conn.executemany(_INSERT, batch)
+                count += len(batch)
+                batch.clear()
+        conn.executemany(_INSERT, batch)
+        count += len(batch)
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.replace(building, path)
+    return count
+
+
+def _location(row: tuple) -> Location:
+    """
+    :param row      :      The id, name, state, country, lat and lon of a city.
+
+    :return:               The Location of the city.
+    """
+    _, name, state, country, lat, lon = row
+    return Location(name, None, lat, lon, country, state)
+
+
+class GeocodeIndex:
+    """Class representing the read only offline geocoding index"""
+
+    def __init__(self, path: str):
+        """
+        :param path      :      The SQLite file written by build_index.
+        """
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def from_env() -> Optional['GeocodeIndex']:
+        """
+        :return:       GeocodeIndex configured from the environment or None when
+                       OWM_GEO_INDEX_PATH is not set or the index was not built.
+        """
+        path = os.getenv("OWM_GEO_INDEX_PATH", "")
+        if not path or not os.path.exists(path):
+            return None
+        return GeocodeIndex(path)
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        :return:       The read only SQLite connection for the current thread.
+        """
+        conn: sqlite3.Connection | None = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, city_name: str, state_code: Optional[str] = None,
+               country_code: Optional[str] = None, limit: int = 1) -> List[Location]:
+        """
+        :param city_name         :      The city name.
+        :param state_code        :      The state code. Cities without a state, which is every
+                                        city outside the US, match any state.
+        :param country_code      :      The country code. Any country when not given.
+        :param limit             :      The maximum number of locations.
+
+        :return:                        The locations with exactly the normalized name, the ones
+                                        in the given state first.
+        """
+        state = normalize(state_code)
+        sql = f"SELECT {_COLUMNS} FROM cities WHERE name_key = ?"
+        args: list = [normalize(city_name)]
+        if country_code:
+            sql += " AND country_key = ?"
+            args.append(normalize(country_code))
+        if state:
+            sql += " AND state_key IN (?, '')"
+            args.append(state)
+        sql += " ORDER BY state_key = '', id LIMIT ?"
+        rows = self._connection().execute(sql, (*args, limit)).fetchall()
+        return [_location(row) for row in rows]
+
+    def prefix(self, prefix: str, state_code: Optional[str] = None,
+               country_code: Optional[str] = None, limit: int = 10) -> List[Location]:
+        """
+        :param prefix            :      The start of the city name.
+        :param state_code        :      The state code. Any state when not given.
+        :param country_code      :      The country code. Any country when not given.
+        :param limit             :      The maximum number of locations.
+
+        :return:                        The locations whose normalized name starts with the
+                                        prefix, in name order.
+        """
+        start = normalize(prefix)
+        sql = f"SELECT {_COLUMNS} FROM cities WHERE name_key >= ? AND name_key < ?"
+        args: list = [start, start + "\U0010ffff"]
+        if country_code:
+            sql += " AND country_key = ?"
+            args.append(normalize(country_code))
+        if state_code:
+            sql += " AND state_key = ?"
+            args.append(normalize(state_code))
+        sql += " ORDER BY name_key, id LIMIT ?"
+        rows = self._connection().execute(sql, (*args, limit)).fetchall()
+        return [_location(row) for row in rows]
+
+    def locations(self) -> Iterator[Location]:
+        """
+        :return:       Iterator of the Location of every city in the index.
+        """
+        try:
+            for row in self._connection().execute(f"SELECT {_COLUMNS} FROM cities"):
+                yield _location(row)
+        except sqlite3.Error as e:
+            logger.warning("%s: %s", get_full_class_name(e), e.args)
+
+    def resolve(self, city_name: str, state_code: str, country_code: str) -> Optional[Location]:
+        """
+        :param city_name:      The city name to get the latitude and longitude from.
+        :param state_code:     The state code to get the latitude and longitude from.
+        :param country_code:   The country code to get the latitude and longitude from.
+
+        :return:               The Location of the city or None when it is not in the index.
+        """
+        try:
+            locations = self.lookup(city_name, state_code, country_code)
+        except sqlite3.Error as e:
+            logger.warning("%s: %s", get_full_class_name(e), e.args)
+            locations = []
+        with self._lock:
+            if locations:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return locations[0] if locations else None
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    :param argv      :      The command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Build the offline geocoding index.")
+    parser.add_argument("city_list", help="city.list.json.gz from bulk.openweathermap.org")
+    parser.add_argument("--index", default=os.getenv("OWM_GEO_INDEX_PATH")
+                        or ".cache/cities.sqlite3", help="SQLite file of the index")
+    args = parser.parse_args(argv)
+    count = build_index(iter_city_list(args.city_list), args.index)
+    print(f"Indexed {count} cities in {args.index}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""
+This python script is for the history of the current weather and forecast responses. Every
+response fetched from the openweather API is appended to a SQLite table of the day it belongs
+to, keyed by the location id and the timestamp, so a range of days for one location only reads
+the tables of those days. The writes are queued and made in batches by a background thread so
+the requests never wait for the disk.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from openweathermap.cache.response import CURRENT, FORECAST
+from openweathermap.datasets.current_weather import CurrentWeatherData
+from openweathermap.datasets.decoders import decode_json, get_decoder
+from openweathermap.datasets.forecast import Forecast
+from utils.get_class_name import get_full_class_name
+
+logger = logging.getLogger(__name__)
+
+# Get configuration information
+load_dotenv()
+
+# The kinds of history, CURRENT and FORECAST, are the prefixes of the day tables.
+_CLASSES = {CURRENT: CurrentWeatherData, FORECAST: Forecast}
+_DAY_SECONDS = 86400
+
+# A queued response: kind, units of measure, fetched at, decoded payload and raw body.
+Record = Tuple[str, Optional[str], int, Any, Optional[bytes]]
+
+
+def _day(timestamp: int) -> str:
+    """
+    :param timestamp      :      The unix timestamp.
+
+    :return:                     The UTC day of the timestamp, e.g. 20251018.
+    """
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y%m%d")
+
+
+def _row(record: Record) -> Tuple[str, tuple]:
+    """
+    :param record      :      The queued response.
+
+    :return:                  Tuple of the day table and the row to insert. The current weather
+                              is keyed by its observation time and a forecast by the time it was
+                              fetched.
+    """
+    kind, units_of_measure, fetched_at, payload, body = record
+    if kind == CURRENT:
+        location_id, timestamp = int(payload.get("id") or 0), int(payload.get("dt"))
+        coord = payload.get("coord") or {}
+    else:
+        city = payload.get("city") or {}
+        location_id, timestamp = int(city.get("id") or 0), fetched_at
+        coord = city.get("coord") or {}
+    if body is None:
+        body = json.dumps(payload, separators=(",", ":")).encode()
+    return f"{kind}_{_day(timestamp)}", (location_id, timestamp, coord.get("lat"),
+                                         coord.get("lon"), units_of_measure,
+                                         zlib.compress(body))
+
+
+# pylint: disable=too-many-instance-attributes
+# Eight is reasonable in this case.
+class HistoryStore:
+    """Class representing the append-only, day partitioned history of the responses"""
+
+    def __init__(self, path: str, batch_size: int = 500, flush_interval: float = 1.0,
+                 queue_size: int = 10000, retention_days: int = 0):
+        """
+        :param path               :      The SQLite file of the history.
+        :param batch_size         :      The maximum number of responses written in one
+                                         transaction.
+        :param flush_interval     :      The seconds a response waits for a batch to fill up.
+        :param queue_size         :      The maximum number of responses waiting to be written.
+                                         Responses are dropped instead of blocking the request
+                                         when it is full.
+        :param retention_days     :      The number of days kept. 0 keeps every day.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.written = 0
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._local = threading.local()
+        self._tables: set = set()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._writer = threading.Thread(target=self._write_loop, name="owm-history-writer",
+                                        daemon=True)
+        self._writer.start()
+
+    @staticmethod
+    def from_env() -> Optional['HistoryStore']:
+        """
+        :return:       HistoryStore configured from the environment or None when
+                       OWM_HISTORY_PATH is not set.
+        """
+        path = os.getenv("OWM_HISTORY_PATH", "")
+        if not path:
+            return None
+        return HistoryStore(path,
+                            batch_size=int(os.getenv("OWM_HISTORY_BATCH_SIZE", "500")),
+                            flush_interval=float(os.getenv("OWM_HISTORY_FLUSH_INTERVAL", "1")),
+                            queue_size=int(os.getenv("OWM_HISTORY_QUEUE_SIZE", "10000")),
+                            retention_days=int(os.getenv("OWM_HISTORY_RETENTION_DAYS", "0")))
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        :return:       The SQLite connection for the current thread.
+        """
+        conn: sqlite3.Connection | None = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record(self, kind: str, payload: Any, units_of_measure: Optional[str],
+               body: Optional[bytes] = None) -> None:
+        """
+        :param kind                  :      The kind of response, current or forecast.
+        :param payload               :      The decoded response.
+        :param units_of_measure      :      The units of measure of the response.
+        :param body                  :      The raw response body. It is encoded from the payload
+                                            by the writer when not given.
+        """
+        try:
+            self._queue.put_nowait((kind, units_of_measure, int(time.time()), payload, body))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write_loop(self) -> None:
+        """
+        Write the queued responses in batches until None is queued.
+        """
+        while True:
+            record = self._queue.get()
+            batch: List[Record] = []
+            deadline = time.monotonic() + self.flush_interval
+            while record is not None:
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+                for _ in batch:
+                    self._queue.task_done()
+            if record is None:
+                self._queue.task_done()
+                return
+
+    def _write(self, batch: List[Record]) -> None:
+        """
+        :param batch      :      The responses to write in one transaction.
+        """
+        # The days before the retention are not written, they would be removed right away.
+        cutoff = _day(int(time.time()) - self.retention_days * _DAY_SECONDS) \
+            if self.retention_days > 0 else ""
+        rows: Dict[str, List[tuple]] = {}
+        for record in batch:
+            try:
+                table, row = _row(record)
+            except (TypeError, ValueError, AttributeError) as e:
+                logger.warning("%s: %s", get_full_class_name(e), e.args)
+                continue
+            if table[-8:] >= cutoff:
+                rows.setdefault(table, []).append(row)
+        try:
+            with self._connection() as conn:
+                new_tables = rows.keys() - self._tables
+                for table, table_rows in rows.items():
+                    if table in new_tables:
+                        self._create_table(conn, table)
+                    conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?, ?, ?)",
+                                     table_rows)
+                # A new day started, so the oldest day may be past the retention now.
+                if new_tables and cutoff:
+                    self.purge(int(time.time()) - self.retention_days * _DAY_SECONDS, conn)
+            self._tables.update(new_tables)
+            self.written += sum(len(table_rows) for table_rows in rows.values())
+        except sqlite3.Error as e:
+            logger.warning("%s: %s", get_full_class_name(e), e.args)
+
+    @staticmethod
+    def _create_table(conn: sqlite3.Connection, table: str) -> None:
+        """
+        :param conn       :      The connection of the writer.
+        :param table      :      The day table to create, e.g. current_20251018.
+        """
+        # The rows are stored in primary key order so a location's rows are next to each other.
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (location_id INTEGER NOT NULL, "
+                     "dt INTEGER NOT NULL, lat REAL, lon REAL, units TEXT, payload BLOB NOT NULL, "
+                     "PRIMARY KEY (location_id, dt)) WITHOUT ROWID")
+
+    def _day_tables(self, conn: sqlite3.Connection, kind: str, start: int,
+                    end: int) -> List[str]:
+        """
+        :param conn       :      The connection to read with.
+        :param kind       :      The kind of response, current or forecast.
+        :param start      :      The first unix timestamp.
+        :param end        :      The last unix timestamp.
+
+        :return:                 The existing day tables between start and end, oldest first.
+        """
+        return [name for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name BETWEEN ? AND ? "
+            "ORDER BY name", (f"{kind}_{_day(start)}", f"{kind}_{_day(end)}"))]
+
+    def purge(self, before: int, conn: Optional[sqlite3.Connection] = None) -> int:
+        """
+        :param before      :      The unix timestamp. The days before its day are removed.
+        :param conn        :      The connection to use. Defaults to the current thread's.
+
+        :return:                  The number of day tables removed.
+        """
+        conn = conn or self._connection()
+        removed = 0
+        for kind in _CLASSES:
+            for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                        "AND name >= ? AND name < ?",
+                                        (f"{kind}_", f"{kind}_{_day(before)}")).fetchall():
+                conn.execute(f"DROP TABLE {name}")
+                self._tables.discard(name)
+                removed += 1
+        return removed
+
+    def rows(self, kind: str, location_id: int, start: int,
+             end: Optional[int] = None) -> Iterator[Tuple[int, Optional[str], Any]]:
+        """
+        :param kind             :      The kind of response, current or forecast.
+        :param location_id      :      The id of the location, CurrentWeatherData.id or City.id.
+        :param start            :      The first unix timestamp.
+        :param end              :      The last unix timestamp. Defaults to now.
+
+        :return:                       Iterator of the timestamp, units of measure and decoded
+                                       payload of each response, oldest first.
+        """
+        end = int(time.time()) if end is None else end
+        conn = self._connection()
+        for table in self._day_tables(conn, kind, start, end):
+            for timestamp, units, payload in conn.execute(
+                    f"SELECT dt, units, payload FROM {table} WHERE location_id = ? "
+                    "AND dt BETWEEN ? AND ? ORDER BY dt", (location_id, start, end)):
+                yield timestamp, units, decode_json(zlib.decompress(payload))
+
+    def history(self, kind: str, location_id: int, start: int,
+                end: Optional[int] = None) -> List[CurrentWeatherData | Forecast]:
+        """
+        :param kind             :      The kind of response, current or forecast.
+        :param location_id      :      The id of the location, CurrentWeatherData.id or City.id.
+        :param start            :      The first unix timestamp.
+        :param end              :      The last unix timestamp. Defaults to now.
+
+        :return:                       The CurrentWeatherData or Forecast responses, oldest
+                                       first.
+        """
+        cls = _CLASSES[kind]
+        return [get_decoder(cls, units)(payload)
+                for _, units, payload in self.rows(kind, location_id, start, end)]
+
+    def last_days(self, kind: str, location_id: int,
+                  days: int) -> List[CurrentWeatherData | Forecast]:
+        """
+        :param kind             :      The kind of response, current or forecast.
+        :param location_id      :      The id of the location, CurrentWeatherData.id or City.id.
+        :param days             :      The number of days, e.g. 30.
+
+        :return:                       The responses of the last days, oldest first.
+        """
+        start = datetime.now(timezone.utc) - timedelta(days=days)
+        return self.history(kind, location_id, int(start.timestamp()))
+
+    def flush(self) -> None:
+        """
+        Wait until every queued response is written.
+        """
+        self._queue.join()
+
+    def close(self) -> None:
+        """
+        Write the queued responses and stop the writer.
+        """
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
@@ -0,0 +1,257 @@
+"""
+This python script is for the in-process metrics of the openweathermap package. The counters
+and histograms are rendered in the Prometheus text format by the /metrics route.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                                      1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(labels: Dict[str, str]) -> LabelValues:
+    """
+    :param labels      :      The labels of a sample.
+
+    :return:                  The labels as a sorted tuple so they can be used as a key.
+    """
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    """
+    :param labels      :      The labels of a sample.
+    :param extra       :      An extra label, e.g. the le label of a histogram bucket.
+
+    :return:                  The labels in the Prometheus text format.
+    """
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """Class representing a monotonically increasing counter"""
+
+    def __init__(self, name: str, documentation: str):
+        """
+        :param name               :      The metric name.
+        :param documentation      :      The help text of the metric.
+        """
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        :param amount      :      The amount to add.
+        :param labels      :      The labels of the sample.
+        """
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        """
+        :param labels      :      The labels of the sample.
+
+        :return:                  The current value.
+        """
+        return self._values.get(_labels(labels), 0)
+
+    def render(self) -> List[str]:
+        """
+        :return:       The lines of the metric in the Prometheus text format.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Class representing a histogram of observed values such as latencies"""
+
+    def __init__(self, name: str, documentation: str,
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        :param name               :      The metric name.
+        :param documentation      :      The help text of the metric.
+        :param buckets            :      The upper bounds of the buckets.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        :param value       :      The observed value.
+        :param labels      :      The labels of the sample.
+        """
+        key = _labels(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            # The bucket counts followed by the sum and the count.
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 3)
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        :param labels      :      The labels of the sample.
+
+        :return:                  Iterator used by the with statement to observe the elapsed time.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        """
+        :return:       The lines of the metric in the Prometheus text format.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, counts in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    bound_text = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_format_labels(labels, ('le', bound_text))}"
+                                 f" {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {counts[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {counts[-1]}")
+        return lines
+
+
+class Gauge:
+    """Class representing a value read from a function when the metrics are rendered"""
+
+    def __init__(self, name: str, documentation: str,
+                 read: Callable[[], Dict[LabelValues, float] | float]):
+        """
+        :param name               :      The metric name.
+        :param documentation      :      The help text of the metric.
+        :param read               :      The function returning the value or the values by
+                                         labels.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def render(self) -> List[str]:
+        """
+        :return:       The lines of the metric in the Prometheus text format.
+        """
+        values = self.read()
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Registry:
+    """Class representing the metrics of the process"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Counter | Histogram | Gauge] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        """
+        :param metric      :      The metric to register.
+
+        :return:                  The registered metric. The existing one is returned when a
+                                  metric with the same name is already registered.
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        """
+        :param name               :      The metric name.
+        :param documentation      :      The help text of the metric.
+
+        :return:                         The Counter.
+        """
+        return self._register(Counter(name, documentation))
+
+    def histogram(self, name: str, documentation: str,
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """
+        :param name               :      The metric name.
+        :param documentation      :      The help text of the metric.
+        :param buckets            :      The upper bounds of the buckets.
+
+        :return:                         The Histogram.
+        """
+        return self._register(Histogram(name, documentation, buckets))
+
+    def gauge(self, name: str, documentation: str,
+              read: Callable[[], Dict[LabelValues, float] | float]) -> Gauge:
+        """
+        :param name               :      The metric name.
+        :param documentation      :      The help text of the metric.
+        :param read               :      The function returning the value or the values by
+                                         labels.
+
+        :return:                         The Gauge.
+        """
+        return self._register(Gauge(name, documentation, read))
+
+    def render(self) -> str:
+        """
+        :return:       All the metrics in the Prometheus text format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def labels(**values: str) -> LabelValues:
+    """
+    :param values      :      The labels of a gauge sample.
+
+    :return:                  The labels as the key of a gauge value.
+    """
+    return _labels(values)
+
+
+REGISTRY = Registry()
+
+UPSTREAM_REQUESTS = REGISTRY.counter("owm_upstream_requests_total",
+                                     "Requests made to the openweather API.")
+UPSTREAM_SECONDS = REGISTRY.histogram("owm_upstream_request_seconds",
+                                      "Latency of the requests made to the openweather API.")
+PARSE_SECONDS = REGISTRY.histogram("owm_parse_seconds",
+                                   "Time spent parsing the openweather API responses.")
+RENDER_SECONDS = REGISTRY.histogram("owm_render_seconds", "Time spent rendering templates.")
+UPSTREAM_RETRIES = REGISTRY.counter("owm_upstream_retries_total",
+                                    "Requests to the openweather API retried after a failure.")
+UPSTREAM_HEDGES = REGISTRY.counter("owm_upstream_hedges_total",
+                                   "Hedged requests sent after a slow openweather API request.")
+CIRCUIT_REJECTED = REGISTRY.counter("owm_circuit_rejected_total",
+                                    "Requests failed fast because the circuit was open.")
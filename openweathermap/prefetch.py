@@ -0,0 +1,369 @@
+"""
+This python script is for the background prefetcher that keeps the weather of a watchlist of
+locations warm in the weather cache. The watchlist is read from a csv file of cities and can be
+learned from the most requested locations. Each entry is refreshed shortly before it expires,
+so the interactive requests for the watched locations are served from memory.
+
+    python -m openweathermap.prefetch watchlist.csv [--learn-top 0] [--once]
+"""
+import argparse
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from openweathermap import weather
+from openweathermap.bulk import LocationQuery, read_locations
+from openweathermap.cache.response import CURRENT, FORECAST, WeatherCache
+from openweathermap.datasets.units import CANONICAL_UNITS
+from openweathermap.metrics import REGISTRY, labels
+from openweathermap.rate_limit import BACKGROUND, priority
+from utils.get_class_name import get_full_class_name
+from utils.log_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+# Get configuration information
+load_dotenv()
+
+PREFETCH_REFRESHES = REGISTRY.counter("owm_prefetch_refreshes_total",
+                                      "Background refreshes of the watched weather by result.")
+PREFETCH_LAG_SECONDS = REGISTRY.histogram(
+    "owm_prefetch_lag_seconds", "Time between the scheduled and the finished refresh.",
+    (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0))
+
+
+@dataclass(slots=True)
+class WatchedEntry:
+    """Class representing the refresh schedule of one watched cache key"""
+    lat: float = field(default=None)
+    lon: float = field(default=None)
+    learned: bool = field(default=False)
+    # The seconds before the expiry the entry is refreshed, drawn once so the entries are spread.
+    lead: float = field(default=None)
+
+
+# pylint: disable=too-many-instance-attributes
+# Twelve is reasonable in this case.
+class Prefetcher:
+    """Class representing the background refresher of the watched locations"""
+
+    def __init__(self, cache: WeatherCache, locations: Iterable[LocationQuery] = (),
+                 learn_top: int = 0, lead: float = 60, jitter: float = 30,
+                 interval: float = 5, concurrency: int = 4, max_per_minute: float = 60,
+                 fetchers: Optional[Dict[str, Callable[[float, float], object]]] = None):
+        """
+        :param cache              :      The weather cache kept warm.
+        :param locations          :      The cities of the watchlist.
+        :param learn_top          :      The number of the most requested cache keys that are
+                                         watched as well. 0 only watches the watchlist.
+        :param lead               :      The seconds before the expiry of an entry it is
+                                         refreshed.
+        :param jitter             :      The most seconds added to the lead of each entry, so
+                                         the entries cached together are not refreshed together.
+        :param interval           :      The seconds between two checks of the schedule.
+        :param concurrency        :      The maximum number of refreshes in flight.
+        :param max_per_minute     :      The maximum number of refreshes per minute.
+        :param fetchers           :      The functions fetching the weather of each kind by
+                                         latitude and longitude. Defaults to the weather fetchers.
+        """
+        self.cache = cache
+        self.locations = list(locations)
+        self.learn_top = learn_top
+        self.lead = lead
+        self.jitter = jitter
+        self.interval = interval
+        self.max_per_minute = max_per_minute
+        self.fetchers = fetchers or {CURRENT: weather.fetch_current_weather,
+                                     FORECAST: weather.fetch_forcast}
+        self.entries: Dict[Tuple, WatchedEntry] = {}
+        self._unresolved: List[LocationQuery] = list(self.locations)
+        self._in_flight: set = set()
+        self._recent: Deque[float] = deque()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._executor = ThreadPoolExecutor(max_workers=concurrency,
+                                            thread_name_prefix="owm-prefetch")
+
+    @staticmethod
+    def from_env(cache: WeatherCache, required: bool = False) -> Optional['Prefetcher']:
+        """
+        :param cache         :      The weather cache kept warm.
+        :param required      :      Return a Prefetcher even without a watchlist nor learning,
+                                    for the keys given to watch.
+
+        :return:                    Prefetcher configured from the environment or None when
+                                    there is neither a watchlist nor learning.
+        """
+        path = os.getenv("OWM_PREFETCH_WATCHLIST", "")
+        learn_top = int(os.getenv("OWM_PREFETCH_LEARN_TOP", "0"))
+        if not path and learn_top <= 0 and not required:
+            return None
+        return Prefetcher(cache, read_locations(path) if path else (), learn_top=learn_top,
+                          lead=float(os.getenv("OWM_PREFETCH_LEAD", "60")),
+                          jitter=float(os.getenv("OWM_PREFETCH_JITTER", "30")),
+                          interval=float(os.getenv("OWM_PREFETCH_INTERVAL", "5")),
+                          concurrency=int(os.getenv("OWM_PREFETCH_CONCURRENCY", "4")),
+                          max_per_minute=float(os.getenv("OWM_PREFETCH_MAX_PER_MINUTE", "60")))
+
+    def _watch(self, key: Tuple, lat: float, lon: float, learned: bool) -> None:
+        """
+        :param key          :      The cache key to keep warm.
+        :param lat          :      The latitude the weather is fetched for.
+        :param lon          :      The longitude the weather is fetched for.
+        :param learned      :      True when the key was learned from the requests.
+        """
+        with self._lock:
+            # A learned key keeps its schedule and becomes a watchlist key when it is listed.
+            if key not in self.entries or (self.entries[key].learned and not learned):
+                self.entries[key] = WatchedEntry(lat, lon, learned,
+                                                 self.lead + random.uniform(0, self.jitter))
+            self.cache.watched.add(key)
+
+    def watch(self, key: Tuple, lat: float, lon: float) -> None:
+        """
+        :param key      :      The cache key to keep warm until unwatch is called, e.g. one
+                               streamed to the dashboards.
+        :param lat      :      The latitude the weather is fetched for.
+        :param lon      :      The longitude the weather is fetched for.
+        """
+        self._watch(key, lat, lon, False)
+
+    def unwatch(self, key: Tuple) -> None:
+        """
+        :param key      :      The cache key to stop keeping warm.
+        """
+        with self._lock:
+            self.entries.pop(key, None)
+            self.cache.watched.discard(key)
+
+    def update_watchlist(self) -> None:
+        """
+        Resolve the cities of the watchlist that are not resolved yet and replace the learned
+        keys with the most requested ones.
+        """
+        unresolved = []
+        for query in self._unresolved:
+            # The geocoding of the watchlist leaves the quota to the interactive requests.
+            with priority(BACKGROUND):
+                location = weather.get_lan_lon(query.city_name, query.state_code,
+                                               query.country_code)
+            if location is None or location.lat is None:
+                unresolved.append(query)
+                continue
+            for kind in self.fetchers:
+                self._watch(self.cache.make_key(kind, location.lat, location.lon,
+                                                CANONICAL_UNITS), location.lat, location.lon,
+                            False)
+        self._unresolved = unresolved
+        if self.learn_top > 0:
+            popular = set(self.cache.popular(self.learn_top))
+            # The broker threads watch and unwatch keys at the same time.
+            with self._lock:
+                for key in [key for key, entry in self.entries.items()
+                            if entry.learned and key not in popular]:
+                    del self.entries[key]
+                    self.cache.watched.discard(key)
+            for key in popular:
+                if key[0] in self.fetchers:
+                    self._watch(key, key[1], key[2], True)
+            self.cache.decay()
+
+    def due(self, now: Optional[float] = None) -> List[Tuple[float, Tuple]]:
+        """
+        :param now      :      The current time. Defaults to time.time().
+
+        :return:               The time each watched key was due to be refreshed and the key,
+                               most overdue first.
+        """
+        now = time.time() if now is None else now
+        due = []
+        for key, entry in list(self.entries.items()):
+            cached = self.cache.get(key)
+            # A key that is not cached is due right away.
+            due_at = cached[1] - entry.lead if cached is not None else now
+            if due_at <= now and key not in self._in_flight:
+                due.append((due_at, key))
+        return sorted(due)
+
+    def _budget(self, now: float) -> int:
+        """
+        :param now      :      The monotonic time now.
+
+        :return:               The number of refreshes that can start without going over the
+                               refreshes per minute.
+        """
+        while self._recent and self._recent[0] <= now - 60:
+            self._recent.popleft()
+        return max(0, int(self.max_per_minute) - len(self._recent))
+
+    def tick(self, now: Optional[float] = None) -> int:
+        """
+        :param now      :      The current time. Defaults to time.time().
+
+        :return:               The number of refreshes started.
+        """
+        due = self.due(now)
+        with self._lock:
+            due = due[:self._budget(time.monotonic())]
+            for _, key in due:
+                self._in_flight.add(key)
+                self._recent.append(time.monotonic())
+        for due_at, key in due:
+            self._executor.submit(self._refresh, key, due_at)
+        return len(due)
+
+    def _refresh(self, key: Tuple, due_at: float) -> None:
+        """
+        :param key         :      The cache key to refresh.
+        :param due_at      :      The time the key was due to be refreshed.
+        """
+        result = "error"
+        try:
+            entry = self.entries.get(key)
+            if entry is not None:
+                fetch = self.fetchers[key[0]]
+                # The prefetches leave the quota to the interactive requests.
+                with priority(BACKGROUND):
+                    value, _ = weather.fetch_flights.do(
+                        key, lambda: fetch(entry.lat, entry.lon))
+                if weather.is_successful(value):
+                    self.cache.put(key, value)
+                    result = "ok"
+                    PREFETCH_LAG_SECONDS.observe(max(0.0, time.time() - due_at), kind=key[0])
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.warning("%s: %s", get_full_class_name(e), e.args)
+        finally:
+            PREFETCH_REFRESHES.inc(kind=key[0], result=result)
+            with self._lock:
+                self._in_flight.discard(key)
+
+    def _run(self) -> None:
+        """
+        Check the schedule every interval until stopped. The watchlist is updated every minute.
+        """
+        updated = 0.0
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - updated >= 60:
+                    self.update_watchlist()
+                    updated = time.monotonic()
+                self.tick()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("%s: %s", get_full_class_name(e), e.args)
+            self._stop.wait(self.interval)
+
+    def start(self) -> 'Prefetcher':
+        """
+        :return:       The Prefetcher, refreshing the watched locations in a daemon thread.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="owm-prefetch-scheduler",
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, wait: bool = True) -> None:
+        """
+        :param wait      :      Wait for the refreshes in flight to finish.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._executor.shutdown(wait=wait)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        :return:       The number of watched keys and the share of the lookups of the watched
+                       keys served fresh from memory.
+        """
+        lookups = self.cache.watched_lookups
+        total = sum(lookups.values())
+        entries = list(self.entries.values())
+        return {"watched": len(entries),
+                "learned": sum(entry.learned for entry in entries),
+                "unresolved": len(self._unresolved),
+                "hit_rate": round(lookups["hit"] / total, 4) if total else 0.0}
+
+
+_default_prefetcher: Prefetcher | None = None
+_default_prefetcher_lock = threading.Lock()
+
+
+def start_default_prefetcher(required: bool = False) -> Prefetcher | None:
+    """
+    :param required      :      Start a Prefetcher without a watchlist when it is not
+                                configured, e.g. to keep the streamed locations warm.
+
+    :return:                    The process wide Prefetcher of the weather cache, started, or
+                                None when it is not configured nor required.
+    """
+    global _default_prefetcher  # pylint: disable=global-statement
+    with _default_prefetcher_lock:
+        if _default_prefetcher is None:
+            _default_prefetcher = Prefetcher.from_env(weather.weather_cache, required)
+            if _default_prefetcher is not None:
+                _default_prefetcher.start()
+    return _default_prefetcher
+
+
+def _watched_by_source() -> Dict:
+    """
+    :return:       The number of watched keys by source, watchlist or learned.
+    """
+    if _default_prefetcher is None:
+        return {}
+    stats = _default_prefetcher.stats()
+    return {labels(source="watchlist"): stats["watched"] - stats["learned"],
+            labels(source="learned"): stats["learned"]}
+
+
+REGISTRY.gauge("owm_prefetch_watched", "Cache keys kept warm by the prefetcher.",
+               _watched_by_source)
+REGISTRY.gauge("owm_prefetch_lookups", "Lookups of the watched cache keys by result.",
+               lambda: {labels(result=result): count for result, count
+                        in weather.weather_cache.watched_lookups.items()})
+
+
+def main(argv: list[str] | None = None) -> Dict[str, float]:
+    """
+    :param argv      :      The command line arguments.
+
+    :return:                The stats of the prefetcher.
+    """
+    parser = argparse.ArgumentParser(description="Keep the weather of a watchlist warm.")
+    parser.add_argument("watchlist", help="csv file with city, state and country columns")
+    parser.add_argument("--learn-top", type=int, default=0,
+                        help="number of the most requested locations watched as well")
+    parser.add_argument("--once", action="store_true",
+                        help="refresh every watched location once and exit")
+    args = parser.parse_args(argv)
+
+    prefetcher = Prefetcher(weather.weather_cache, read_locations(args.watchlist),
+                            learn_top=args.learn_top)
+    prefetcher.update_watchlist()
+    if args.once:
+        prefetcher.max_per_minute = len(prefetcher.entries)
+        prefetcher.tick()
+        prefetcher.stop()
+    else:
+        try:
+            prefetcher.start()._thread.join()
+        except KeyboardInterrupt:
+            prefetcher.stop(wait=False)
+    print(prefetcher.stats())
+    return prefetcher.stats()
+
+
+if __name__ == '__main__':
+    configure_logging()
+    main()
@@ -0,0 +1,344 @@
+"""
+This python script is for the rate limiter of the calls to the openweather API. The token
+buckets are kept in a SQLite file so every worker process draws from the same per minute and
+per day budgets, with optional budgets per endpoint. The background refreshes leave a share of
+each bucket to the interactive requests, and a call either waits for a token or fails at once
+so the cached weather is served instead.
+"""
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+
+import requests
+from dotenv import load_dotenv
+
+from openweathermap.metrics import REGISTRY, labels
+from utils.get_class_name import get_full_class_name
+
+logger = logging.getLogger(__name__)
+
+# Get configuration information
+load_dotenv()
+
+# The priority classes of the calls.
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# The bucket shared by every endpoint.
+ALL_ENDPOINTS = "all"
+
+_priority: ContextVar[str] = ContextVar("owm_priority", default=INTERACTIVE)
+
+RATE_LIMITED = REGISTRY.counter("owm_rate_limited_total",
+                                "Calls refused by the rate limiter by endpoint and priority.")
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram("owm_rate_limit_wait_seconds",
+                                             "Time spent waiting for a rate limiter token.")
+
+
+class RateLimitedError(requests.RequestException):
+    """Raised instead of calling the openweather API when there is no token for the call"""
+
+
+@contextmanager
+def priority(value: str) -> Iterator[None]:
+    """
+    :param value      :      The priority of the calls made in the with block, INTERACTIVE or
+                             BACKGROUND.
+
+    :return:                 Iterator used by the with statement.
+    """
+    token = _priority.set(value)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    """
+    :return:       The priority of the calls made by the current thread or task.
+    """
+    return _priority.get()
+
+
+@dataclass(slots=True)
+class Bucket:
+    """Class representing the budget of one token bucket"""
+    name: str = field(default=None)
+    capacity: float = field(default=None)
+    rate: float = field(default=None)
+
+    @staticmethod
+    def per_minute(name: str, calls: float) -> 'Bucket':
+        """
+        :param name       :      The name of the bucket.
+        :param calls      :      The calls allowed per minute.
+
+        :return:                 The bucket refilled evenly over a minute.
+        """
+        return Bucket(f"{name}:minute", calls, calls / 60)
+
+    @staticmethod
+    def per_day(name: str, calls: float) -> 'Bucket':
+        """
+        :param name       :      The name of the bucket.
+        :param calls      :      The calls allowed per day.
+
+        :return:                 The bucket refilled evenly over a day.
+        """
+        return Bucket(f"{name}:day", calls, calls / 86400)
+
+
+def parse_endpoint_limits(value: Optional[str]) -> Dict[str, float]:
+    """
+    :param value      :      The per minute budgets by endpoint, e.g. "geocode:30,forecast:20".
+
+    :return:                 The calls per minute by endpoint.
+    """
+    limits = {}
+    for item in (value or "").split(","):
+        if item.strip():
+            endpoint, calls = item.split(":")
+            limits[endpoint.strip()] = float(calls)
+    return limits
+
+
+class RateLimiter:
+    """Class representing the token buckets shared by the worker processes"""
+
+    def __init__(self, path: str, buckets: Dict[str, List[Bucket]], reserve: float = 0.2,
+                 max_wait: float = 2.0, block: bool = True):
+        """
+        :param path          :      The SQLite file of the buckets, shared by the processes.
+        :param buckets       :      The buckets of each endpoint. The ALL_ENDPOINTS buckets are
+                                    used by every endpoint.
+        :param reserve       :      The share of each bucket the background calls leave to the
+                                    interactive calls, from 0 up to 1 excluded. A bucket too
+                                    small for its reserve and one token keeps only what leaves
+                                    one token to the background calls.
+        :param max_wait      :      The most seconds a blocking call waits for a token.
+        :param block         :      Wait for a token when there is none. When False the call
+                                    fails at once so the cached weather can be served.
+        """
+        if not 0 <= reserve < 1:
+            raise ValueError(f"the rate limit reserve must be from 0 up to 1, not {reserve}")
+        self.path = path
+        self.buckets = buckets
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self.block = block
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, "
+                         "tokens REAL NOT NULL, updated REAL NOT NULL)")
+
+    @staticmethod
+    def from_env() -> Optional['RateLimiter']:
+        """
+        :return:       RateLimiter configured from the environment or None when no budget is
+                       set.
+        """
+        buckets: Dict[str, List[Bucket]] = {}
+        per_minute = float(os.getenv("OWM_RATE_LIMIT_PER_MINUTE", "0"))
+        per_day = float(os.getenv("OWM_RATE_LIMIT_PER_DAY", "0"))
+        if per_minute > 0:
+            buckets.setdefault(ALL_ENDPOINTS, []).append(Bucket.per_minute(ALL_ENDPOINTS,
+                                                                           per_minute))
+        if per_day > 0:
+            buckets.setdefault(ALL_ENDPOINTS, []).append(Bucket.per_day(ALL_ENDPOINTS, per_day))
+        for endpoint, calls in parse_endpoint_limits(
+                os.getenv("OWM_RATE_LIMIT_ENDPOINTS")).items():
+            buckets.setdefault(endpoint, []).append(Bucket.per_minute(endpoint, calls))
+        if not buckets:
+            return None
+        return RateLimiter(os.getenv("OWM_RATE_LIMIT_PATH", ".cache/rate_limit.sqlite3"),
+                           buckets, reserve=float(os.getenv("OWM_RATE_LIMIT_RESERVE", "0.2")),
+                           max_wait=float(os.getenv("OWM_RATE_LIMIT_MAX_WAIT", "2")),
+                           block=os.getenv("OWM_RATE_LIMIT_MODE", "block").lower() == "block")
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        :return:       The SQLite connection for the current thread.
+        """
+        conn: sqlite3.Connection | None = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _buckets(self, endpoint: str) -> List[Bucket]:
+        """
+        :param endpoint      :      The name of the endpoint, e.g. geocode.
+
+        :return:                    The buckets the call draws a token from.
+        """
+        return self.buckets.get(ALL_ENDPOINTS, []) + self.buckets.get(endpoint, [])
+
+    def _take(self, buckets: List[Bucket], reserve: float) -> float:
+        """
+        :param buckets      :      The buckets to take a token from.
+        :param reserve      :      The share of each bucket that must be left after the token.
+
+        :return:                   0 when a token was taken from every bucket, otherwise the
+                                   seconds until there are enough tokens.
+        """
+        conn = self._connection()
+        now = time.time()
+        # The write lock is taken first so the processes refill and take in turn.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = {name: (tokens, updated) for name, tokens, updated in conn.execute(
+                f"SELECT name, tokens, updated FROM buckets WHERE name IN "
+                f"({','.join('?' * len(buckets))})", [bucket.name for bucket in buckets])}
+            levels = {}
+            wait = 0.0
+            for bucket in buckets:
+                tokens, updated = rows.get(bucket.name, (bucket.capacity, now))
+                tokens = min(bucket.capacity, tokens + max(0.0, now - updated) * bucket.rate)
+                levels[bucket.name] = tokens
+                # The reserve is clamped so a background call can still get the last token of
+                # a small bucket.
+                needed = 1 + max(0.0, min(reserve * bucket.capacity, bucket.capacity - 1))
+                if tokens < needed:
+                    wait = max(wait, (needed - tokens) / bucket.rate)
+            if wait == 0:
+                levels = {name: tokens - 1 for name, tokens in levels.items()}
+            conn.executemany("INSERT OR REPLACE INTO buckets (name, tokens, updated) "
+                             "VALUES (?, ?, ?)",
+                             [(name, tokens, now) for name, tokens in levels.items()])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def _reserve(self) -> float:
+        """
+        :return:       The share of the buckets the calls of the current priority must leave.
+        """
+        return self.reserve if current_priority() == BACKGROUND else 0.0
+
+    def _next_wait(self, endpoint: str, buckets: List[Bucket], block: Optional[bool],
+                   start: float) -> float:
+        """
+        :param endpoint      :      The name of the endpoint.
+        :param buckets       :      The buckets the call draws a token from.
+        :param block         :      Wait for a token. Defaults to the mode of the limiter. The
+                                    background calls never wait.
+        :param start         :      The monotonic time the call started waiting.
+
+        :return:                    0 when the token was taken, otherwise the seconds to sleep
+                                    before trying again. RateLimitedError is raised when there is
+                                    no token in time.
+        """
+        wait = self._take(buckets, self._reserve())
+        if wait == 0:
+            return 0.0
+        block = (self.block if block is None else block) and current_priority() != BACKGROUND
+        if not block or time.monotonic() - start + wait > self.max_wait:
+            RATE_LIMITED.inc(endpoint=endpoint, priority=current_priority())
+            raise RateLimitedError(f"the rate limit of the {endpoint} endpoint is reached")
+        # The jitter spreads the processes waiting for the same token.
+        return wait * random.uniform(1.0, 1.2)
+
+    def acquire(self, endpoint: str, block: Optional[bool] = None) -> float:
+        """
+        :param endpoint      :      The name of the endpoint, e.g. geocode.
+        :param block         :      Wait for a token. Defaults to the mode of the limiter. The
+                                    background calls never wait.
+
+        :return:                    The seconds waited for the token. RateLimitedError is raised
+                                    when there is no token in time.
+        """
+        buckets = self._buckets(endpoint)
+        if not buckets:
+            return 0.0
+        start = time.monotonic()
+        try:
+            while (delay := self._next_wait(endpoint, buckets, block, start)) > 0:
+                time.sleep(delay)
+        except sqlite3.Error as e:
+            # The limiter must not take the site down, so the call goes ahead.
+            logger.warning("%s: %s", get_full_class_name(e), e.args)
+        waited = time.monotonic() - start
+        RATE_LIMIT_WAIT_SECONDS.observe(waited, endpoint=endpoint)
+        return waited
+
+    async def acquire_async(self, endpoint: str, block: Optional[bool] = None) -> float:
+        """
+        :param endpoint      :      The name of the endpoint, e.g. geocode.
+        :param block         :      Wait for a token. Defaults to the mode of the limiter.
+
+        :return:                    Same as acquire, without blocking the event loop while
+                                    waiting. The SQLite transaction, which waits while another
+                                    process holds the write lock, runs on a worker thread that
+                                    sees the priority of the caller.
+        """
+        buckets = self._buckets(endpoint)
+        if not buckets:
+            return 0.0
+        start = time.monotonic()
+        try:
+            while (delay := await asyncio.to_thread(self._next_wait, endpoint, buckets, block,
+                                                    start)) > 0:
+                await asyncio.sleep(delay)
+        except sqlite3.Error as e:
+            logger.warning("%s: %s", get_full_class_name(e), e.args)
+        waited = time.monotonic() - start
+        RATE_LIMIT_WAIT_SECONDS.observe(waited, endpoint=endpoint)
+        return waited
+
+    def tokens(self) -> Dict[str, float]:
+        """
+        :return:       The tokens left in each bucket now.
+        """
+        now = time.time()
+        try:
+            rows = {name: (tokens, updated) for name, tokens, updated in self._connection()
+                    .execute("SELECT name, tokens, updated FROM buckets").fetchall()}
+        except sqlite3.Error as e:
+            logger.warning("%s: %s", get_full_class_name(e), e.args)
+            rows = {}
+        levels = {}
+        for buckets in self.buckets.values():
+            for bucket in buckets:
+                tokens, updated = rows.get(bucket.name, (bucket.capacity, now))
+                levels[bucket.name] = min(bucket.capacity,
+                                          tokens + max(0.0, now - updated) * bucket.rate)
+        return levels
+
+
+_default_limiter: RateLimiter | None = None
+_default_limiter_loaded = False
+_default_limiter_lock = threading.Lock()
+
+
+def get_default_limiter() -> RateLimiter | None:
+    """
+    :return:       The process wide RateLimiter or None when no budget is configured.
+    """
+    global _default_limiter, _default_limiter_loaded  # pylint: disable=global-statement
+    if not _default_limiter_loaded:
+        with _default_limiter_lock:
+            if not _default_limiter_loaded:
+                _default_limiter = RateLimiter.from_env()
+                _default_limiter_loaded = True
+    return _default_limiter
+
+
+REGISTRY.gauge("owm_rate_limit_tokens", "Tokens left in each rate limiter bucket.",
+               lambda: {labels(bucket=name): round(tokens, 3) for name, tokens
+                        in (_default_limiter.tokens() if _default_limiter else {}).items()})
@@ -0,0 +1,467 @@
+"""
+This python script is for the resilience of the calls to the openweather API. The idempotent
+GETs are retried with an exponential backoff, a slow request can be hedged with a second one
+once it is slower than a percentile of the recent latencies, and a circuit breaker per endpoint
+fails the calls fast while the upstream is unhealthy so the cached weather can be served.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Type
+
+import requests
+from dotenv import load_dotenv
+
+from openweathermap.metrics import (CIRCUIT_REJECTED, REGISTRY, UPSTREAM_HEDGES, UPSTREAM_RETRIES,
+                                    labels)
+from openweathermap.rate_limit import RateLimitedError
+from utils.tracing import propagate
+
+# Get configuration information
+load_dotenv()
+
+# The status codes worth retrying, the other responses are final.
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+# The value of each state in the owm_circuit_state metric.
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling the openweather API while the circuit of the endpoint is open"""
+
+
+class CircuitBreaker:
+    """Class representing the circuit breaker of one endpoint"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        :param failure_threshold      :      The consecutive failed calls that open the circuit.
+        :param reset_timeout          :      The seconds the circuit stays open before one call
+                                             is let through to probe the upstream.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opens = 0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """
+        :return:       The state of the circuit, closed, open or half_open.
+        """
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """
+        :return:       True when the call may go to the upstream. While the circuit is half open
+                       only one probing call at a time is allowed.
+        """
+        state = self.state
+        with self._lock:
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release(self) -> None:
+        """
+        Let another call probe the upstream when the probing call did not reach it.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_success(self) -> None:
+        """
+        Close the circuit after a successful call.
+        """
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._state = CLOSED
+
+    def record_failure(self) -> None:
+        """
+        Count a failed call and open the circuit after too many, or when the probe failed.
+        """
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self._state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    self.opens += 1
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+
+
+class LatencyWindow:
+    """Class representing the latencies of the recent requests of one endpoint"""
+
+    def __init__(self, size: int = 256, min_samples: int = 50):
+        """
+        :param size             :      The number of recent latencies kept.
+        :param min_samples      :      The latencies needed before a percentile is given.
+        """
+        self.min_samples = min_samples
+        self._latencies: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        """
+        :param seconds      :      The latency of a request.
+        """
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """
+        :param percentile      :      The percentile, e.g. 95.
+
+        :return:                      The latency of the percentile or None when there are not
+                                      enough latencies yet.
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+
+# pylint: disable=too-many-instance-attributes
+# Twelve is reasonable in this case.
+class Resilience:
+    """Class representing the retries, hedging and circuit breakers of the upstream calls"""
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.1, max_delay: float = 1.0,
+                 budget: float = 10.0, hedge_percentile: float = 0.0,
+                 hedge_min_delay: float = 0.05, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0, hedge_workers: int = 16):
+        """
+        :param attempts               :      The most attempts of a call, 1 for no retries.
+        :param base_delay             :      The seconds before the first retry. The delay
+                                             doubles after each retry, with jitter.
+        :param max_delay              :      The longest delay between two attempts.
+        :param budget                 :      The seconds after which no more attempts are made.
+        :param hedge_percentile       :      The latency percentile after which a second request
+                                             is sent, e.g. 95. 0 disables the hedging.
+        :param hedge_min_delay        :      The shortest wait before a second request is sent.
+        :param failure_threshold      :      The consecutive failed calls that open a circuit.
+        :param reset_timeout          :      The seconds a circuit stays open.
+        :param hedge_workers          :      The threads sending the requests of the blocking client
+                                             while the hedging is enabled, both the first and the
+                                             second request of a call.
+        """
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, LatencyWindow] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=hedge_workers,
+                                            thread_name_prefix="owm-hedge") \
+            if hedge_percentile > 0 else None
+
+    @staticmethod
+    def from_env() -> 'Resilience':
+        """
+        :return:       Resilience configured from the environment.
+        """
+        return Resilience(attempts=int(os.getenv("OWM_RETRY_ATTEMPTS", "3")),
+                          base_delay=float(os.getenv("OWM_RETRY_BASE_DELAY", "0.1")),
+                          max_delay=float(os.getenv("OWM_RETRY_MAX_DELAY", "1")),
+                          budget=float(os.getenv("OWM_RETRY_BUDGET", "10")),
+                          hedge_percentile=float(os.getenv("OWM_HEDGE_PERCENTILE", "0")),
+                          hedge_min_delay=float(os.getenv("OWM_HEDGE_MIN_DELAY", "0.05")),
+                          failure_threshold=int(os.getenv("OWM_CIRCUIT_FAILURES", "5")),
+                          reset_timeout=float(os.getenv("OWM_CIRCUIT_RESET", "30")),
+                          hedge_workers=int(os.getenv("OWM_HEDGE_WORKERS", "16")))
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        """
+        :param endpoint      :      The name of the endpoint, e.g. geocode.
+
+        :return:                    The circuit breaker of the endpoint.
+        """
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    endpoint, CircuitBreaker(self.failure_threshold, self.reset_timeout))
+        return breaker
+
+    def states(self) -> Dict[str, str]:
+        """
+        :return:       The state of the circuit of each endpoint called so far.
+        """
+        return {endpoint: breaker.state for endpoint, breaker in list(self._breakers.items())}
+
+    def opens(self) -> Dict[str, int]:
+        """
+        :return:       The times the circuit of each endpoint was opened.
+        """
+        return {endpoint: breaker.opens for endpoint, breaker in list(self._breakers.items())}
+
+    def _window(self, endpoint: str) -> LatencyWindow:
+        """
+        :param endpoint      :      The name of the endpoint.
+
+        :return:                    The recent latencies of the endpoint.
+        """
+        window = self._latencies.get(endpoint)
+        if window is None:
+            with self._lock:
+                window = self._latencies.setdefault(endpoint, LatencyWindow())
+        return window
+
+    def _hedge_after(self, endpoint: str) -> Optional[float]:
+        """
+        :param endpoint      :      The name of the endpoint.
+
+        :return:                    The seconds after which a second request is sent or None
+                                    when the hedging is disabled or there are too few latencies.
+        """
+        if self.hedge_percentile <= 0:
+            return None
+        latency = self._window(endpoint).percentile(self.hedge_percentile)
+        return None if latency is None else max(self.hedge_min_delay, latency)
+
+    def _delay(self, attempt: int) -> float:
+        """
+        :param attempt      :      The attempt that failed, 0 for the first one.
+
+        :return:                   The seconds to wait before the next attempt.
+        """
+        return min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _reject(self, endpoint: str, breaker: CircuitBreaker) -> None:
+        """
+        :param endpoint      :      The name of the endpoint.
+        :param breaker       :      The circuit breaker of the endpoint.
+        """
+        if not breaker.allow():
+            CIRCUIT_REJECTED.inc(endpoint=endpoint)
+            raise CircuitOpenError(f"the circuit of the {endpoint} endpoint is open")
+
+    def _timed(self, endpoint: str, func: Callable[[], Any]) -> Any:
+        """
+        :param endpoint      :      The name of the endpoint.
+        :param func          :      The function making the request.
+
+        :return:                    The response. The latency is added to the window.
+        """
+        start = time.perf_counter()
+        try:
+            return func()
+        finally:
+            self._window(endpoint).add(time.perf_counter() - start)
+
+    def _hedged(self, endpoint: str, func: Callable[[], Any],
+                errors: Tuple[Type[BaseException], ...]) -> Any:
+        """
+        :param endpoint      :      The name of the endpoint.
+        :param func          :      The function making the request.
+        :param errors        :      The errors of a failed request.
+
+        :return:                    The response of the request, or of the second request when
+                                    it answers first. Both are sent by the hedge pool and the
+                                    slower one is left to finish, its response is dropped.
+        """
+        hedge_after = self._hedge_after(endpoint)
+        if hedge_after is None or self._executor is None:
+            return self._timed(endpoint, func)
+        started = threading.Event()
+
+        def first() -> Any:
+            started.set()
+            return self._timed(endpoint, func)
+        futures = [self._executor.submit(propagate(first))]
+        # The hedge delay counts from the start of the request, not from its wait for a thread.
+        started.wait()
+        done, _ = wait(futures, timeout=hedge_after)
+        if not done:
+            UPSTREAM_HEDGES.inc(endpoint=endpoint)
+            futures.append(self._executor.submit(propagate(lambda: self._timed(endpoint, func))))
+        error: BaseException | None = None
+        try:
+            for next_done in as_completed(futures):
+                try:
+                    return next_done.result()
+                except errors as e:
+                    error = e
+            raise error
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def call(self, endpoint: str, func: Callable[[], Any],
+             status_of: Callable[[Any], int] = lambda resp: resp.status_code,
+             errors: Tuple[Type[BaseException], ...] = (requests.RequestException,)) -> Any:
+        """
+        :param endpoint       :      The name of the endpoint, e.g. geocode.
+        :param func           :      The function making one idempotent request.
+        :param status_of      :      The function returning the status code of a response.
+        :param errors         :      The errors of a failed request.
+
+        :return:                     The first response that is not worth retrying, or the last
+                                     one. The last error is raised when every attempt failed,
+                                     CircuitOpenError when the circuit of the endpoint is open and
+                                     RateLimitedError, without retrying, when there is no quota.
+        """
+        breaker = self.breaker(endpoint)
+        self._reject(endpoint, breaker)
+        deadline = time.monotonic() + self.budget
+        resp, error = None, None
+        for attempt in range(self.attempts):
+            try:
+                resp, error = self._hedged(endpoint, func, errors), None
+                if status_of(resp) not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return resp
+            except RateLimitedError:
+                # Waiting for the quota is not a failure of the upstream.
+                breaker.release()
+                raise
+            except errors as e:
+                resp, error = None, e
+            except Exception:
+                breaker.record_failure()
+                raise
+            delay = self._delay(attempt)
+            if attempt + 1 == self.attempts or time.monotonic() + delay >= deadline:
+                break
+            UPSTREAM_RETRIES.inc(endpoint=endpoint)
+            time.sleep(delay)
+        breaker.record_failure()
+        if error is not None:
+            raise error
+        return resp
+
+    async def _timed_async(self, endpoint: str, func: Callable[[], Awaitable]) -> Any:
+        """
+        :param endpoint      :      The name of the endpoint.
+        :param func          :      The function returning the awaitable request.
+
+        :return:                    The response. The latency is added to the window.
+        """
+        start = time.perf_counter()
+        try:
+            return await func()
+        finally:
+            self._window(endpoint).add(time.perf_counter() - start)
+
+    async def _hedged_async(self, endpoint: str, func: Callable[[], Awaitable],
+                            errors: Tuple[Type[BaseException], ...]) -> Any:
+        """
+        :param endpoint      :      The name of the endpoint.
+        :param func          :      The function returning the awaitable request.
+        :param errors        :      The errors of a failed request.
+
+        :return:                    The response of the request, or of the second request when
+                                    it answers first. The slower request is cancelled.
+        """
+        hedge_after = self._hedge_after(endpoint)
+        if hedge_after is None:
+            return await self._timed_async(endpoint, func)
+        tasks = [asyncio.ensure_future(self._timed_async(endpoint, func))]
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            UPSTREAM_HEDGES.inc(endpoint=endpoint)
+            tasks.append(asyncio.ensure_future(self._timed_async(endpoint, func)))
+        error: BaseException | None = None
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    return await next_done
+                except errors as e:
+                    error = e
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call_async(self, endpoint: str, func: Callable[[], Awaitable],
+                         status_of: Callable[[Any], int],
+                         errors: Tuple[Type[BaseException], ...]) -> Any:
+        """
+        :param endpoint       :      The name of the endpoint, e.g. geocode.
+        :param func           :      The function returning one idempotent awaitable request.
+        :param status_of      :      The function returning the status code of a response.
+        :param errors         :      The errors of a failed request.
+
+        :return:                     Same as call, without blocking the event loop.
+        """
+        breaker = self.breaker(endpoint)
+        self._reject(endpoint, breaker)
+        deadline = time.monotonic() + self.budget
+        resp, error = None, None
+        for attempt in range(self.attempts):
+            try:
+                resp, error = await self._hedged_async(endpoint, func, errors), None
+                if status_of(resp) not in RETRY_STATUSES:
+                    breaker.record_success()
+                    return resp
+            except RateLimitedError:
+                # Waiting for the quota is not a failure of the upstream.
+                breaker.release()
+                raise
+            except errors as e:
+                resp, error = None, e
+            except Exception:
+                breaker.record_failure()
+                raise
+            delay = self._delay(attempt)
+            if attempt + 1 == self.attempts or time.monotonic() + delay >= deadline:
+                break
+            UPSTREAM_RETRIES.inc(endpoint=endpoint)
+            await asyncio.sleep(delay)
+        breaker.record_failure()
+        if error is not None:
+            raise error
+        return resp
+
+
+_default_resilience: Resilience | None = None
+_default_resilience_lock = threading.Lock()
+
+
+def get_default_resilience() -> Resilience:
+    """
+    :return:       The process wide Resilience, shared by the sync and async clients so they see
+                   the same circuits.
+    """
+    global _default_resilience  # pylint: disable=global-statement
+    if _default_resilience is None:
+        with _default_resilience_lock:
+            if _default_resilience is None:
+                _default_resilience = Resilience.from_env()
+    return _default_resilience
+
+
+REGISTRY.gauge("owm_circuit_state", "State of the circuit of each endpoint: 0 closed, "
+               "1 half open, 2 open.",
+               lambda: {labels(endpoint=endpoint): _STATE_VALUES[state] for endpoint, state
+                        in (_default_resilience.states() if _default_resilience else {}).items()})
+REGISTRY.gauge("owm_circuit_opens", "Times the circuit of each endpoint was opened.",
+               lambda: {labels(endpoint=endpoint): opens for endpoint, opens
+                        in (_default_resilience.opens() if _default_resilience else {}).items()})
@@ -0,0 +1,313 @@
+"""
+This python script is for the in-memory spatial index of the known locations. The locations are
+kept in a k-d tree over their position on the unit sphere, so the nearest locations and the
+locations within a radius are found without comparing every location, and a coordinate can be
+snapped to the nearest known location to share its cached weather.
+"""
+import heapq
+import math
+import threading
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from openweathermap.datasets.location import Location
+
+EARTH_RADIUS_KM = 6371.0088
+
+# The new locations are searched one by one until there are this many, then the tree is rebuilt.
+_REBUILD_AFTER = 256
+# The most points kept in one leaf of the tree.
+_LEAF_SIZE = 16
+
+Point = Tuple[float, float, float]
+
+
+def to_point(lat: float, lon: float) -> Point:
+    """
+    :param lat      :      The latitude in degrees.
+    :param lon      :      The longitude in degrees.
+
+    :return:               The position on the unit sphere. The straight line distance between
+                           two points grows with the distance over the earth's surface.
+    """
+    lat, lon = math.radians(lat), math.radians(lon)
+    cos_lat = math.cos(lat)
+    return cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat)
+
+
+def chord_to_km(chord: float) -> float:
+    """
+    :param chord      :      The straight line distance between two points on the unit sphere.
+
+    :return:                 The distance over the earth's surface in kilometers.
+    """
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def km_to_chord(km: float) -> float:
+    """
+    :param km      :      The distance over the earth's surface in kilometers.
+
+    :return:              The straight line distance between two points on the unit sphere.
+    """
+    return 2 * math.sin(min(math.pi, km / EARTH_RADIUS_KM) / 2)
+
+
+def _squared(a: Point, b: Point) -> float:
+    """
+    :param a      :      The first point.
+    :param b      :      The second point.
+
+    :return:             The squared straight line distance between the points.
+    """
+    dx, dy, dz = a[0] - b[0], a[1] - b[1], a[2] - b[2]
+    return dx * dx + dy * dy + dz * dz
+
+
+class _KDTree:
+    """Class representing a static k-d tree stored in flat lists"""
+
+    def __init__(self, points: List[Point]):
+        """
+        :param points      :      The points of the tree.
+        """
+        self.points = points
+        # The point indices ordered so the points of each leaf are next to each other.
+        self.order: List[int] = list(range(len(points)))
+        # For each node: the split axis (-1 for a leaf), the split value and the left and right
+        # nodes. A leaf stores the start and end of its points in order instead of the nodes.
+        self.axis: List[int] = []
+        self.split: List[float] = []
+        self.left: List[int] = []
+        self.right: List[int] = []
+        # The x, y and z of the points, only used while building.
+        self._columns = [[point[axis] for point in points] for axis in range(3)]
+        self.root = self._build(0, len(points))
+        del self._columns
+
+    def _build(self, start: int, end: int) -> int:
+        """
+        :param start      :      The start of the points of the subtree in order.
+        :param end        :      The end of the points of the subtree in order.
+
+        :return:                 The node of the subtree.
+        """
+        node = len(self.axis)
+        self.axis.append(-1)
+        self.split.append(0.0)
+        self.left.append(start)
+        self.right.append(end)
+        if end - start <= _LEAF_SIZE:
+            return node
+        indices = self.order[start:end]
+        # Split on the axis the points are spread out the most.
+        spreads = []
+        for column in self._columns:
+            values = list(map(column.__getitem__, indices))
+            spreads.append(max(values) - min(values))
+        axis = spreads.index(max(spreads))
+        indices.sort(key=self._columns[axis].__getitem__)
+        self.order[start:end] = indices
+        middle = start + (end - start) // 2
+        self.axis[node] = axis
+        self.split[node] = self._columns[axis][self.order[middle]]
+        self.left[node] = self._build(start, middle)
+        self.right[node] = self._build(middle, end)
+        return node
+
+    def nearest(self, target: Point, k: int) -> List[Tuple[float, int]]:
+        """
+        :param target      :      The point to search from.
+        :param k           :      The number of points.
+
+        :return:                  The squared distance and index of the k nearest points.
+        """
+        best: List[Tuple[float, int]] = []  # Max heap of the negated distances.
+        # The nodes to visit with the smallest squared distance any of their points can have.
+        stack = [(self.root, 0.0)]
+        while stack:
+            node, bound = stack.pop()
+            if len(best) == k and bound >= -best[0][0]:
+                continue
+            axis = self.axis[node]
+            if axis < 0:
+                for point_index in self.order[self.left[node]:self.right[node]]:
+                    distance = _squared(target, self.points[point_index])
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, point_index))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, point_index))
+                continue
+            difference = target[axis] - self.split[node]
+            near, far = (self.left[node], self.right[node]) if difference < 0 \
+                else (self.right[node], self.left[node])
+            stack.append((far, max(bound, difference * difference)))
+            stack.append((near, bound))
+        return sorted((-distance, point_index) for distance, point_index in best)
+
+    def within(self, target: Point, squared_radius: float) -> List[Tuple[float, int]]:
+        """
+        :param target              :      The point to search from.
+        :param squared_radius      :      The squared straight line radius.
+
+        :return:                          The squared distance and index of the points within
+                                          the radius.
+        """
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            axis = self.axis[node]
+            if axis < 0:
+                for point_index in self.order[self.left[node]:self.right[node]]:
+                    distance = _squared(target, self.points[point_index])
+                    if distance <= squared_radius:
+                        found.append((distance, point_index))
+                continue
+            difference = target[axis] - self.split[node]
+            if difference < 0 or difference * difference <= squared_radius:
+                stack.append(self.left[node])
+            if difference >= 0 or difference * difference <= squared_radius:
+                stack.append(self.right[node])
+        return found
+
+
+class SpatialIndex:
+    """Class representing the nearest location index of the known locations"""
+
+    def __init__(self, locations: Iterable[Location] = (),
+                 loader: Optional[Callable[[], Iterable[Location]]] = None):
+        """
+        :param locations      :      The known locations.
+        :param loader         :      Function returning more locations. They are added in a
+                                     background thread so building a large index does not slow
+                                     the start, and the queries wait until they are added.
+        """
+        self._locations: List[Location] = []
+        self._points: List[Point] = []
+        self._tree = _KDTree([])
+        self._pending = 0
+        self._loader = loader
+        self._lock = threading.Lock()
+        for location in locations:
+            self._append(location)
+        self._rebuild()
+        if loader is not None:
+            threading.Thread(target=self._load, name="owm-spatial-index", daemon=True).start()
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def _append(self, location: Location) -> bool:
+        """
+        :param location      :      The location to add.
+
+        :return:                    True when the location has coordinates and was added.
+        """
+        if location is None or location.lat is None or location.lon is None:
+            return False
+        # The location goes first so every point read without the lock has its location.
+        self._locations.append(location)
+        self._points.append(to_point(location.lat, location.lon))
+        return True
+
+    def _rebuild(self) -> None:
+        """
+        Rebuild the tree with every location.
+        """
+        self._tree = _KDTree(list(self._points))
+        self._pending = 0
+
+    def _load(self) -> None:
+        """
+        Add the locations of the loader once.
+        """
+        if self._loader is None:
+            return
+        with self._lock:
+            if self._loader is not None:
+                for location in self._loader():
+                    self._append(location)
+                self._loader = None
+                self._rebuild()
+
+    def add(self, location: Location) -> None:
+        """
+        :param location      :      The location to add, e.g. one resolved by the geocoding API.
+        """
+        with self._lock:
+            if self._append(location):
+                self._pending += 1
+                if self._pending >= _REBUILD_AFTER:
+                    self._rebuild()
+
+    def _snapshot(self) -> Tuple[_KDTree, int]:
+        """
+        :return:       Tuple of the tree and the number of points, the ones added since the tree
+                       was built included. The points are only appended and the tree holds the
+                       first ones, so the pair is consistent without the lock even while the
+                       tree is rebuilt.
+        """
+        tree = self._tree
+        return tree, len(self._points)
+
+    def _candidates(self, target: Point, k: int) -> List[Tuple[float, int]]:
+        """
+        :param target      :      The point to search from.
+        :param k           :      The number of points.
+
+        :return:                  The squared distance and index of the k nearest points from
+                                  the tree and from the locations added since it was built.
+        """
+        tree, count = self._snapshot()
+        found = tree.nearest(target, k)
+        for point_index in range(len(tree.points), count):
+            found.append((_squared(target, self._points[point_index]), point_index))
+        return sorted(found)[:k]
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> List[Tuple[Location, float]]:
+        """
+        :param lat      :      The latitude to search from.
+        :param lon      :      The longitude to search from.
+        :param k        :      The number of locations.
+
+        :return:               The k nearest locations and their distance in kilometers,
+                               nearest first.
+        """
+        self._load()
+        return [(self._locations[point_index], chord_to_km(math.sqrt(distance)))
+                for distance, point_index in self._candidates(to_point(lat, lon), k)]
+
+    def within(self, lat: float, lon: float, radius_km: float) -> List[Tuple[Location, float]]:
+        """
+        :param lat            :      The latitude to search from.
+        :param lon            :      The longitude to search from.
+        :param radius_km      :      The radius in kilometers.
+
+        :return:                     The locations within the radius and their distance in
+                                     kilometers, nearest first.
+        """
+        self._load()
+        target = to_point(lat, lon)
+        squared_radius = km_to_chord(radius_km) ** 2
+        tree, count = self._snapshot()
+        found = tree.within(target, squared_radius)
+        for point_index in range(len(tree.points), count):
+            distance = _squared(target, self._points[point_index])
+            if distance <= squared_radius:
+                found.append((distance, point_index))
+        return [(self._locations[point_index], chord_to_km(math.sqrt(distance)))
+                for distance, point_index in sorted(found)]
+
+    def snap(self, lat: float, lon: float, max_km: float) -> Optional[Location]:
+        """
+        :param lat         :      The latitude to snap.
+        :param lon         :      The longitude to snap.
+        :param max_km      :      The farthest a location may be.
+
+        :return:                  The nearest known location within max_km or None. Requests
+                                  snapped to the same location share its cached weather.
+        """
+        nearest = self.nearest(lat, lon, 1)
+        if nearest and nearest[0][1] <= max_km:
+            return nearest[0][0]
+        return None
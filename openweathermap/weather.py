@@ -1,142 +1,404 @@
 """
 This python script gets the current weather from the openweather API.
 """
+import logging
 import os
-from typing import Type
-from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Type
 
-import requests
 from dotenv import load_dotenv
-from requests import Response
+from requests import RequestException, Response
 
+from openweathermap.cache.geocode import GeocodeCache
+from openweathermap.cache.response import CURRENT, FORECAST, WeatherCache
+from openweathermap.client import WeatherClient, get_default_client
 from openweathermap.datasets.current_weather import CurrentWeatherData
+from openweathermap.datasets.decoders import (decode_current_weather, decode_forecast,
+                                              decode_json, decode_location)
 from openweathermap.datasets.forecast import Forecast
 from openweathermap.datasets.location import Location
 from openweathermap.datasets.shared import Formats
+from openweathermap.datasets.units import (CANONICAL_UNITS, current_weather_in_units,
+                                           forecast_in_units)
+from openweathermap.geocode_index import GeocodeIndex
+from openweathermap.history import HistoryStore
+from openweathermap.metrics import PARSE_SECONDS, REGISTRY, labels
+from openweathermap.spatial_index import SpatialIndex
 from utils.get_class_name import get_full_class_name
+from utils.log_config import configure_logging
+from utils.single_flight import SingleFlight
+from utils.stage_timer import stage_timer
+from utils.tracing import current_span, propagate, span
+
+logger = logging.getLogger(__name__)
+
+# The endpoint names used by the metrics.
+GEOCODE = "geocode"
+CURRENT_WEATHER = "current_weather"
 
 # Get configuration information
 load_dotenv()
 api_key: str | None = os.getenv("API_KEY")
-owm_geo_url: str | None = os.getenv("OWM_GEO_URL")
-owm_cur_weather_url: str | None = os.getenv("OWM_CUR_WEATHER_URL")
-own_forecast_url: str | None = os.getenv("OWM_FRC_WEATHER_URL")
 language: str | None = os.getenv("LANGUAGE")
+# The default units of measure. The weather is fetched and cached in CANONICAL_UNITS and
+# converted to the units of each request.
 units_of_measure: str | None = os.getenv("UNITS_OF_MEASURE")
+concurrent_fetch: bool = os.getenv("OWM_CONCURRENT_FETCH", "true").lower() == "true"
+lazy_forecast: bool = os.getenv("OWM_LAZY_FORECAST", "true").lower() == "true"
+snap_radius_km: float = float(os.getenv("OWM_SNAP_RADIUS_KM", "5"))
+
+# Shared by every request so the current weather and forecast can be fetched at the same time.
+_fetch_executor = ThreadPoolExecutor(max_workers=int(os.getenv("OWM_FETCH_WORKERS", "8")),
+                                     thread_name_prefix="owm-fetch")
+geocode_cache: GeocodeCache = GeocodeCache.from_env()
+geocode_index: GeocodeIndex | None = GeocodeIndex.from_env()
+# The known locations, the cities of the geocoding index and the ones resolved by the API.
+spatial_index: SpatialIndex = SpatialIndex(
+    loader=geocode_index.locations if geocode_index is not None else None)
+weather_cache: WeatherCache = WeatherCache.from_env()
+history_store: HistoryStore | None = HistoryStore.from_env()
+# Coalesce identical concurrent lookups, by location for main and by coordinates for the fetches.
+request_flights: SingleFlight = SingleFlight()
+fetch_flights: SingleFlight = SingleFlight()
+
+REGISTRY.gauge("owm_cache_lookups", "Lookups of the caches by cache and result.",
+               lambda: {labels(cache="geocode", result="hit"): geocode_cache.hits,
+                        labels(cache="geocode", result="miss"): geocode_cache.misses,
+                        labels(cache="geocode_index", result="hit"):
+                            geocode_index.hits if geocode_index is not None else 0,
+                        labels(cache="geocode_index", result="miss"):
+                            geocode_index.misses if geocode_index is not None else 0,
+                        labels(cache="weather", result="hit"): weather_cache.hits,
+                        labels(cache="weather", result="stale"): weather_cache.stale_hits,
+                        labels(cache="weather", result="miss"): weather_cache.misses,
+                        labels(cache="weather", result="fallback"): weather_cache.fallback_hits,
+                        labels(cache="weather_shared", result="hit"): weather_cache.shared_hits})
+REGISTRY.gauge("owm_single_flight_coalesced", "Callers that shared an in-flight call.",
+               lambda: {labels(flight="request"): request_flights.stats()["coalesced"],
+                        labels(flight="fetch"): fetch_flights.stats()["coalesced"]})
+if history_store is not None:
+    REGISTRY.gauge("owm_history_responses", "Responses written to or dropped by the history.",
+                   lambda: {labels(result="written"): history_store.written,
+                            labels(result="dropped"): history_store.dropped})
 
 
 # help(CurrentWeatherData)
 
+
+def is_successful(weather_data: CurrentWeatherData | Forecast | None) -> bool:
+    """
+    :param weather_data:   The CurrentWeatherData or Forecast returned by the openweather API.
+
+    :return:               True when the response was successful and can be cached.
+    """
+    return weather_data is not None and weather_data.cod == 200
+
+
 # def postgres_close(p_connection: Connection) -> None:
-def get_lan_lon(city_name: str, state_code: str, country_code: str, limit: int = 1) -> Location:
+def get_lan_lon(city_name: str, state_code: str, country_code: str, limit: int = 1,
+                client: WeatherClient | None = None) -> Location:
     """
     :param city_name:      The city name to get the latitude and longitude from.
     :param state_code:     The state code to get the latitude and longitude from.
     :param country_code:   The country code to get the latitude and longitude from.
     :param limit:          The number of latitude and longitude combinations to retrieve.
+    :param client:         The pooled http client. Defaults to the shared client.
 
     :return:               Location dataclass representing the location.
     """
+    cache_key = GeocodeCache.make_key(city_name, state_code, country_code, limit)
+    found, cached_location = geocode_cache.get(cache_key)
+    if found:
+        logger.debug("get_lan_lon: geocode cache hit", extra={"cache_key": cache_key})
+        current_span().set("cache", "hit")
+        return cached_location if cached_location is not None else Location()
+    if geocode_index is not None:
+        indexed_location = geocode_index.resolve(city_name, state_code, country_code)
+        if indexed_location is not None:
+            logger.debug("get_lan_lon: geocode index hit", extra={"cache_key": cache_key})
+            current_span().set("cache", "index")
+            return indexed_location
+    current_span().set("cache", "miss")
     try:
+        client = client or get_default_client()
         location_data: Location | None = Location()
-        resp: Response = requests.get(
-            f"{owm_geo_url}{city_name},{state_code},{country_code}&limit={limit}&appid={api_key}",
-            timeout=5)
-        print(f"get_lan_lon: {resp.status_code = }")
-        print(f"{resp.json() = }")
-        print(f"{type(resp.json()) = }")
-        if resp.status_code == 200 and resp.json():
-            location_data = Location.from_dict(resp.json()[0])
-    except HTTPError as e:
-        print(f"{get_full_class_name(e)}: {e.read().decode()}")
+        resp: Response = client.get(
+            f"{client.geo_url}{city_name},{state_code},{country_code}&limit={limit}"
+            f"&appid={api_key}", GEOCODE)
+        # The body is decoded once and reused.
+        payload = decode_json(resp.content)
+        logger.debug("get_lan_lon: status_code=%s payload=%s", resp.status_code, payload,
+                     extra={"status_code": resp.status_code})
+        if resp.status_code == 200 and payload:
+            with PARSE_SECONDS.time(type=GEOCODE), span("parse", type=GEOCODE):
+                location_data = decode_location(payload[0])
+            geocode_cache.put(cache_key, location_data)
+            spatial_index.add(location_data)
+        elif resp.status_code in (200, 400, 404):
+            # Nothing matched the lookup so it is cached for a short time only.
+            geocode_cache.put(cache_key, None)
+    except RequestException as e:
+        logger.warning("%s: %s", get_full_class_name(e), e.args)
         location_data = None
     except (IndexError, ValueError, TypeError, AttributeError, ImportError, NameError) as e:
-        print(f"{get_full_class_name(e)}: {e.args}")
+        logger.warning("%s: %s", get_full_class_name(e), e.args)
         location_data = None
 
     return location_data
 
 
-def get_current_weather(lat: float, lon: float) -> CurrentWeatherData:
+def get_current_weather(lat: float, lon: float, client: WeatherClient | None = None,
+                        units: str | None = None) -> CurrentWeatherData:
     """
     :param lat:      The latitude to get the current weather from.
     :param lon:      The longitude to get the current weather from.
+    :param client:   The pooled http client. Defaults to the shared client.
+    :param units:    The units of measure. Defaults to the UNITS_OF_MEASURE setting.
 
     :return:         CurrentWeatherData dataclass representing the current weather.
     """
+    units = units or units_of_measure
+    if lat is None or lon is None:
+        return current_weather_in_units(fetch_current_weather(lat, lon, client), units)
+    key = weather_cache.make_key(CURRENT, lat, lon, CANONICAL_UNITS)
+    return current_weather_in_units(weather_cache.get_or_load(
+        key, lambda: fetch_flights.do(key, lambda: fetch_current_weather(lat, lon, client))[0],
+        is_successful), units)
+
+
+def fetch_current_weather(lat: float, lon: float,
+                           client: WeatherClient | None = None) -> CurrentWeatherData:
+    """
+    :param lat:      The latitude to get the current weather from.
+    :param lon:      The longitude to get the current weather from.
+    :param client:   The pooled http client. Defaults to the shared client.
+
+    :return:         CurrentWeatherData dataclass fetched from the openweather API in the
+                     canonical units.
+    """
     try:
         current_weather_data: CurrentWeatherData | None = CurrentWeatherData()
-        resp: Response = requests.get(
-            f"{owm_cur_weather_url}lat={lat}&lon={lon}&lang={language}&appid={api_key}"
-            f"&units={units_of_measure}", timeout=5)
-        print(f"get_current_weather: {resp.status_code = }")
-        print(f"{resp.json() = }")
-        print(f"{type(resp.json()) = }")
-        if resp.status_code == 200 and resp.json():
-            current_weather_data = CurrentWeatherData.from_dict(resp.json(), units_of_measure)
-    except HTTPError as e:
-        print(f"{get_full_class_name(e)}: {e.read().decode()}")
+        client = client or get_default_client()
+        resp: Response = client.get(
+            f"{client.cur_weather_url}lat={lat}&lon={lon}&lang={language}&appid={api_key}"
+            f"&units={CANONICAL_UNITS}", CURRENT_WEATHER)
+        payload = decode_json(resp.content)
+        logger.debug("get_current_weather: status_code=%s payload=%s", resp.status_code,
+                     payload, extra={"status_code": resp.status_code})
+        if resp.status_code == 200 and payload:
+            with PARSE_SECONDS.time(type=CURRENT_WEATHER), span("parse", type=CURRENT_WEATHER):
+                current_weather_data = decode_current_weather(payload, CANONICAL_UNITS)
+            if history_store is not None:
+                history_store.record(CURRENT, payload, CANONICAL_UNITS, resp.content)
+    except RequestException as e:
+        logger.warning("%s: %s", get_full_class_name(e), e.args)
         current_weather_data = None
     except (IndexError, ValueError, TypeError, AttributeError) as e:
-        print(f"{get_full_class_name(e)}: {e.args}")
+        logger.warning("%s: %s", get_full_class_name(e), e.args)
         current_weather_data = None
 
     return current_weather_data
 
 
-def get_forcast(lat: float, lon: float) -> Forecast:
+def get_forcast(lat: float, lon: float, client: WeatherClient | None = None,
+                units: str | None = None) -> Forecast:
     """
     :param lat:      The latitude to get the forecast from.
     :param lon:      The longitude to get the forecast from.
+    :param client:   The pooled http client. Defaults to the shared client.
+    :param units:    The units of measure. Defaults to the UNITS_OF_MEASURE setting.
 
     :return:         ForecastData dataclass representing the forecast.
     """
+    units = units or units_of_measure
+    if lat is None or lon is None:
+        return forecast_in_units(fetch_forcast(lat, lon, client), units)
+    key = weather_cache.make_key(FORECAST, lat, lon, CANONICAL_UNITS)
+    return forecast_in_units(weather_cache.get_or_load(
+        key, lambda: fetch_flights.do(key, lambda: fetch_forcast(lat, lon, client))[0],
+        is_successful), units)
+
+
+def fetch_forcast(lat: float, lon: float, client: WeatherClient | None = None) -> Forecast:
+    """
+    :param lat:      The latitude to get the forecast from.
+    :param lon:      The longitude to get the forecast from.
+    :param client:   The pooled http client. Defaults to the shared client.
+
+    :return:         Forecast dataclass fetched from the openweather API in the canonical
+                     units.
+    """
     try:
         forecast_data: Forecast | None = Forecast()
-        resp: Response = requests.get(
-            f"{own_forecast_url}lat={lat}&lon={lon}&lang={language}&appid={api_key}"
-            f"&units={units_of_measure}", timeout=5)
-        print(f"get_forcast: {resp.status_code = }")
-        print(f"{resp.json() = }")
-        print(f"{type(resp.json()) = }")
-        if resp.status_code == 200 and resp.json():
-            forecast_data = Forecast.from_dict(resp.json(), units_of_measure)
-    except HTTPError as e:
-        print(f"{get_full_class_name(e)}: {e.read().decode()}")
+        client = client or get_default_client()
+        resp: Response = client.get(
+            f"{client.forecast_url}lat={lat}&lon={lon}&lang={language}&appid={api_key}"
+            f"&units={CANONICAL_UNITS}", FORECAST)
+        payload = decode_json(resp.content)
+        logger.debug("get_forcast: status_code=%s payload=%s", resp.status_code, payload,
+                     extra={"status_code": resp.status_code})
+        if resp.status_code == 200 and payload:
+            with PARSE_SECONDS.time(type=FORECAST), span("parse", type=FORECAST):
+                forecast_data = decode_forecast(payload, CANONICAL_UNITS, lazy_forecast)
+            if history_store is not None:
+                history_store.record(FORECAST, payload, CANONICAL_UNITS, resp.content)
+    except RequestException as e:
+        logger.warning("%s: %s", get_full_class_name(e), e.args)
         forecast_data = None
     except (IndexError, ValueError, TypeError, AttributeError) as e:
-        print(f"{get_full_class_name(e)}: {e.args}")
+        logger.warning("%s: %s", get_full_class_name(e), e.args)
         forecast_data = None
 
     return forecast_data
 
 
-def main(city_name: str, state_code: str, country_code: str) -> \
+def _timed(timings: Dict[str, float], stage: str, func, *args, **kwargs):
+    """
+    :param timings      :      The dictionary the elapsed time is stored in.
+    :param stage        :      The name of the stage being timed.
+    :param func         :      The function to time.
+
+    :return:                   The result of the function.
+    """
+    with stage_timer(timings, stage), span(stage):
+        return func(*args, **kwargs)
+
+
+def main(city_name: str, state_code: str, country_code: str,
+         client: WeatherClient | None = None, concurrent: bool | None = None,
+         timings: Dict[str, float] | None = None, units: str | None = None) -> \
         (tuple[Type[Location], Type[CurrentWeatherData], Type[Formats]] | tuple):
     """
     :param city_name:      The city name to get the latitude and longitude from.
     :param state_code:     The state code to get the latitude and longitude from.
     :param country_code:   The country code to get the latitude and longitude from.
+    :param client:         The pooled http client. Defaults to the shared client.
+    :param concurrent:     Fetch the current weather and forecast at the same time. Defaults to
+                           the OWM_CONCURRENT_FETCH setting.
+    :param timings:        Dictionary filled with the elapsed seconds of each stage.
+    :param units:          The units of measure. Defaults to the UNITS_OF_MEASURE setting.
 
     :return:               Tuple of the Location and the CurrentWeatherData dataclasses.
     """
-    formats_data: Formats = Formats.set_format_items(units_of_measure)
-    print(f"In main: {formats_data = }")
+    timings = {} if timings is None else timings
+    units = units or units_of_measure
+    # Identical lookups made at the same time share the result of the first one.
+    flight_key = (GeocodeCache.make_key(city_name, state_code, country_code), units)
+
+    def lead() -> tuple:
+        phases: Dict[str, float] = {}
+        return _main(city_name, state_code, country_code, client, concurrent, phases,
+                     units), phases
+    with stage_timer(timings, "total"):
+        (result, phases), shared = request_flights.do(flight_key, lead)
+        # The coalesced requests report the stages of the request they shared.
+        timings.update(phases)
+    if shared:
+        logger.debug("In main: coalesced with the in-flight request",
+                     extra={"flight_key": flight_key})
+    logger.info("In main: timings=%s coalesced=%s", timings, shared,
+                extra={"timings": timings, "coalesced": shared})
+    return result
+
+
+def _main(city_name: str, state_code: str, country_code: str, client: WeatherClient | None,
+          concurrent: bool | None, timings: Dict[str, float], units: str | None) -> tuple:
+    """
+    :param city_name:      The city name to get the latitude and longitude from.
+    :param state_code:     The state code to get the latitude and longitude from.
+    :param country_code:   The country code to get the latitude and longitude from.
+    :param client:         The pooled http client. Defaults to the shared client.
+    :param concurrent:     Fetch the current weather and forecast at the same time.
+    :param timings:        Dictionary filled with the elapsed seconds of each stage.
+    :param units:          The units of measure.
+
+    :return:               Tuple of the Location, CurrentWeatherData, Forecast and Formats.
+    """
+    concurrent = concurrent_fetch if concurrent is None else concurrent
+    formats_data: Formats = _timed(timings, "formats", Formats.for_units, units)
+    logger.debug("In main: formats_data=%s", formats_data)
+
+    location_data: Location = _timed(timings, "geocode", get_lan_lon, city_name,
+                                     state_code, country_code, client=client)
+    logger.debug("In main: location_data=%s", location_data)
 
-    location_data: Location = get_lan_lon(city_name, state_code, country_code)
-    print(f"In main: {location_data = }")
+    current_weather_data, forecast_data = _fetch_weather(location_data, client, concurrent,
+                                                         timings, units)
+    return location_data, current_weather_data, forecast_data, formats_data
 
-    current_weather_data: CurrentWeatherData = get_current_weather(location_data.lat,
-                                                                   location_data.lon)
-    print(f"In main: {current_weather_data = }")
 
-    forecast_data: Forecast = get_forcast(location_data.lat, location_data.lon)
-    print(f"In main: {forecast_data = }")
+def main_by_coords(lat: float, lon: float, client: WeatherClient | None = None,
+                   concurrent: bool | None = None, timings: Dict[str, float] | None = None,
+                   units: str | None = None) -> tuple:
+    """
+    :param lat:            The latitude to get the weather from, e.g. from a device's GPS.
+    :param lon:            The longitude to get the weather from.
+    :param client:         The pooled http client. Defaults to the shared client.
+    :param concurrent:     Fetch the current weather and forecast at the same time. Defaults to
+                           the OWM_CONCURRENT_FETCH setting.
+    :param timings:        Dictionary filled with the elapsed seconds of each stage.
+    :param units:          The units of measure. Defaults to the UNITS_OF_MEASURE setting.
 
+    :return:               Tuple of the Location, CurrentWeatherData, Forecast and Formats. The
+                           coordinates are snapped to the nearest known location within
+                           OWM_SNAP_RADIUS_KM so nearby requests share its cached weather.
+    """
+    timings = {} if timings is None else timings
+    concurrent = concurrent_fetch if concurrent is None else concurrent
+    units = units or units_of_measure
+    with stage_timer(timings, "total"):
+        formats_data: Formats = _timed(timings, "formats", Formats.for_units, units)
+        location_data: Location = _timed(timings, "snap", spatial_index.snap, lat, lon,
+                                         snap_radius_km) or Location(lat=lat, lon=lon)
+        logger.debug("In main_by_coords: location_data=%s", location_data)
+        current_weather_data, forecast_data = _fetch_weather(location_data, client, concurrent,
+                                                             timings, units)
+    logger.info("In main_by_coords: timings=%s", timings, extra={"timings": timings})
     return location_data, current_weather_data, forecast_data, formats_data
 
 
+def _fetch_weather(location_data: Location | None, client: WeatherClient | None, concurrent: bool,
+                   timings: Dict[str, float], units: str | None) -> tuple:
+    """
+    :param location_data:  The Location to get the weather from.
+    :param client:         The pooled http client. Defaults to the shared client.
+    :param concurrent:     Fetch the current weather and forecast at the same time.
+    :param timings:        Dictionary filled with the elapsed seconds of each stage.
+    :param units:          The units of measure.
+
+    :return:               Tuple of the CurrentWeatherData and Forecast, None and None when
+                           the location could not be looked up, e.g. the circuit is open.
+    """
+    if location_data is None:
+        return None, None
+    if concurrent:
+        # The current weather and forecast only depend on the location.
+        # propagate keeps the spans of the fetches under the span of the request.
+        current_future = _fetch_executor.submit(propagate(_timed), timings, "current_weather",
+                                                get_current_weather, location_data.lat,
+                                                location_data.lon, client=client, units=units)
+        forecast_future = _fetch_executor.submit(propagate(_timed), timings, "forecast",
+                                                 get_forcast, location_data.lat,
+                                                 location_data.lon, client=client, units=units)
+        current_weather_data: CurrentWeatherData = current_future.result()
+        forecast_data: Forecast = forecast_future.result()
+    else:
+        current_weather_data: CurrentWeatherData = _timed(timings, "current_weather",
+                                                          get_current_weather,
+                                                          location_data.lat,
+                                                          location_data.lon, client=client,
+                                                          units=units)
+        forecast_data: Forecast = _timed(timings, "forecast", get_forcast,
+                                         location_data.lat, location_data.lon,
+                                         client=client, units=units)
+    logger.debug("In main: current_weather_data=%s", current_weather_data)
+    logger.debug("In main: forecast_data=%s", forecast_data)
+
+    return current_weather_data, forecast_data
+
+
 if __name__ == '__main__':
+    configure_logging()
     main('Atlanta', 'GA', country_code='US')
     # main('Toronto', '', country_code='CA')
     # main('Dublin', '', country_code = 'IE')
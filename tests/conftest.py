@@ -0,0 +1,13 @@
+"""
+This python script configures the tests. The caches of the openweathermap modules are kept in a
+temporary directory instead of the .cache directory of the working tree, and no request is
+sent to the openweather API.
+"""
+import os
+import tempfile
+
+_cache_dir = tempfile.mkdtemp(prefix="owm-tests-")
+os.environ.update(OWM_GEO_CACHE_PATH=os.path.join(_cache_dir, "geocode.sqlite3"),
+                  OWM_WEATHER_CACHE_PATH=os.path.join(_cache_dir, "weather.sqlite3"),
+                  OWM_RATE_LIMIT_PATH=os.path.join(_cache_dir, "rate_limit.sqlite3"),
+                  OWM_BASE_URL="http://127.0.0.1:9", API_KEY="test")
@@ -0,0 +1,34 @@
+"""
+This python script tests that the json bodies of the API are reused while they are fresh,
+compressed or not.
+"""
+# pylint: disable=protected-access
+import api
+from openweathermap.datasets.location import Location
+
+
+def test_a_small_body_is_reused_for_a_compressed_request(monkeypatch):
+    encoded = []
+
+    def encode_json(value) -> bytes:
+        encoded.append(value)
+        return b"{}"
+
+    monkeypatch.setattr(api, "encode_json", encode_json)
+    for _ in range(3):
+        assert api._body("small", "gzip", Location(), "current", None, 60) == (b"{}", None)
+    assert len(encoded) == 1
+
+
+def test_a_large_body_is_compressed_and_reused(monkeypatch):
+    encoded = []
+
+    def encode_json(value) -> bytes:
+        encoded.append(value)
+        return b"[" + b"0," * api.MIN_COMPRESS_SIZE + b"0]"
+
+    monkeypatch.setattr(api, "encode_json", encode_json)
+    for _ in range(3):
+        _, encoding = api._body("large", "gzip", Location(), "current", None, 60)
+        assert encoding == "gzip"
+    assert len(encoded) == 1
@@ -0,0 +1,98 @@
+"""
+This python script tests that the binary encoding round-trips the weather dataclasses and
+rejects the bodies it can not read.
+"""
+import dataclasses
+import struct
+
+import pytest
+
+from benchmarks import load_payload
+from openweathermap.datasets.binary import MAGIC, VERSION, decode_binary, encode_binary
+from openweathermap.datasets.current_weather import CurrentWeatherData
+from openweathermap.datasets.decoders import decode_current_weather, decode_forecast
+from openweathermap.datasets.forecast import Forecast
+from openweathermap.datasets.units import UNITS
+
+CURRENT_PAYLOADS = ("current", "current_rain", "current_snow", "current_no_gust")
+FORECAST_PAYLOADS = ("forecast", "forecast_missing")
+
+
+@pytest.mark.parametrize("units", UNITS)
+@pytest.mark.parametrize("name", CURRENT_PAYLOADS)
+def test_current_weather_round_trip(name, units):
+    current = decode_current_weather(load_payload(name), units)
+    body = encode_binary(current)
+    assert decode_binary(body) == current
+    assert decode_binary(memoryview(body)) == current
+
+
+@pytest.mark.parametrize("lazy", (False, True))
+@pytest.mark.parametrize("units", UNITS)
+@pytest.mark.parametrize("name", FORECAST_PAYLOADS)
+def test_forecast_round_trip(name, units, lazy):
+    forecast = decode_forecast(load_payload(name), units, lazy)
+    body = encode_binary(forecast)
+    assert decode_binary(body) == forecast
+    assert decode_binary(body, lazy=True) == forecast
+    assert list(decode_binary(body, lazy=True).list_obj) == list(forecast.list_obj)
+
+
+@pytest.mark.parametrize("obj", (CurrentWeatherData(), Forecast(), Forecast(list_obj=[])),
+                         ids=("empty_current", "empty_forecast", "no_rows"))
+def test_empty_dataclasses_round_trip(obj):
+    assert decode_binary(encode_binary(obj)) == obj
+
+
+def test_optional_fields_round_trip():
+    current = decode_current_weather(load_payload("current_rain"), "metric")
+    current = dataclasses.replace(current, rain=None, snow=None, name=None,
+                                  wind=dataclasses.replace(current.wind, gust=None))
+    decoded = decode_binary(encode_binary(current))
+    assert decoded == current
+    assert decoded.rain is None and decoded.wind.gust is None and decoded.name is None
+
+
+def test_forecast_missing_fields_stay_none():
+    forecast = decode_forecast(load_payload("forecast_missing"), "standard")
+    decoded = decode_binary(encode_binary(forecast))
+    for row, decoded_row in zip(forecast.list_obj, decoded.list_obj):
+        assert [getattr(decoded_row, f.name) is None for f in dataclasses.fields(row)] == \
+               [getattr(row, f.name) is None for f in dataclasses.fields(row)]
+
+
+def test_header():
+    body = encode_binary(decode_current_weather(load_payload("current"), "standard"))
+    magic, version = struct.unpack_from("<4sB", body)
+    assert (magic, version) == (MAGIC, VERSION)
+
+
+def test_other_version_is_rejected():
+    body = bytearray(encode_binary(decode_current_weather(load_payload("current"), "standard")))
+    body[4] = VERSION + 1
+    with pytest.raises(ValueError, match="version"):
+        decode_binary(bytes(body))
+
+
+def test_other_magic_is_rejected():
+    body = encode_binary(decode_current_weather(load_payload("current"), "standard"))
+    with pytest.raises(ValueError):
+        decode_binary(b"JSON" + body[4:])
+
+
+def test_other_fields_are_rejected():
+    body = bytearray(encode_binary(decode_forecast(load_payload("forecast"), "standard")))
+    body[6] ^= 0xFF
+    with pytest.raises(ValueError, match="other fields"):
+        decode_binary(bytes(body))
+
+
+@pytest.mark.parametrize("name", ("current", "forecast"))
+def test_truncated_body_is_rejected(name):
+    payload = load_payload(name)
+    obj = (decode_forecast(payload, "standard") if name == "forecast"
+           else decode_current_weather(payload, "standard"))
+    body = encode_binary(obj)
+    for length in range(0, len(body), max(1, len(body) // 97)):
+        with pytest.raises(ValueError):
+            decode_binary(body[:length])
@@ -0,0 +1,27 @@
+"""
+This python script tests that a malformed location of a bulk lookup fails on its own instead of
+failing the whole batch.
+"""
+from openweathermap import weather
+from openweathermap.bulk import LocationQuery, fetch_many
+from openweathermap.datasets.current_weather import CurrentWeatherData
+from openweathermap.datasets.forecast import Forecast
+from openweathermap.datasets.location import Location
+
+
+def test_malformed_rows_fail_on_their_own(monkeypatch):
+    def main(city_name, state_code, country_code, **kwargs):  # pylint: disable=unused-argument
+        return (Location(name=city_name, lat=1.0, lon=2.0), CurrentWeatherData(cod=200),
+                Forecast(cod=200), None)
+
+    monkeypatch.setattr(weather, "main", main)
+    rows = [("Atlanta", "GA", "US"), None, ("Toronto", "", "CA", "extra"), 42,
+            LocationQuery("Dublin", "", "IE"), ("London",)]
+    results = list(fetch_many(rows, max_concurrency=2))
+    assert len(results) == len(rows)
+    assert sorted(result.query.city_name for result in results if result.ok) == [
+        "Atlanta", "Dublin", "London"]
+    failed = [result for result in results if not result.ok]
+    assert len(failed) == 3
+    assert all(result.query is None and "ValueError" in result.error for result in failed)
+
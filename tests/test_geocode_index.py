@@ -0,0 +1,107 @@
+"""
+This python script tests the offline geocoding index built from a small gzipped city list, and
+that get_lan_lon only calls the geocoding API for the cities missing from the index.
+"""
+import gzip
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from openweathermap import geocode_index, weather
+from openweathermap.geocode_index import GeocodeIndex, build_index, iter_city_list, normalize
+
+CITIES = [
+    {"id": 4180439, "name": "Atlanta", "state": "GA", "country": "US",
+     "coord": {"lon": -84.387978, "lat": 33.749001}},
+    {"id": 4250542, "name": "Springfield", "state": "IL", "country": "US",
+     "coord": {"lon": -89.643707, "lat": 39.801151}},
+    {"id": 4409896, "name": "Springfield", "state": "MO", "country": "US",
+     "coord": {"lon": -93.298241, "lat": 37.215328}},
+    {"id": 3448439, "name": "São Paulo", "state": "", "country": "BR",
+     "coord": {"lon": -46.636108, "lat": -23.547501}},
+    {"id": 2643743, "name": "London", "state": "", "country": "GB",
+     "coord": {"lon": -0.12574, "lat": 51.50853}},
+    {"id": 6058560, "name": "London", "state": "", "country": "CA",
+     "coord": {"lon": -81.23304, "lat": 42.983391}},
+    # Skipped by build_index, it has no coordinates.
+    {"id": 1, "name": "Nowhere", "state": "", "country": "US"},
+]
+
+
+@pytest.fixture(name="city_list")
+def fixture_city_list(tmp_path) -> str:
+    """
+    :return:       The path of the gzipped city list, formatted like city.list.json.gz.
+    """
+    path = str(tmp_path / "city.list.json.gz")
+    with gzip.open(path, "wt", encoding="utf-8") as city_file:
+        json.dump(CITIES, city_file, indent=2, ensure_ascii=False)
+    return path
+
+
+@pytest.fixture(name="index")
+def fixture_index(city_list, tmp_path) -> GeocodeIndex:
+    """
+    :return:       The GeocodeIndex built from the city list.
+    """
+    path = str(tmp_path / "cities.sqlite3")
+    assert build_index(iter_city_list(city_list), path) == len(CITIES) - 1
+    return GeocodeIndex(path)
+
+
+def test_normalize():
+    assert normalize("  São   Paulo ") == "sao paulo"
+    assert normalize(None) == ""
+
+
+def test_iter_city_list_reads_across_the_chunks(city_list, monkeypatch):
+    monkeypatch.setattr(geocode_index, "_CHUNK_SIZE", 7)
+    assert list(iter_city_list(city_list)) == CITIES
+
+
+def test_exact_lookup(index):
+    [location] = index.lookup("atlanta", "ga", "us")
+    assert (location.name, location.state, location.country) == ("Atlanta", "GA", "US")
+    assert (location.lat, location.lon) == (33.749001, -84.387978)
+    assert index.lookup("Sao Paulo", country_code="BR")[0].name == "São Paulo"
+
+
+def test_state_qualified_lookup(index):
+    assert index.lookup("Springfield", "MO", "US")[0].state == "MO"
+    assert index.lookup("Springfield", "IL", "US")[0].state == "IL"
+    # A city without a state matches any state.
+    assert index.lookup("London", "ON", "CA")[0].country == "CA"
+    assert [location.country for location in index.lookup("London", limit=5)] == ["GB", "CA"]
+
+
+def test_prefix_lookup(index):
+    assert [location.state for location in index.prefix("spring")] == ["IL", "MO"]
+    assert [location.state for location in index.prefix("Spring", "mo")] == ["MO"]
+    assert [location.country for location in index.prefix("lon", country_code="GB")] == ["GB"]
+    assert not index.prefix("xyz")
+
+
+def test_miss(index):
+    assert not index.lookup("Atlanta", "GA", "CA")
+    assert not index.lookup("Springfield", "TX", "US")
+    assert index.resolve("Atlantis", "", "GR") is None
+    assert index.resolve("Atlanta", "GA", "US") is not None
+    assert (index.hits, index.misses) == (1, 1)
+
+
+def test_get_lan_lon_falls_back_to_the_api(index, monkeypatch):
+    urls = []
+
+    def get(url, endpoint):  # pylint: disable=unused-argument
+        urls.append(url)
+        return SimpleNamespace(status_code=200, content=b"[]")
+
+    client = SimpleNamespace(geo_url="http://geo/?q=", get=get)
+    monkeypatch.setattr(weather, "geocode_index", index)
+    location = weather.get_lan_lon("Springfield", "MO", "US", client=client)
+    assert (location.name, location.state) == ("Springfield", "MO")
+    assert not urls
+    location = weather.get_lan_lon("Index Miss", "GA", "US", client=client)
+    assert location.lat is None
+    assert urls == ["http://geo/?q=Index Miss,GA,US&limit=1&appid=test"]
@@ -0,0 +1,106 @@
+"""
+This python script tests that the priority of a call reaches the rate limiter, also when the
+request is sent from the hedge pool or the fetch executor.
+"""
+import asyncio
+import threading
+import time
+from typing import List
+
+import pytest
+import requests
+
+from openweathermap import weather
+from openweathermap.datasets.location import Location
+from openweathermap.rate_limit import (ALL_ENDPOINTS, BACKGROUND, INTERACTIVE, Bucket,
+                                       RateLimitedError, RateLimiter, current_priority, priority)
+from openweathermap.resilience import Resilience
+
+
+class RecordingLimiter(RateLimiter):
+    """Class representing a rate limiter recording the priority of each call"""
+
+    def __init__(self, path: str, calls: float = 1000, reserve: float = 0.2):
+        super().__init__(path, {ALL_ENDPOINTS: [Bucket.per_minute(ALL_ENDPOINTS, calls)]},
+                         reserve=reserve, block=False)
+        self.priorities: List[str] = []
+        self.threads: List[str] = []
+
+    def acquire(self, endpoint: str, block=None) -> float:
+        self.priorities.append(current_priority())
+        self.threads.append(threading.current_thread().name)
+        return super().acquire(endpoint, block)
+
+
+def test_background_priority_reaches_the_limiter_through_the_hedge_pool(tmp_path):
+    limiter = RecordingLimiter(str(tmp_path / "rate_limit.sqlite3"))
+    resilience = Resilience(attempts=1, hedge_percentile=50, hedge_min_delay=0.01,
+                            hedge_workers=2)
+    for _ in range(60):
+        resilience._window("current_weather").add(0.01)  # pylint: disable=protected-access
+
+    def request() -> int:
+        limiter.acquire("current_weather")
+        if len(limiter.priorities) == 1:
+            # The first request is slow and fails, so the hedge answers.
+            time.sleep(0.2)
+            raise requests.ConnectionError("timed out")
+        return 200
+
+    with priority(BACKGROUND):
+        assert resilience.call("current_weather", request, lambda status: status) == 200
+    assert limiter.priorities == [BACKGROUND, BACKGROUND]
+    assert limiter.threads[1].startswith("owm-hedge")
+
+
+def test_background_priority_reaches_the_fetch_executor(monkeypatch, tmp_path):
+    limiter = RecordingLimiter(str(tmp_path / "rate_limit.sqlite3"))
+    threads = []
+
+    def fetch(lat, lon, client=None, units=None):  # pylint: disable=unused-argument
+        threads.append(threading.current_thread().name)
+        limiter.acquire("current_weather")
+
+    monkeypatch.setattr(weather, "get_current_weather", fetch)
+    monkeypatch.setattr(weather, "get_forcast", fetch)
+    with priority(BACKGROUND):
+        weather._fetch_weather(Location(lat=1.0, lon=2.0), None,  # pylint: disable=protected-access
+                               True, {}, "standard")
+    assert limiter.priorities == [BACKGROUND, BACKGROUND]
+    assert threading.current_thread().name not in threads
+
+
+def test_interactive_is_the_default_priority(tmp_path):
+    limiter = RecordingLimiter(str(tmp_path / "rate_limit.sqlite3"))
+    limiter.acquire("geocode")
+    assert limiter.priorities == [INTERACTIVE]
+
+
+def test_acquire_async_keeps_the_priority(tmp_path):
+    # One token: the background call must leave it to the interactive calls.
+    limiter = RateLimiter(str(tmp_path / "rate_limit.sqlite3"),
+                          {ALL_ENDPOINTS: [Bucket.per_minute(ALL_ENDPOINTS, 5)]}, reserve=0.5,
+                          block=False)
+
+    async def background() -> None:
+        with priority(BACKGROUND):
+            for _ in range(5):
+                await limiter.acquire_async("geocode")
+
+    with pytest.raises(RateLimitedError):
+        asyncio.run(background())
+    asyncio.run(limiter.acquire_async("geocode"))
+
+
+def test_background_gets_the_last_token_of_a_small_bucket(tmp_path):
+    limiter = RateLimiter(str(tmp_path / "rate_limit.sqlite3"),
+                          {ALL_ENDPOINTS: [Bucket.per_minute(ALL_ENDPOINTS, 1)]}, reserve=0.5,
+                          block=False)
+    with priority(BACKGROUND):
+        limiter.acquire("geocode")
+
+
+def test_reserve_out_of_range_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        RateLimiter(str(tmp_path / "rate_limit.sqlite3"),
+                    {ALL_ENDPOINTS: [Bucket.per_minute(ALL_ENDPOINTS, 5)]}, reserve=1.0)
@@ -0,0 +1,66 @@
+"""
+This python script tests that a hedged call of the blocking client returns the first successful
+response.
+"""
+import threading
+import time
+
+import pytest
+import requests
+
+from openweathermap.resilience import Resilience
+
+
+def hedged_resilience() -> Resilience:
+    """
+    :return:       Resilience hedging every request slower than 10ms.
+    """
+    resilience = Resilience(attempts=1, hedge_percentile=50, hedge_min_delay=0.01,
+                            hedge_workers=2)
+    for _ in range(60):
+        resilience._window("current_weather").add(0.01)  # pylint: disable=protected-access
+    return resilience
+
+
+def test_the_faster_hedge_answers_a_slow_request():
+    resilience = hedged_resilience()
+    calls = []
+    lock = threading.Lock()
+
+    def request() -> str:
+        with lock:
+            calls.append(None)
+            first = len(calls) == 1
+        if first:
+            time.sleep(0.5)
+            return "slow"
+        return "fast"
+
+    start = time.perf_counter()
+    assert resilience.call("current_weather", request, lambda resp: 200) == "fast"
+    assert time.perf_counter() - start < 0.4
+    assert len(calls) == 2
+
+
+def test_a_fast_request_is_not_hedged():
+    resilience = hedged_resilience()
+    calls = []
+
+    def request() -> str:
+        calls.append(None)
+        return "fast"
+
+    assert resilience.call("current_weather", request, lambda resp: 200) == "fast"
+    time.sleep(0.05)
+    assert len(calls) == 1
+
+
+def test_the_error_is_raised_when_both_requests_fail():
+    resilience = hedged_resilience()
+
+    def request() -> str:
+        time.sleep(0.05)
+        raise requests.ConnectionError("timed out")
+
+    with pytest.raises(requests.ConnectionError):
+        resilience.call("current_weather", request, lambda resp: 200)
@@ -0,0 +1,80 @@
+"""
+This python script tests that the weather of a lookup degrades to the empty result, instead of
+failing the page, while the circuit of the geocoding endpoint is open, and that the coalesced
+lookups report the stages of the lookup they shared.
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app import app
+from openweathermap import async_weather, weather
+from openweathermap.resilience import get_default_resilience
+
+
+@pytest.fixture
+def open_geocode_circuit():
+    """
+    :return:       The circuit breaker of the geocoding endpoint, opened for the test.
+    """
+    breaker = get_default_resilience().breaker(weather.GEOCODE)
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    yield breaker
+    breaker.record_success()
+
+
+@pytest.mark.usefixtures("open_geocode_circuit")
+def test_main_returns_the_empty_result():
+    location, current, forecast, formats = weather.main("Open Circuit", "GA", "US")
+    assert (location, current, forecast) == (None, None, None)
+    assert formats is not None
+
+
+@pytest.mark.usefixtures("open_geocode_circuit")
+def test_main_async_returns_the_empty_result():
+    location, current, forecast, formats = asyncio.run(
+        async_weather.main("Open Circuit Async", "GA", "US"))
+    assert (location, current, forecast) == (None, None, None)
+    assert formats is not None
+
+
+@pytest.mark.usefixtures("open_geocode_circuit")
+@pytest.mark.parametrize("path", ["/", "/async"])
+def test_home_renders_while_the_circuit_is_open(path):
+    response = app.test_client().post(path, data={"cityName": "Open Circuit Page",
+                                                  "stateName": "GA", "countryName": "US"})
+    assert response.status_code == 200
+
+
+def test_coalesced_requests_report_the_stages(monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_main(city_name, state_code, country_code, client, concurrent, timings, units):
+        # pylint: disable=unused-argument,too-many-arguments
+        timings["geocode"] = 0.25
+        started.set()
+        release.wait(5)
+        return None, None, None, None
+
+    monkeypatch.setattr(weather, "_main", slow_main)
+    timings = [{}, {}]
+    coalesced = weather.request_flights.stats()["coalesced"]
+    leader = threading.Thread(target=weather.main, args=("Coalesced", "GA", "US"),
+                              kwargs={"timings": timings[0]})
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=weather.main, args=("Coalesced", "GA", "US"),
+                                kwargs={"timings": timings[1]})
+    follower.start()
+    while weather.request_flights.stats()["coalesced"] == coalesced:
+        time.sleep(0.01)
+    release.set()
+    leader.join()
+    follower.join()
+    for stages in timings:
+        assert stages["geocode"] == 0.25
+        assert list(stages)[-1] == "total"
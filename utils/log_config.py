@@ -0,0 +1,49 @@
+"""
+This python script is to configure the logging as text or as one json object per line.
+"""
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+# The attributes every LogRecord has. Anything else was passed with extra= and is logged as a
+# field of the json object.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Class representing a formatter writing each record as one json object"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        :param record      :      The log record.
+
+        :return:                  The record as a json object.
+        """
+        entry = {"time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+                 "level": record.levelname,
+                 "logger": record.name,
+                 "message": record.getMessage()}
+        entry.update({key: value for key, value in vars(record).items()
+                      if key not in _RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str | None = None, log_format: str | None = None) -> None:
+    """
+    :param level           :      The log level. Defaults to the OWM_LOG_LEVEL setting.
+    :param log_format      :      text or json. Defaults to the OWM_LOG_FORMAT setting.
+    """
+    level = (level or os.getenv("OWM_LOG_LEVEL", "WARNING")).upper()
+    log_format = (log_format or os.getenv("OWM_LOG_FORMAT", "text")).lower()
+    handler = logging.StreamHandler()
+    if log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    if not root.handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
@@ -19,3 +19,57 @@ def visibility_in_miles(visibility: float) -> float:
     :return:          round(visibility_in_km(visibility) * 0.621371)
     """
     return round(visibility_in_km(visibility) * 0.621371, 2)
+
+
+def temperature_in_units(temperature, from_units: str, to_units: str):
+    """
+    :param temperature:     temperature as a number or a numpy array.
+    :param from_units:      units of measure of the temperature (standard, metric or imperial).
+    :param to_units:        units of measure to convert to (standard, metric or imperial).
+
+    :return:          temperature in to_units
+    """
+    if from_units == to_units:
+        return temperature
+    if from_units == "metric":
+        kelvin = temperature + 273.15
+    elif from_units == "imperial":
+        kelvin = (temperature - 32) * 5 / 9 + 273.15
+    else:
+        kelvin = temperature
+    if to_units == "metric":
+        return kelvin - 273.15
+    if to_units == "imperial":
+        return (kelvin - 273.15) * 9 / 5 + 32
+    return kelvin
+
+
+def wind_speed_in_units(speed, from_units: str, to_units: str):
+    """
+    :param speed:           wind speed as a number or a numpy array.
+    :param from_units:      units of measure of the speed (meters/sec unless imperial).
+    :param to_units:        units of measure to convert to (meters/sec unless imperial).
+
+    :return:          wind speed in to_units
+    """
+    if (from_units == "imperial") == (to_units == "imperial"):
+        return speed
+    if to_units == "imperial":
+        return speed * 2.236936
+    return speed / 2.236936
+
+
+def visibility_in_units(visibility, from_units: str, to_units: str):
+    """
+    :param visibility:      visibility as a number or a numpy array, in miles when imperial and
+                            in km otherwise.
+    :param from_units:      units of measure of the visibility.
+    :param to_units:        units of measure to convert to.
+
+    :return:          visibility in to_units
+    """
+    if (from_units == "imperial") == (to_units == "imperial"):
+        return visibility
+    if to_units == "imperial":
+        return visibility * 0.621371
+    return visibility / 0.621371
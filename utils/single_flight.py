@@ -0,0 +1,124 @@
+"""
+This python script is to coalesce identical concurrent calls into one in-flight call. Blocking
+and async callers of the same key share the same call.
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+
+class _Call:
+    """Class representing one in-flight call and its outcome"""
+    __slots__ = ("event", "result", "error", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        # Called once the call is done, to wake up the async callers.
+        self.waiters: List[Callable[[], None]] = []
+
+
+def _wake(done: asyncio.Future) -> None:
+    """
+    :param done      :      The future an async caller is waiting on.
+    """
+    if not done.done():
+        done.set_result(None)
+
+
+class SingleFlight:
+    """Class representing a group of calls where only one call per key runs at a time"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        :param key       :      The key identifying identical calls.
+        :param func      :      The function to call when no call for the key is in flight.
+
+        :return:                Tuple of the result and whether it was shared from a call that
+                                was already in flight.
+        """
+        call, leader = self._join(key)
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(key, call)
+        return call.result, False
+
+    async def do_async(self, key: Hashable, func: Callable[[], Awaitable]) -> Tuple[Any, bool]:
+        """
+        :param key       :      The key identifying identical calls.
+        :param func      :      The function returning the awaitable to await when no call for
+                                the key is in flight.
+
+        :return:                Tuple of the result and whether it was shared from a call that
+                                was already in flight. The event loop is not blocked while
+                                waiting for the call of another caller.
+        """
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+        call, leader = self._join(key, lambda: loop.call_soon_threadsafe(_wake, done))
+        if not leader:
+            await done
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = await func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(key, call)
+        return call.result, False
+
+    def _join(self, key: Hashable, waiter: Callable[[], None] | None = None) -> Tuple[_Call, bool]:
+        """
+        :param key         :      The key identifying identical calls.
+        :param waiter      :      Called once the in-flight call is done, when there is one.
+
+        :return:                  Tuple of the call of the key and whether the caller leads it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self.calls += 1
+                return call, True
+            self.coalesced += 1
+            if waiter is not None:
+                call.waiters.append(waiter)
+            return call, False
+
+    def _finish(self, key: Hashable, call: _Call) -> None:
+        """
+        :param key       :      The key identifying identical calls.
+        :param call      :      The call that is done.
+        """
+        with self._lock:
+            del self._calls[key]
+        call.event.set()
+        for waiter in call.waiters:
+            waiter()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return:       The number of calls made and the number of callers that were coalesced.
+        """
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._calls)}
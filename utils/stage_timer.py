@@ -0,0 +1,23 @@
+"""
+This python script is to time the different stages of a request.
+"""
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+
+@contextmanager
+def stage_timer(timings: Dict[str, float] | None, stage: str) -> Iterator[None]:
+    """
+    :param timings      :      The dictionary the elapsed time is stored in. Nothing is stored
+                               when it is None.
+    :param stage        :      The name of the stage being timed.
+
+    :return:                   Iterator used by the with statement.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = time.perf_counter() - start
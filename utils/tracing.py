@@ -0,0 +1,373 @@
+"""
+This python script is to trace where the time of a request goes. A traced request records a tree
+of spans, each with its start and end time and attributes such as the cache result or the
+payload size, and the finished trace is exported as one json object. A request can also be
+profiled with cProfile. When the request is neither traced nor profiled a span is a shared
+no-op object, so the instrumented code costs one context variable lookup.
+
+    python -m utils.tracing .cache/traces.jsonl > trace.json
+
+converts the exported traces to the Chrome trace event format, opened by chrome://tracing and
+https://ui.perfetto.dev.
+"""
+import cProfile
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from utils.get_class_name import get_full_class_name
+
+logger = logging.getLogger(__name__)
+
+# The span the current code runs in, None when the request is not traced.
+_current: ContextVar[Optional['Span']] = ContextVar("owm_span", default=None)
+
+
+@dataclass(slots=True, eq=False)
+class Span:
+    """Class representing one timed operation of a traced request"""
+    name: str = field(default=None)
+    trace: 'Trace' = field(default=None, repr=False)
+    parent: Optional['Span'] = field(default=None, repr=False)
+    start: float = field(default=None)
+    end: float = field(default=None)
+    thread: int = field(default=None)
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    # The token resetting the current span when the span ends.
+    token: Any = field(default=None, repr=False)
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        :param key        :      The name of the attribute.
+        :param value      :      The value of the attribute.
+        """
+        self.attributes[key] = value
+
+    def __enter__(self) -> 'Span':
+        self.start = time.time()
+        self.thread = threading.get_ident()
+        self.trace.spans.append(self)
+        self.token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.end = time.time()
+        if exc_type is not None:
+            self.attributes["error"] = get_full_class_name(exc)
+        _current.reset(self.token)
+
+
+class _NoopSpan:
+    """Class representing the span of a request that is not traced"""
+    __slots__ = ()
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        :param key        :      The name of the attribute.
+        :param value      :      The value of the attribute.
+        """
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        return None
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """Class representing the spans recorded for one request"""
+
+    def __init__(self, name: str, **attributes):
+        """
+        :param name            :      The name of the root span, e.g. the route.
+        :param attributes      :      The attributes of the root span.
+        """
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self.root = Span(name, self, None, attributes=dict(attributes))
+
+    def _node(self, span: Span, children: Dict[int, List[Span]]) -> Dict[str, Any]:
+        """
+        :param span          :      The span.
+        :param children      :      The child spans by the id of their parent.
+
+        :return:                    The span and its children as a json object.
+        """
+        end = span.end if span.end is not None else time.time()
+        return {"name": span.name,
+                "start": span.start,
+                "offset_ms": round((span.start - self.root.start) * 1000, 3),
+                "duration_ms": round((end - span.start) * 1000, 3),
+                "thread": span.thread,
+                "attributes": span.attributes,
+                "children": [self._node(child, children)
+                             for child in children.get(id(span), ())]}
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        :return:       The trace as a json object, the spans nested under their parent.
+        """
+        children: Dict[int, List[Span]] = {}
+        for span in sorted(self.spans, key=lambda s: s.start):
+            if span.parent is not None:
+                children.setdefault(id(span.parent), []).append(span)
+        return {"trace_id": self.trace_id, "pid": os.getpid(),
+                "root": self._node(self.root, children)}
+
+
+def to_chrome_events(trace: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    :param trace      :      A trace as exported by Trace.to_dict.
+
+    :return:                 The complete events of the Chrome trace event format, one per span.
+    """
+    events = []
+    nodes = [trace["root"]]
+    while nodes:
+        node = nodes.pop()
+        events.append({"name": node["name"], "ph": "X", "ts": round(node["start"] * 1e6),
+                       "dur": round(node["duration_ms"] * 1000), "pid": trace["pid"],
+                       "tid": node["thread"],
+                       "args": dict(node["attributes"], trace_id=trace["trace_id"])})
+        nodes.extend(node["children"])
+    return events
+
+
+def span(name: str, **attributes) -> Span | _NoopSpan:
+    """
+    :param name            :      The name of the operation.
+    :param attributes      :      The attributes of the span.
+
+    :return:                      The child Span of the current span used by the with statement,
+                                  or the no-op span when the request is not traced.
+    """
+    parent = _current.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(name, parent.trace, parent, attributes=attributes)
+
+
+def current_span() -> Span | _NoopSpan:
+    """
+    :return:       The span the code runs in, or the no-op span when the request is not traced.
+    """
+    return _current.get() or NOOP_SPAN
+
+
+def propagate(func: Callable) -> Callable:
+    """
+    :param func      :      The function to run on another thread.
+
+    :return:                The function running in a copy of the current context, so the
+                            thread sees the context variables of the caller, e.g. the span and
+                            the rate limiter priority.
+    """
+    context = copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+    return run
+
+
+def propagate_async(coro: Awaitable) -> Awaitable:
+    """
+    :param coro      :      The coroutine to run on another event loop.
+
+    :return:                The coroutine running under the current span. The coroutine itself
+                            when the request is not traced.
+    """
+    parent = _current.get()
+    if parent is None:
+        return coro
+    return _under(parent, coro)
+
+
+async def _under(parent: Span, coro: Awaitable) -> Any:
+    """
+    :param parent      :      The span the coroutine runs under.
+    :param coro        :      The coroutine.
+
+    :return:                  The result of the coroutine. The task running it has its own
+                              context, so the span is not reset.
+    """
+    _current.set(parent)
+    return await coro
+
+
+class Tracer:
+    """Class representing which requests are traced or profiled and where the results go"""
+
+    def __init__(self, sample_rate: float = 0.0, export: str = "log",
+                 path: str = ".cache/traces.jsonl", profile_rate: float = 0.0,
+                 profile_dir: str = ".cache/profiles", allow_headers: bool = False,
+                 keep: int = 100):
+        """
+        :param sample_rate        :      The fraction of the requests traced.
+        :param export             :      log writes each trace to the log, file appends it to
+                                         path as one json object per line and none only keeps it
+                                         in recent.
+        :param path               :      The json lines file of the file export.
+        :param profile_rate       :      The fraction of the requests profiled with cProfile.
+        :param profile_dir        :      The directory the pstats files are written to.
+        :param allow_headers      :      Trace or profile a request when it asks to with the
+                                         X-OWM-Trace or X-OWM-Profile header.
+        :param keep               :      The number of recent traces kept in memory.
+        """
+        self.sample_rate = sample_rate
+        self.export = export
+        self.path = path
+        self.profile_rate = profile_rate
+        self.profile_dir = profile_dir
+        self.allow_headers = allow_headers
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def from_env() -> 'Tracer':
+        """
+        :return:       Tracer configured from the environment.
+        """
+        load_dotenv()
+        return Tracer(sample_rate=float(os.getenv("OWM_TRACE_SAMPLE_RATE", "0")),
+                      export=os.getenv("OWM_TRACE_EXPORT", "log").lower(),
+                      path=os.getenv("OWM_TRACE_PATH", ".cache/traces.jsonl"),
+                      profile_rate=float(os.getenv("OWM_PROFILE_SAMPLE_RATE", "0")),
+                      profile_dir=os.getenv("OWM_PROFILE_DIR", ".cache/profiles"),
+                      allow_headers=os.getenv("OWM_TRACE_HEADERS", "false").lower() == "true")
+
+    def start(self, name: str, trace: bool = False, profile: bool = False,
+              **attributes) -> 'TraceContext | _NoopSpan':
+        """
+        :param name            :      The name of the request, e.g. the route.
+        :param trace           :      Trace the request whatever the sample rate.
+        :param profile         :      Profile the request whatever the sample rate.
+        :param attributes      :      The attributes of the root span.
+
+        :return:                      The TraceContext of the request used by the with
+                                      statement, or the no-op span when the request is neither
+                                      traced nor profiled.
+        """
+        trace = trace or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        profile = profile or (self.profile_rate > 0 and random.random() < self.profile_rate)
+        if not (trace or profile) or _current.get() is not None:
+            return NOOP_SPAN
+        return TraceContext(self, Trace(name, **attributes), profile)
+
+    def finish(self, trace: Trace) -> None:
+        """
+        :param trace      :      The finished trace to export.
+        """
+        exported = trace.to_dict()
+        self.recent.append(exported)
+        try:
+            if self.export == "log":
+                logger.info("trace %s %s %.1fms", trace.root.name, trace.trace_id,
+                            exported["root"]["duration_ms"], extra={"trace": exported})
+            elif self.export == "file":
+                line = json.dumps(exported, default=str) + "\n"
+                with self._lock:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    with open(self.path, "a", encoding="utf-8") as file:
+                        file.write(line)
+        except OSError as e:
+            logger.warning("%s: %s", get_full_class_name(e), e.args)
+
+    def dump_profile(self, trace: Trace, profiler: cProfile.Profile) -> None:
+        """
+        :param trace         :      The trace of the profiled request.
+        :param profiler      :      The profiler of the request.
+        """
+        path = os.path.join(self.profile_dir, f"{trace.trace_id}.prof")
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(path)
+            trace.root.set("profile", path)
+        except OSError as e:
+            logger.warning("%s: %s", get_full_class_name(e), e.args)
+
+
+class TraceContext:
+    """Class representing the root span of a traced request and its optional profiler"""
+
+    def __init__(self, tracer: Tracer, trace: Trace, profile: bool):
+        """
+        :param tracer       :      The Tracer exporting the trace.
+        :param trace        :      The Trace of the request.
+        :param profile      :      Profile the request with cProfile.
+        """
+        self.tracer = tracer
+        self.trace = trace
+        self.profiler: cProfile.Profile | None = cProfile.Profile() if profile else None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        :param key        :      The name of the attribute of the root span.
+        :param value      :      The value of the attribute.
+        """
+        self.trace.root.set(key, value)
+
+    def __enter__(self) -> 'TraceContext':
+        self.trace.root.__enter__()
+        if self.profiler is not None:
+            # Only the calls made on this thread are profiled, the fetches running on the
+            # worker threads show up as the time spent waiting for them.
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Another profiler is already running on this thread.
+                self.profiler = None
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.tracer.dump_profile(self.trace, self.profiler)
+        self.trace.root.__exit__(exc_type, exc, traceback)
+        self.tracer.finish(self.trace)
+
+
+_default_tracer: Tracer | None = None
+_default_tracer_lock = threading.Lock()
+
+
+def get_default_tracer() -> Tracer:
+    """
+    :return:       The process wide Tracer.
+    """
+    global _default_tracer  # pylint: disable=global-statement
+    if _default_tracer is None:
+        with _default_tracer_lock:
+            if _default_tracer is None:
+                _default_tracer = Tracer.from_env()
+    return _default_tracer
+
+
+def main(argv: list[str] | None = None) -> None:
+    """
+    :param argv      :      The json lines files of the exported traces. Writes the traces in
+                            the Chrome trace event format to stdout.
+    """
+    events = []
+    for path in (argv if argv is not None else sys.argv[1:]):
+        with open(path, encoding="utf-8") as file:
+            events.extend(event for line in file if line.strip()
+                          for event in to_chrome_events(json.loads(line)))
+    json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()